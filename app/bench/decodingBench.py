@@ -0,0 +1,82 @@
+"""Micro-benchmarks for decoding MyTurn responses, run with python -m app.bench.decodingBench"""
+import argparse
+import functools
+import operator
+import timeit
+from datetime import date, datetime, timedelta
+from typing import Callable, List
+
+import pytz
+
+from ..src.myTurnCA import Location, LocationAvailabilitySlots, _parse_slots, _parse_availability, \
+    _merge_appointments
+
+LOCATION = Location(location_id='a3Ef0000000AAAA', name='Bench Location', booking_type='Public',
+                    vaccine_data='VACCINE_DATA', distance=1000, address='1 Main St, Sacramento CA 95814')
+# slots are dated tomorrow so none of them get filtered out as already occurred
+START_DATE = datetime.now(tz=pytz.timezone('US/Pacific')).date() + timedelta(days=1)
+
+
+def slots_payload(size: int) -> dict:
+    """Builds a slotsWithAvailability response with the given number of slots"""
+    return {'slotsWithAvailability': [{'localStartTime': f'{(i // 60) % 24}:{i % 60:02d}:00', 'durationSeconds': 300}
+                                      for i in range(size)]}
+
+
+def availability_payload(size: int) -> dict:
+    """Builds an availability response covering the given number of days"""
+    return {'availability': [{'date': (START_DATE + timedelta(days=i)).strftime('%Y-%m-%d'), 'available': i % 2 == 0}
+                             for i in range(size)]}
+
+
+def legacy_parse_slots(start_date: date, response_json: dict) -> List[datetime]:
+    """The slot decoding MyTurnCA used before the fast path, kept as the baseline"""
+    def combine(timestamp: str) -> datetime:
+        return datetime.combine(start_date, datetime.strptime(timestamp, '%H:%M:%S').time(),
+                                tzinfo=pytz.timezone('US/Pacific'))
+
+    return [combine(x['localStartTime']) for x in response_json['slotsWithAvailability']
+            if combine(x['localStartTime']) > datetime.now(tz=pytz.timezone('US/Pacific'))]
+
+
+def legacy_merge(location_slots: List[List[datetime]]) -> List[datetime]:
+    """The slot merging MyTurnCA used before the fast path, kept as the baseline"""
+    return functools.reduce(operator.add, location_slots)
+
+
+def bench(name: str, func: Callable, number: int) -> float:
+    """Runs func number times and prints the best average time per call out of 3 runs"""
+    best = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f'{name:<40} {best * 1000:>10.3f} ms')
+    return best
+
+
+def main():
+    """Runs every benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--slots', type=int, default=5000, help='number of slots per slots payload')
+    parser.add_argument('--days', type=int, default=365, help='number of days per availability payload')
+    parser.add_argument('--number', type=int, default=20, help='number of calls per timing run')
+    args = parser.parse_args()
+
+    slots = slots_payload(args.slots)
+    assert LocationAvailabilitySlots(location=LOCATION, slots=legacy_parse_slots(START_DATE, slots)) \
+        == _parse_slots(LOCATION, START_DATE, slots)
+    legacy = bench('legacy slot parsing', lambda: legacy_parse_slots(START_DATE, slots), args.number)
+    fast = bench('slot parsing', lambda: _parse_slots(LOCATION, START_DATE, slots), args.number)
+    print(f'{"speedup":<40} {legacy / fast:>10.1f}x')
+
+    availability = availability_payload(args.days)
+    bench('availability parsing', lambda: _parse_availability(LOCATION, availability), args.number)
+
+    # one small slot list per day, which is where repeated list concatenation hurts the most
+    day_slots = [datetime.combine(START_DATE, datetime.min.time(), tzinfo=pytz.timezone('US/Pacific'))] * 10
+    per_day = [LocationAvailabilitySlots(location=LOCATION, slots=day_slots) for _ in range(args.days * 10)]
+    location_dates = [(0, LOCATION, START_DATE)] * len(per_day)
+    legacy = bench('legacy slot merging', lambda: legacy_merge([day_slots] * len(per_day)), args.number)
+    fast = bench('slot merging', lambda: _merge_appointments(location_dates, per_day), args.number)
+    print(f'{"speedup":<40} {legacy / fast:>10.1f}x')
+
+
+if __name__ == '__main__':
+    main()
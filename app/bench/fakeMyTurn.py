@@ -0,0 +1,140 @@
+"""Local fake of the MyTurn API for load tests"""
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ..src.rateLimiter import endpoint_name
+
+SLOTS_PATH = re.compile(r'^/public/locations/(?P<location_id>[^/]+)/date/(?P<date>[^/]+)/slots$')
+AVAILABILITY_PATH = re.compile(r'^/public/locations/(?P<location_id>[^/]+)/availability$')
+
+
+class FakeMyTurnConfig:
+    """Class to describe what the fake server returns"""
+    def __init__(self, locations: int = 20, available_ratio: float = 0.5, slots_per_day: int = 50,
+                 latency: float = 0.0, error_rate: float = 0.0, throttle_rate: float = 0.0, seed: int = 0):
+        self.locations = locations
+        self.available_ratio = available_ratio
+        self.slots_per_day = slots_per_day
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.seed = seed
+
+
+class FakeMyTurnServer:
+    """Threaded HTTP server imitating the MyTurn endpoints MyTurnCA uses, use as a context manager. Responses are
+    deterministic for a given config apart from the injected latency, errors and 429s"""
+    def __init__(self, config: FakeMyTurnConfig, host: str = '127.0.0.1', port: int = 0):
+        self.config = config
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self.random = random.Random(config.seed)
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-myturn', daemon=True)
+
+    @property
+    def url(self) -> str:
+        """Base url to pass to MyTurnCA"""
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/public/'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request_counts(self) -> dict:
+        """Returns endpoint -> number of requests received, including the ones that got injected failures"""
+        with self.lock:
+            return dict(self.requests)
+
+    def respond(self, path: str, body: dict):
+        """Returns (status, headers, response body) for a request"""
+        with self.lock:
+            self.requests[endpoint_name(path[len('/public/'):])] += 1
+            roll = self.random.random()
+
+        if self.config.latency:
+            time.sleep(self.config.latency)
+        if roll < self.config.error_rate:
+            return 500, {}, {'error': 'injected error'}
+        if roll < self.config.error_rate + self.config.throttle_rate:
+            return 429, {'Retry-After': '0'}, {'error': 'injected throttle'}
+
+        if path == '/public/eligibility':
+            return 200, {}, {'eligible': True, 'vaccineData': 'FAKE_VACCINE_DATA'}
+        if path == '/public/locations/search':
+            return 200, {}, self.locations(body)
+
+        match = AVAILABILITY_PATH.match(path)
+        if match:
+            return 200, {}, self.availability(match['location_id'], body)
+
+        match = SLOTS_PATH.match(path)
+        if match:
+            return 200, {}, self.slots()
+
+        return 404, {}, {'error': f'unknown path {path}'}
+
+    def locations(self, body: dict) -> dict:
+        """Builds a locations/search response around the searched coordinates"""
+        latitude, longitude = body['location']['lat'], body['location']['lng']
+        return {'locations': [{
+            'extId': f'fake-location-{i}',
+            'name': f'Fake Location {i}',
+            'displayAddress': f'{i} Fake St, Sacramento CA 95814',
+            'type': 'OpenScheduling',
+            'vaccineData': 'FAKE_VACCINE_DATA',
+            'distanceInMeters': 100.0 * i,
+            'location': {'lat': latitude + i * 0.001, 'lng': longitude}
+        } for i in range(self.config.locations)]}
+
+    def availability(self, location_id: str, body: dict) -> dict:
+        """Builds an availability response, whether a location is available on a day never changes"""
+        start_date = date.fromisoformat(body['startDate'])
+        days = (date.fromisoformat(body['endDate']) - start_date).days + 1
+        dates = [start_date + timedelta(days=i) for i in range(days)]
+        return {'availability': [{
+            'date': day.isoformat(),
+            'available': random.Random(f'{self.config.seed}{location_id}{day}').random() < self.config.available_ratio
+        } for day in dates]}
+
+    def slots(self) -> dict:
+        """Builds a slots response with slots every 5 minutes from 8am"""
+        return {'slotsWithAvailability': [{'localStartTime': f'{8 + i * 5 // 60}:{i * 5 % 60:02d}:00'}
+                                          for i in range(self.config.slots_per_day)]}
+
+    def _handler(self):
+        """Private helper function to build the request handler class bound to this server"""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Request handler forwarding to FakeMyTurnServer.respond"""
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                status, headers, response = fake.respond(self.path, body)
+                content = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
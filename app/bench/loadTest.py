@@ -0,0 +1,157 @@
+"""Load tests MyTurnCA and the notification polling loop against a local fake MyTurn server,
+run with python -m app.bench.loadTest"""
+import argparse
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+from .fakeMyTurn import FakeMyTurnConfig, FakeMyTurnServer
+from ..src.myTurnCA import MyTurnCA
+from ..src.notificationGenerator import NotificationGenerator
+from ..src.zipCodeIndex import ZipCodeIndex
+
+
+class BenchNotificationGenerator(NotificationGenerator):
+    """NotificationGenerator that counts published notifications instead of writing them to mongo"""
+    def __init__(self, my_turn_ca: MyTurnCA):
+        # MongoClient doesn't connect until it's used, and nothing on the polling path uses it once
+        # _publish_notification is overridden
+        super().__init__(mongodb_user='bench', mongodb_password='bench', mongodb_host='127.0.0.1', mongodb_port='1',
+                         my_turn_api_key='bench', my_turn_ca=my_turn_ca)
+        self.published = 0
+
+    def _publish_notification(self, zip_code: int, message: str):
+        self.published += 1
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Returns the p-th percentile of values using the nearest-rank method"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def report(name: str, latencies: List[float], elapsed: float, request_counts: Dict[str, int]):
+    """Prints throughput, latency percentiles and how many requests reached the fake server"""
+    print(f'{name}: {len(latencies)} call(s) in {elapsed:.2f}s, {len(latencies) / elapsed:.1f} calls/s, '
+          f'p50 {percentile(latencies, 50) * 1000:.1f}ms, p99 {percentile(latencies, 99) * 1000:.1f}ms')
+    if not request_counts:
+        return
+    total = sum(request_counts.values())
+    print(f'  upstream: {total} request(s), {total / elapsed:.1f} requests/s - '
+          f'{", ".join(f"{endpoint} {count}" for endpoint, count in sorted(request_counts.items()))}')
+
+
+def run_get_appointments(args: argparse.Namespace, my_turn_ca: MyTurnCA,
+                         first_result: bool = False) -> Tuple[List[float], float]:
+    """Calls get_appointments from --concurrency threads for --calls calls, returns the latency of each call
+    and the total time taken. With first_result iter_appointments is called instead and the latency is the
+    time it took to get the first location's appointments"""
+    start_date = date.today()
+
+    def get_appointments(i: int) -> float:
+        started_at = perf_counter()
+        if first_result:
+            appointments = my_turn_ca.iter_appointments(latitude=38.5 + i % 10 * 0.1, longitude=-121.5,
+                                                        start_date=start_date, end_date=start_date + timedelta(weeks=1))
+            next(appointments, None)
+            latency = perf_counter() - started_at
+            # the rest is still fetched so the upstream load matches get_appointments
+            for _ in appointments:
+                pass
+            return latency
+
+        my_turn_ca.get_appointments(latitude=38.5 + i % 10 * 0.1, longitude=-121.5, start_date=start_date,
+                                    end_date=start_date + timedelta(weeks=1))
+        return perf_counter() - started_at
+
+    started_at = perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = list(executor.map(get_appointments, range(args.calls)))
+    return latencies, perf_counter() - started_at
+
+
+def bench_get_appointments(args: argparse.Namespace, config: FakeMyTurnConfig):
+    """Benchmarks get_appointments against the fake server"""
+    with FakeMyTurnServer(config) as server:
+        my_turn_ca = MyTurnCA(api_key='bench', max_workers=args.max_workers, cache_ttl=args.cache_ttl,
+                              base_url=server.url)
+        latencies, elapsed = run_get_appointments(args, my_turn_ca)
+        report('get_appointments', latencies, elapsed, server.request_counts())
+
+
+def bench_iter_appointments(args: argparse.Namespace, config: FakeMyTurnConfig):
+    """Benchmarks how long iter_appointments takes to yield its first result against the fake server"""
+    with FakeMyTurnServer(config) as server:
+        my_turn_ca = MyTurnCA(api_key='bench', max_workers=args.max_workers, cache_ttl=args.cache_ttl,
+                              base_url=server.url)
+        latencies, elapsed = run_get_appointments(args, my_turn_ca, first_result=True)
+        report('iter_appointments (time to first result)', latencies, elapsed, server.request_counts())
+
+
+def bench_replay(args: argparse.Namespace):
+    """Benchmarks get_appointments against traffic recorded with app.bench.recordTraffic"""
+    my_turn_ca = MyTurnCA(api_key='bench', max_workers=args.max_workers, cache_ttl=args.cache_ttl,
+                          replay_from=args.replay, replay_realtime=args.replay_realtime)
+    latencies, elapsed = run_get_appointments(args, my_turn_ca)
+    report(f'get_appointments replaying {args.replay}', latencies, elapsed, {})
+
+
+def bench_notification_loop(args: argparse.Namespace, config: FakeMyTurnConfig):
+    """Polls --zip_codes zip codes for --polls rounds the way the notification scheduler does"""
+    zip_codes = [zip_code for zip_code, _ in itertools.islice(ZipCodeIndex.load().items(), args.zip_codes)]
+    with FakeMyTurnServer(config) as server:
+        generator = BenchNotificationGenerator(MyTurnCA(api_key='bench', max_workers=args.max_workers,
+                                                        cache_ttl=args.cache_ttl, base_url=server.url))
+        latencies = []
+        started_at = perf_counter()
+        for _ in range(args.polls):
+            poll_started_at = perf_counter()
+            generator.poll_zip_codes(zip_codes)
+            latencies.append(perf_counter() - poll_started_at)
+        report(f'notification loop ({len(zip_codes)} zip codes per poll, {generator.published} notification(s))',
+               latencies, perf_counter() - started_at, server.request_counts())
+
+
+def main():
+    """Runs the load tests"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--locations', type=int, default=20, help='locations returned by each location search')
+    parser.add_argument('--available_ratio', type=float, default=0.5, help='fraction of days with availability')
+    parser.add_argument('--slots_per_day', type=int, default=50, help='slots returned for each available day')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds the fake server takes per request')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='fraction of requests failing with a 500')
+    parser.add_argument('--throttle_rate', type=float, default=0.0, help='fraction of requests failing with a 429')
+    parser.add_argument('--calls', type=int, default=200, help='get_appointments calls to make')
+    parser.add_argument('--concurrency', type=int, default=8, help='threads calling get_appointments')
+    parser.add_argument('--zip_codes', type=int, default=200, help='zip codes polled by the notification loop')
+    parser.add_argument('--polls', type=int, default=5, help='rounds of notification polling')
+    parser.add_argument('--max_workers', type=int, default=10, help='MyTurnCA worker pool size')
+    parser.add_argument('--cache_ttl', type=float, default=0,
+                        help='MyTurnCA response cache ttl, 0 makes every call reach the fake server')
+    parser.add_argument('--scenario', choices=['all', 'get_appointments', 'iter_appointments', 'notification_loop'],
+                        default='all')
+    parser.add_argument('--replay', help='benchmark get_appointments against this recorded archive instead')
+    parser.add_argument('--replay_realtime', action='store_true', help='replay responses at their recorded timing')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(name)s: %(message)s', level=logging.ERROR)
+
+    if args.replay:
+        bench_replay(args)
+        return
+
+    config = FakeMyTurnConfig(locations=args.locations, available_ratio=args.available_ratio,
+                              slots_per_day=args.slots_per_day, latency=args.latency, error_rate=args.error_rate,
+                              throttle_rate=args.throttle_rate)
+    if args.scenario in ['all', 'get_appointments']:
+        bench_get_appointments(args, config)
+    if args.scenario in ['all', 'iter_appointments']:
+        bench_iter_appointments(args, config)
+    if args.scenario in ['all', 'notification_loop']:
+        bench_notification_loop(args, config)
+
+
+if __name__ == '__main__':
+    main()
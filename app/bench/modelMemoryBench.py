@@ -0,0 +1,73 @@
+"""Memory benchmarks for the MyTurnCA result models, run with python -m app.bench.modelMemoryBench"""
+import argparse
+import gc
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable
+
+import pytz
+
+from ..src.myTurnCA import Location, LocationAvailabilitySlots
+
+
+class LegacyLocation:
+    """The dict-backed Location MyTurnCA used before, kept as the baseline"""
+    def __init__(self, location_id: str, name: str, booking_type: str, vaccine_data: str,
+                 distance: float, address: str, latitude: float = None, longitude: float = None):
+        self.location_id = location_id
+        self.name = name
+        self.booking_type = booking_type
+        self.vaccine_data = vaccine_data
+        self.distance_in_meters = distance
+        self.address = address
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+class LegacyLocationAvailabilitySlots:
+    """The list-backed LocationAvailabilitySlots MyTurnCA used before, kept as the baseline"""
+    def __init__(self, location, slots):
+        self.location = location
+        self.slots = slots
+
+
+def measure(name: str, build: Callable[[], object]) -> int:
+    """Prints and returns how many bytes the object built by build keeps allocated"""
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    print(f'{name:<40} {size / 1024:>10.1f} KiB')
+    return size
+
+
+def main():
+    """Runs every benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--locations', type=int, default=2000, help='number of locations')
+    parser.add_argument('--slots', type=int, default=200, help='number of slots per location')
+    args = parser.parse_args()
+
+    # the strings are shared between both versions so only the objects themselves are measured
+    fields = [(f'a3Ef0000000{i:04d}', f'Location {i}', 'OpenScheduling', 'VACCINE_DATA', 100.0 * i,
+               f'{i} Main St, Sacramento CA 95814', 38.5, -121.5) for i in range(args.locations)]
+    start = datetime.now(tz=pytz.timezone('US/Pacific')).replace(microsecond=0)
+
+    def slots():
+        return [start + timedelta(minutes=5 * i) for i in range(args.slots)]
+
+    legacy = measure('legacy locations', lambda: [LegacyLocation(*x) for x in fields])
+    compact = measure('locations', lambda: [Location(*x) for x in fields])
+    print(f'{"saving":<40} {1 - compact / legacy:>10.1%}')
+
+    legacy = measure('legacy slots', lambda: [LegacyLocationAvailabilitySlots(location=None, slots=slots())
+                                              for _ in range(args.locations)])
+    compact = measure('slots', lambda: [LocationAvailabilitySlots(location=None, slots=slots())
+                                        for _ in range(args.locations)])
+    print(f'{"saving":<40} {1 - compact / legacy:>10.1%}')
+
+
+if __name__ == '__main__':
+    main()
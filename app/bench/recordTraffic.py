@@ -0,0 +1,35 @@
+"""Records live MyTurn traffic for the given zip codes into an archive that MyTurnCA can replay,
+run with MY_TURN_API_KEY set and python -m app.bench.recordTraffic --out traffic.jsonl.gz 94103 95814"""
+import argparse
+import logging
+import os
+from datetime import datetime, timedelta
+
+from ..src.constants import MY_TURN_API_KEY, PACIFIC_TIMEZONE
+from ..src.myTurnCA import MyTurnCA
+from ..src.zipCodeIndex import ZipCodeIndex
+
+
+def main():
+    """Runs get_appointments for each zip code with recording enabled"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('zip_codes', type=int, nargs='+')
+    parser.add_argument('--out', required=True, help='archive to write, conventionally ending in .jsonl.gz')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(name)s: %(message)s', level=logging.INFO)
+
+    zip_code_index = ZipCodeIndex.load()
+    my_turn_ca = MyTurnCA(api_key=os.environ[MY_TURN_API_KEY], cache_ttl=0, record_to=args.out)
+    start_date = datetime.now(tz=PACIFIC_TIMEZONE).date()
+    try:
+        for zip_code in args.zip_codes:
+            latitude, longitude = zip_code_index.lookup(zip_code)
+            appointments = my_turn_ca.get_appointments(latitude=latitude, longitude=longitude, start_date=start_date,
+                                                       end_date=start_date + timedelta(weeks=1))
+            logging.info(f'recorded {len(appointments)} location(s) with appointments near {zip_code}')
+    finally:
+        my_turn_ca.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Import time benchmarks for each process' entry point, run with python -m app.bench.startupBench"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINTS = {
+    'worker': 'src.notificationGenerator',
+    'bot': 'src.myTurnCABot',
+}
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+
+def import_times(module: str) -> List[Tuple[str, int, int]]:
+    """Imports module in a fresh interpreter and returns (name, depth, cumulative microseconds) per import"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=APP_DIR,
+                            stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, universal_newlines=True, check=True)
+    times = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            times.append((match.group(4), (len(match.group(3)) - 1) // 2, int(match.group(2))))
+
+    return times
+
+
+def packages_by_time(times: List[Tuple[str, int, int]]) -> Dict[str, int]:
+    """Sums the cumulative time of every package, counting each import only when nothing above it in the
+    import tree belongs to the same package"""
+    packages: Dict[str, int] = {}
+    ancestors: List[Tuple[int, str]] = []
+    # importtime prints children before their parent, walking backwards visits parents first
+    for name, depth, cumulative in reversed(times):
+        package = name.split('.')[0]
+        while ancestors and ancestors[-1][0] >= depth:
+            ancestors.pop()
+        if all(package != ancestor for _, ancestor in ancestors):
+            packages[package] = packages.get(package, 0) + cumulative
+        ancestors.append((depth, package))
+
+    return packages
+
+
+def main():
+    """Runs every benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5, help='number of runs per entry point, the fastest is kept')
+    parser.add_argument('--top', type=int, default=10, help='number of packages to list per entry point')
+    args = parser.parse_args()
+
+    for name, module in ENTRY_POINTS.items():
+        runs = [import_times(module) for _ in range(args.runs)]
+        fastest = min(runs, key=lambda times: times[-1][2])
+        print(f'{name} ({module}): {fastest[-1][2] / 1000:.1f}ms')
+        packages = sorted(packages_by_time(fastest).items(), key=lambda item: item[1], reverse=True)
+        for package, cumulative in packages[:args.top]:
+            print(f'    {package:<30} {cumulative / 1000:>8.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
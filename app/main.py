@@ -5,10 +5,13 @@ import logging
 import os
 import sys
 
-from src import myTurnCABot
+from src.startupTimer import StartupTimer
+
+# started before the rest of the imports so they're included in the startup breakdown
+STARTUP_TIMER = StartupTimer()
+
 from src.constants import DISCORD_BOT_TOKEN, MONGO_USER, MONGO_PASSWORD, MONGO_HOST, MONGO_PORT, NAMESPACE, JOB_IMAGE, \
     MY_TURN_API_KEY
-from src.notificationGenerator import NotificationGenerator
 
 BOT_ENV_VARS = {
     DISCORD_BOT_TOKEN: '',
@@ -36,9 +39,23 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--worker', action='store_true')
     parser.add_argument('--zip_code', type=int)
+    parser.add_argument('--scheduler', action='store_true',
+                        help='poll every pending zip code from this process instead of one job per zip code')
+    parser.add_argument('--queue_worker', action='store_true',
+                        help='poll zip codes claimed from the shared work queue, run as many replicas as needed')
+    parser.add_argument('--use_scheduler', action='store_true',
+                        help='run the bot without creating notification jobs, requires a --scheduler process or '
+                             '--queue_worker replicas')
+    parser.add_argument('--metrics_port', type=int,
+                        help='serve Prometheus metrics on this port, only reachable from localhost')
     args = parser.parse_args()
 
-    if args.worker:
+    # each mode only imports what it uses, workers never load discord or kubernetes
+    if args.metrics_port is not None:
+        from src.metrics import start_metrics_server
+        start_metrics_server(args.metrics_port)
+
+    if args.worker or args.scheduler or args.queue_worker:
         for var in WORKER_ENV_VARS:
             try:
                 WORKER_ENV_VARS[var] = os.environ[var]
@@ -46,12 +63,20 @@ if __name__ == '__main__':
                 logging.error(f'Error: {var} is a required environment variable')
                 sys.exit(1)
 
+        from src.notificationGenerator import NotificationGenerator
+        STARTUP_TIMER.phase('imports')
         notification_generator = NotificationGenerator(mongodb_user=WORKER_ENV_VARS[MONGO_USER],
                                                        mongodb_password=WORKER_ENV_VARS[MONGO_PASSWORD],
                                                        mongodb_host=WORKER_ENV_VARS[MONGO_HOST],
                                                        mongodb_port=WORKER_ENV_VARS[MONGO_PORT],
-                                                       my_turn_api_key=WORKER_ENV_VARS[MY_TURN_API_KEY])
-        notification_generator.generate_notification(args.zip_code)
+                                                       my_turn_api_key=WORKER_ENV_VARS[MY_TURN_API_KEY],
+                                                       startup_timer=STARTUP_TIMER)
+        if args.scheduler:
+            notification_generator.run_scheduler()
+        elif args.queue_worker:
+            notification_generator.run_queue_worker()
+        else:
+            notification_generator.generate_notification(args.zip_code)
         sys.exit(0)
 
     for var in BOT_ENV_VARS:
@@ -61,6 +86,8 @@ if __name__ == '__main__':
             logging.error(f'Error: {var} is a required environment variable')
             sys.exit(1)
 
+    from src import myTurnCABot
+    STARTUP_TIMER.phase('imports')
     myTurnCABot.run(token=BOT_ENV_VARS[DISCORD_BOT_TOKEN],
                     namespace=BOT_ENV_VARS[NAMESPACE],
                     job_image=BOT_ENV_VARS[JOB_IMAGE],
@@ -68,4 +95,6 @@ if __name__ == '__main__':
                     mongodb_password=BOT_ENV_VARS[MONGO_PASSWORD],
                     mongodb_host=BOT_ENV_VARS[MONGO_HOST],
                     mongodb_port=BOT_ENV_VARS[MONGO_PORT],
-                    my_turn_api_key=BOT_ENV_VARS[MY_TURN_API_KEY])
\ No newline at end of file
+                    my_turn_api_key=BOT_ENV_VARS[MY_TURN_API_KEY],
+                    create_jobs=not args.use_scheduler,
+                    startup_timer=STARTUP_TIMER)
\ No newline at end of file
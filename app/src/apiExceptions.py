@@ -0,0 +1,8 @@
+"""Contains custom exceptions raised by the My Turn clients, kept apart from exceptions.py so the workers can use
+them without loading discord"""
+
+
+class VaccineDataRejected(Exception):
+    """Exception to be thrown if a location search was rejected because of its vaccineData, which has already
+    been expired by then"""
+    pass
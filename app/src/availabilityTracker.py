@@ -0,0 +1,98 @@
+"""Incremental appointment fetching across poll cycles"""
+import logging
+import time
+from array import array
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .constants import SLOT_DATA_MAX_AGE_SECONDS, PACIFIC_TIMEZONE, DEFAULT_MAX_WORKERS
+from .myTurnCA import MyTurnCA, Location, LocationAvailability, LocationAvailabilitySlots
+
+
+class AvailabilityTracker:
+    """Class to fetch appointments for the same locations every poll cycle, remembering each location's previous
+    availability so slots are only re-fetched for dates that became available or whose slots are older than max_age"""
+    def __init__(self, my_turn_ca: MyTurnCA, max_age: float = SLOT_DATA_MAX_AGE_SECONDS,
+                 batch_size: int = DEFAULT_MAX_WORKERS, timer: Callable[[], float] = time.monotonic):
+        self.logger = logging.getLogger(__name__)
+        self.my_turn_ca = my_turn_ca
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.timer = timer
+        # location_id -> availability from the previous poll
+        self.previous: Dict[str, LocationAvailability] = {}
+        self.polled_at: Dict[str, float] = {}
+        # (location_id, date) -> (time the slots were fetched, slots as epoch seconds)
+        self.slots: Dict[Tuple[str, date], Tuple[float, array]] = {}
+
+    def get_appointments(self, locations: List[Location], start_date: date, end_date: date,
+                         enough_slots: Optional[int] = None) -> List[LocationAvailabilitySlots]:
+        """Retrieves available appointments from the given vaccination locations, preserving their order. With
+        enough_slots, slots are fetched batch_size dates at a time in location order and the remaining locations
+        are skipped once that many slots were found"""
+        availabilities = self.my_turn_ca.get_availabilities(locations=locations, start_date=start_date,
+                                                            end_date=end_date)
+        now = self.timer()
+        changed = 0
+        for availability in availabilities:
+            location_id = availability.location.location_id
+            previous = self.previous.get(location_id)
+            if previous is None or previous.dates_available != availability.dates_available:
+                changed += 1
+            self.previous[location_id] = availability
+
+        # slots fetched in earlier polls may have already occurred
+        cutoff = datetime.now(tz=PACIFIC_TIMEZONE).timestamp()
+        appointments = []
+        found_slots = 0
+        fetched = 0
+        index = 0
+        while index < len(availabilities) and (enough_slots is None or found_slots < enough_slots):
+            # takes locations in order until a batch worth of their dates need slots fetched
+            batch = []
+            stale = []
+            while index < len(availabilities) and (enough_slots is None or len(stale) < self.batch_size):
+                availability = availabilities[index]
+                index += 1
+                batch.append(availability)
+                for day in availability.dates_available:
+                    location_slots = self.slots.get((availability.location.location_id, day))
+                    if location_slots is None or now - location_slots[0] >= self.max_age:
+                        stale.append((availability.location, day))
+
+            for (location, day), location_slots in zip(stale, self.my_turn_ca.get_slots_for_dates(stale)):
+                self.slots[(location.location_id, day)] = (now, location_slots.epochs)
+            fetched += len(stale)
+
+            for availability in batch:
+                location_id = availability.location.location_id
+                epochs = array('q', (epoch for day in availability.dates_available
+                                     for epoch in self.slots[(location_id, day)][1] if epoch > cutoff))
+                if epochs:
+                    appointments.append(LocationAvailabilitySlots(location=availability.location, epochs=epochs))
+                    found_slots += len(epochs)
+
+        self._forget(availabilities, now)
+        self.logger.info(f'{changed} of {len(availabilities)} location(s) changed availability, '
+                         f'fetched slots for {fetched} date(s)')
+        if index < len(availabilities):
+            self.logger.info(f'found {found_slots} slot(s), skipped the remaining '
+                             f'{len(availabilities) - index} location(s)')
+
+        return appointments
+
+    def _forget(self, availabilities: List[LocationAvailability], now: float):
+        """Private helper function to drop dates that aren't available anymore at the polled locations and
+        everything about locations that haven't been polled within max_age, since each poll may only cover
+        the zip codes that were due"""
+        for availability in availabilities:
+            self.polled_at[availability.location.location_id] = now
+        for location_id in [location_id for location_id, polled_at in self.polled_at.items()
+                            if now - polled_at >= self.max_age]:
+            del self.polled_at[location_id]
+            del self.previous[location_id]
+
+        available = {(location_id, day) for location_id, availability in self.previous.items()
+                     for day in availability.dates_available}
+        for key in [key for key in self.slots if key not in available]:
+            del self.slots[key]
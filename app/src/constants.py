@@ -1,14 +1,46 @@
+import os
+
+import pytz
 from urllib3.util import Retry
 
 """Constants module"""
 # MyTurnCA constants
 REQUESTS_MAX_RETRIES = 100
+# pytz.timezone does a lookup every call, slots are parsed in bulk so the zone is only looked up once
+PACIFIC_TIMEZONE = pytz.timezone('US/Pacific')
+DEFAULT_MAX_WORKERS = 10
+# fraction of successful, non-retried requests that get logged, failed and retried requests are always logged
+REQUEST_LOG_SAMPLE_RATE = 0.05
+RESPONSE_CACHE_TTL_SECONDS = 30
+RESPONSE_CACHE_MAX_SIZE = 4096
+# vaccineData rarely changes, it's refreshed in the background once it's within the refresh-ahead window
+VACCINE_DATA_TTL_SECONDS = 60 * 60
+VACCINE_DATA_REFRESH_AHEAD_SECONDS = 5 * 60
+VACCINE_DATA_DOCUMENT_ID = 'vaccine_data'
+# locations/search answers with this status when the vaccineData it was sent is no longer accepted
+VACCINE_DATA_REJECTED_STATUS = 400
+# number of decimal places coordinates are rounded to in the location search cache key, ~1km
+LOCATION_COORDINATE_PRECISION = 2
 MY_TURN_URL = 'https://api.myturn.ca.gov/public/'
-DEFAULT_RETRY_STRATEGY = Retry(
-    total=REQUESTS_MAX_RETRIES,
-    backoff_factor=0.2,
-    status_forcelist=[403, 429, 500, 502, 503, 504],
-    allowed_methods=frozenset(['GET', 'POST']))
+DEFAULT_RETRY_PARAMETERS = {
+    'total': REQUESTS_MAX_RETRIES,
+    'backoff_factor': 0.2,
+    'status_forcelist': [403, 429, 500, 502, 503, 504],
+    'allowed_methods': frozenset(['GET', 'POST'])
+}
+DEFAULT_RETRY_STRATEGY = Retry(**DEFAULT_RETRY_PARAMETERS)
+# (requests per second, burst) each endpoint may receive from all of our processes combined
+RATE_LIMIT_QUOTAS = {
+    'eligibility': (1, 5),
+    'locations': (5, 10),
+    'availability': (10, 20),
+    'slots': (10, 20)
+}
+# share of the quotas a single process keeps to when the shared rate limit state can't be reached, sized for the
+# number of processes that normally run
+RATE_LIMIT_FALLBACK_SHARE = 1 / 4
+# how long a process keeps to its own share before trying the shared rate limit state again
+RATE_LIMIT_FALLBACK_SECONDS = 60
 ELIGIBLE_REQUEST_BODY = {
     'eligibilityQuestionResponse': [
         {
@@ -142,6 +174,22 @@ LOCATION_POOLS = [
     'default'
 ]
 
+# location catalogue constants
+LOCATION_CATALOGUE_MAX_AGE_SECONDS = 60 * 60
+LOCATION_CATALOGUE_CELL_DEGREES = 0.1
+# spacing of the points searched to refresh the catalogue, roughly 50km, it's narrowed to the search radius
+# once that's known but never below the minimum to bound the number of searches per refresh
+LOCATION_CATALOGUE_SEED_SPACING_DEGREES = 0.5
+LOCATION_CATALOGUE_MIN_SEED_SPACING_DEGREES = 0.2
+LOCATION_CATALOGUE_DOCUMENT_ID = 'location_catalogue'
+# only one process rebuilds the shared catalogue at a time, another takes over once the lease runs out
+LOCATION_CATALOGUE_REFRESH_LEASE_SECONDS = 15 * 60
+# how often the bot checks whether the catalogue is due, adopting one another process rebuilt when it is
+LOCATION_CATALOGUE_CHECK_SECONDS = 60
+
+# zip code index constants
+CA_ZIP_CODE_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'caZipCodes.bin')
+
 # env var constants
 DISCORD_BOT_TOKEN = 'DISCORD_BOT_TOKEN'
 MONGO_USER = 'MONGO_USER'
@@ -165,9 +213,53 @@ GET_APPOINTMENTS_BRIEF = 'Lists appointments at nearby vaccination locations'
 GET_APPOINTMENTS_DESCRIPTION = 'Lists how many appointments are available within the next week at vaccination ' \
                                'locations near the given zip code'
 NOTIFICATION_WAIT_PERIOD = 30
+# metrics are only served on the loopback interface, scrape them with a sidecar or port-forward
+METRICS_BIND_ADDRESS = '127.0.0.1'
+# adaptive poll scheduling, see PollScheduler.next_delay
+SCHEDULER_TICK_SECONDS = 5
+ERROR_RATE_WINDOW = 200
+POLL_MIN_INTERVAL_SECONDS = 10
+POLL_MAX_INTERVAL_SECONDS = 10 * 60
+POLL_HOT_WINDOW_SECONDS = 60 * 60
+POLL_HOT_FACTOR = 0.5
+POLL_COLD_AFTER_SECONDS = 24 * 60 * 60
+POLL_COLD_FACTOR = 4
+POLL_ERROR_FACTOR = 4
+POLL_JITTER = 0.2
+# lease-based work queue shared by --queue_worker replicas, see WorkQueue
+WORK_QUEUE_LEASE_SECONDS = 30
+WORK_QUEUE_HEARTBEAT_SECONDS = 10
+WORK_QUEUE_BATCH_SIZE = 25
+WORK_QUEUE_SYNC_SECONDS = 5
+DUPLICATE_KEY_ERROR_CODE = 11000
+# slots are re-fetched once they're this old even if a location's available dates didn't change
+SLOT_DATA_MAX_AGE_SECONDS = 5 * 60
+DISCORD_MESSAGE_LIMIT = 2000
+# !get_appointments edits its reply as results come in, at most once per interval to stay under Discord's rate limits
+APPOINTMENTS_EDIT_INTERVAL_SECONDS = 1
+# notification jobs stop looking at more locations once this many slots were found
+NOTIFICATION_ENOUGH_SLOTS = 50
+# notification messages mention their user here, see NotificationGenerator._build_message
+MENTION_PLACEHOLDER = '<@{user_id}>'
+# matches notifications that just got their message from a notification job
+NOTIFICATION_CHANGE_STREAM_PIPELINE = [{
+    '$match': {
+        '$or': [
+            {'operationType': 'update', 'updateDescription.updatedFields.message': {'$exists': True}},
+            {'operationType': {'$in': ['insert', 'replace']}, 'fullDocument.message': {'$exists': True}}
+        ]
+    }
+}]
+# standalone servers reject change streams with one of these codes
+CHANGE_STREAM_UNSUPPORTED_ERROR_CODES = frozenset([40573, 40324])
+CHANGE_STREAM_RETRY_SECONDS = 5
 JOB_MAX_RETRIES = 6
 JOB_TTL_SECONDS_AFTER_FINISHED = 0
 JOB_NAME_PREFIX = 'myturncabot-notification-job-'
 JOB_RESTART_POLICY = 'OnFailure'
 JOB_DELETION_PROPAGATION_POLICY = 'Foreground'
-JOB_RESOURCE_REQUESTS = {'memory': '128Mi', 'cpu': '5m'}
\ No newline at end of file
+JOB_RESOURCE_REQUESTS = {'memory': '128Mi', 'cpu': '5m'}
+JOB_LABELS = {'app': 'myturncabot-notification-job'}
+JOB_LABEL_SELECTOR = ','.join(f'{key}={value}' for key, value in JOB_LABELS.items())
+JOB_WATCH_TIMEOUT_SECONDS = 5 * 60
+JOB_WATCH_RETRY_SECONDS = 5
\ No newline at end of file
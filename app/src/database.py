@@ -0,0 +1,32 @@
+"""Helpers for the my_turn_ca database"""
+import logging
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.collection import Collection
+
+NOTIFICATION_INDEXES = [
+    # cancel_notification, notify and get_notifications look notifications up by user
+    IndexModel([('user_id', ASCENDING), ('zip_code', ASCENDING)], name='user_id_zip_code'),
+    # pending notifications are looked up, reassigned and fulfilled by zip code
+    IndexModel([('zip_code', ASCENDING), ('message', ASCENDING)], name='zip_code_message'),
+    # only the handful of notifications waiting to be delivered are indexed
+    IndexModel([('message', ASCENDING)], name='ready_message', partialFilterExpression={'message': {'$exists': True}}),
+    IndexModel([('job_name', ASCENDING)], name='job_name')
+]
+
+POLL_TASK_INDEXES = [
+    # queue workers claim the most overdue task whose lease has expired
+    IndexModel([('next_poll_at', ASCENDING), ('lease_expires_at', ASCENDING)], name='next_poll_at_lease_expires_at')
+]
+
+
+def ensure_notification_indexes(notifications: Collection):
+    """Creates any of the notifications collection's indexes that don't exist yet"""
+    logging.getLogger(__name__).info(f'ensuring indexes exist on {notifications.full_name} - '
+                                     f'{notifications.create_indexes(NOTIFICATION_INDEXES)}')
+
+
+def ensure_poll_task_indexes(poll_tasks: Collection):
+    """Creates any of the poll_tasks collection's indexes that don't exist yet"""
+    logging.getLogger(__name__).info(f'ensuring indexes exist on {poll_tasks.full_name} - '
+                                     f'{poll_tasks.create_indexes(POLL_TASK_INDEXES)}')
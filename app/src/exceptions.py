@@ -4,4 +4,5 @@ from discord.ext import commands
 
 class InvalidZipCode(commands.BadArgument):
     """Exception to be thrown if the provided zip code was not valid"""
-    pass
\ No newline at end of file
+    pass
+
@@ -0,0 +1,99 @@
+"""Informer-style local cache of notification jobs"""
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from kubernetes import client, watch
+
+from .constants import JOB_LABELS, JOB_LABEL_SELECTOR, JOB_NAME_PREFIX, JOB_WATCH_TIMEOUT_SECONDS, \
+    JOB_WATCH_RETRY_SECONDS
+
+
+class JobCache:
+    """Cache of notification jobs keyed by job name, kept current from a single list + watch stream
+    so callers can check on jobs without making any API server calls"""
+    def __init__(self, k8s_batch: client.BatchV1Api, namespace: str, label_selector: str = JOB_LABEL_SELECTOR):
+        self.logger = logging.getLogger(__name__)
+        self.k8s_batch = k8s_batch
+        self.namespace = namespace
+        self.label_selector = label_selector
+        self.jobs: Dict[str, client.V1Job] = {}
+        self.synced = threading.Event()
+        self._stopped = threading.Event()
+        self._watch: Optional[watch.Watch] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._labelled_unlabelled_jobs = False
+
+    def start(self):
+        """Starts keeping the cache current on a background thread, does nothing if it was already started"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='job-cache', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the background thread"""
+        self._stopped.set()
+        if self._watch is not None:
+            self._watch.stop()
+
+    def add(self, job: client.V1Job):
+        """Records a job that was just created so it's visible before its watch event arrives"""
+        with self._lock:
+            self.jobs[job.metadata.name] = job
+
+    def is_active(self, job_name: Optional[str]) -> bool:
+        """Returns whether or not the given job exists and hasn't permanently failed"""
+        with self._lock:
+            job = self.jobs.get(job_name) if job_name else None
+        return job is not None and not (job.status and job.status.failed)
+
+    def active_job_names(self) -> List[str]:
+        """Returns the names of every job that exists and hasn't permanently failed"""
+        with self._lock:
+            job_names = list(self.jobs)
+        return [job_name for job_name in job_names if self.is_active(job_name)]
+
+    def label_unlabelled_jobs(self):
+        """Adds JOB_LABELS to notification jobs created before jobs were labelled, they're recognized by their
+        name instead so the label selector (and everything using it) picks them up from then on"""
+        for job in self.k8s_batch.list_namespaced_job(namespace=self.namespace).items:
+            labels = job.metadata.labels or {}
+            if job.metadata.name.startswith(JOB_NAME_PREFIX) \
+                    and any(labels.get(key) != value for key, value in JOB_LABELS.items()):
+                self.logger.info(f'labelling notification job {job.metadata.name} created before jobs were labelled')
+                self.k8s_batch.patch_namespaced_job(name=job.metadata.name, namespace=self.namespace,
+                                                    body={'metadata': {'labels': JOB_LABELS}})
+
+    def _run(self):
+        """Private helper function to list the jobs and then watch them for changes, relisting whenever the
+        watch times out or breaks"""
+        while not self._stopped.is_set():
+            try:
+                # otherwise jobs that were already running before the upgrade would look like they don't exist
+                if not self._labelled_unlabelled_jobs:
+                    self.label_unlabelled_jobs()
+                    self._labelled_unlabelled_jobs = True
+
+                job_list = self.k8s_batch.list_namespaced_job(namespace=self.namespace,
+                                                              label_selector=self.label_selector)
+                with self._lock:
+                    self.jobs = {job.metadata.name: job for job in job_list.items}
+                self.synced.set()
+
+                self._watch = watch.Watch()
+                for event in self._watch.stream(self.k8s_batch.list_namespaced_job, namespace=self.namespace,
+                                                label_selector=self.label_selector,
+                                                resource_version=job_list.metadata.resource_version,
+                                                timeout_seconds=JOB_WATCH_TIMEOUT_SECONDS):
+                    job = event['object']
+                    with self._lock:
+                        if event['type'] == 'DELETED':
+                            self.jobs.pop(job.metadata.name, None)
+                        else:
+                            self.jobs[job.metadata.name] = job
+            except Exception as e:
+                self.logger.error('got exception while watching notification jobs, relisting them')
+                self.logger.error(e)
+                time.sleep(JOB_WATCH_RETRY_SECONDS)
@@ -0,0 +1,328 @@
+"""Local spatial index of known vaccination locations"""
+import logging
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from .constants import LOCATION_CATALOGUE_MAX_AGE_SECONDS, LOCATION_CATALOGUE_CELL_DEGREES, \
+    LOCATION_CATALOGUE_SEED_SPACING_DEGREES, LOCATION_CATALOGUE_MIN_SEED_SPACING_DEGREES, \
+    LOCATION_CATALOGUE_DOCUMENT_ID, LOCATION_CATALOGUE_REFRESH_LEASE_SECONDS
+from .myTurnCA import Location
+
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_DEGREE_LATITUDE = 111320.0
+
+
+def haversine_distance(latitude: float, longitude: float, other_latitude: float, other_longitude: float) -> float:
+    """Returns the great-circle distance between two points in meters"""
+    latitude, longitude, other_latitude, other_longitude = map(math.radians, [latitude, longitude,
+                                                                              other_latitude, other_longitude])
+    a = math.sin((other_latitude - latitude) / 2) ** 2 \
+        + math.cos(latitude) * math.cos(other_latitude) * math.sin((other_longitude - longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+
+class MongoLocationCatalogueBackend:
+    """Location catalogue shared by every process through a single document in a Mongo collection, a lease on the
+    document makes sure only one process rebuilds it at a time"""
+    def __init__(self, collection: Collection):
+        self.collection = collection
+
+    def refreshed_at(self) -> Optional[float]:
+        """Returns when the stored catalogue was rebuilt, None if nothing has been stored yet"""
+        document = self.collection.find_one({'_id': LOCATION_CATALOGUE_DOCUMENT_ID}, projection={'refreshed_at': 1})
+        return document.get('refreshed_at') if document is not None else None
+
+    def load(self) -> Optional[dict]:
+        """Returns the stored catalogue, None if nothing has been stored yet"""
+        document = self.collection.find_one({'_id': LOCATION_CATALOGUE_DOCUMENT_ID})
+        return document if document is not None and 'refreshed_at' in document else None
+
+    def store(self, snapshot: dict):
+        """Stores the given catalogue unless a more recently rebuilt one is already stored and releases the lease"""
+        try:
+            self.collection.update_one({'_id': LOCATION_CATALOGUE_DOCUMENT_ID,
+                                        'refreshed_at': {'$not': {'$gte': snapshot['refreshed_at']}}},
+                                       {'$set': {**snapshot, 'lease_expires_at': 0}}, upsert=True)
+        except DuplicateKeyError:
+            # the document exists but didn't match, so a more recently rebuilt catalogue is already stored
+            pass
+
+    def try_lease(self, now: float, lease_seconds: float, fresh_after: float) -> bool:
+        """Takes the lease to rebuild the catalogue, unless another process holds it or the stored catalogue was
+        rebuilt after fresh_after, returns whether or not it was taken"""
+        try:
+            self.collection.update_one({'_id': LOCATION_CATALOGUE_DOCUMENT_ID,
+                                        'lease_expires_at': {'$not': {'$gt': now}},
+                                        'refreshed_at': {'$not': {'$gt': fresh_after}}},
+                                       {'$set': {'lease_expires_at': now + lease_seconds}}, upsert=True)
+        except DuplicateKeyError:
+            # the document exists but didn't match, so it's either leased or fresh
+            return False
+        return True
+
+
+class LocationCatalogue:
+    """Grid based spatial index over every known vaccination location, answers location searches locally
+    the same way locations/search would as long as it has been refreshed within max_age seconds. Searches
+    only return their closest search_limit locations, so the catalogue keeps track of which grid cells it
+    knows every location in and won't answer searches that depend on any other cell. With a backend the catalogue
+    is shared by every process and only rebuilt by one of them, the others adopt it. It's rebuilt at most once
+    every max_age, even if the rebuild failed or came back empty"""
+    def __init__(self, max_age: float = LOCATION_CATALOGUE_MAX_AGE_SECONDS,
+                 cell_size: float = LOCATION_CATALOGUE_CELL_DEGREES,
+                 backend: Optional[MongoLocationCatalogueBackend] = None,
+                 lease_seconds: float = LOCATION_CATALOGUE_REFRESH_LEASE_SECONDS, timer: Callable[[], float] = time.time):
+        self.logger = logging.getLogger(__name__)
+        self.max_age = max_age
+        self.cell_size = cell_size
+        self.backend = backend
+        self.lease_seconds = lease_seconds
+        self.timer = timer
+        self.refreshed_at = None
+        # when this process last started rebuilding the catalogue
+        self.attempted_at = None
+        self.refreshing = False
+        self.search_limit = 0
+        self.search_radius = 0.0
+        self.cells: Dict[Tuple[int, int], List[Location]] = {}
+        # cells every location of is in the catalogue
+        self.covered_cells: Set[Tuple[int, int]] = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(cell) for cell in self.cells.values())
+
+    def is_fresh(self) -> bool:
+        """Returns whether or not the catalogue can be used to answer searches"""
+        return self._is_recent(self.refreshed_at) and bool(self.cells)
+
+    def needs_refresh(self) -> bool:
+        """Returns whether or not the catalogue is due to be rebuilt, adopting a catalogue another process rebuilt
+        more recently first"""
+        if self._is_recent(self.refreshed_at):
+            return False
+
+        self._load()
+        return not self._is_recent(self.refreshed_at) and not self._is_recent(self.attempted_at)
+
+    def start_refresh(self) -> bool:
+        """Returns True if the caller should rebuild the catalogue with replace and then call finish_refresh, False
+        if it isn't due or another caller in this or another process is already rebuilding it"""
+        with self._lock:
+            if self.refreshing:
+                return False
+            self.refreshing = True
+
+        if not self.needs_refresh() or not self._lease():
+            self.finish_refresh()
+            return False
+
+        self.attempted_at = self.timer()
+        return True
+
+    def finish_refresh(self):
+        """Ends a refresh started with start_refresh"""
+        with self._lock:
+            self.refreshing = False
+
+    def seed_spacing(self) -> float:
+        """Returns how far apart in degrees the points searched to refresh the catalogue should be, once the
+        search radius is known they're placed close enough together for their searches to overlap"""
+        if not self.search_radius:
+            return LOCATION_CATALOGUE_SEED_SPACING_DEGREES
+        return min(max(self.search_radius / METERS_PER_DEGREE_LATITUDE, LOCATION_CATALOGUE_MIN_SEED_SPACING_DEGREES),
+                   LOCATION_CATALOGUE_SEED_SPACING_DEGREES)
+
+    @staticmethod
+    def refinement_points(search_results: List[List[Location]],
+                          seed_points: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+        """Returns more points to search around each seed point whose search came back full, since those searches
+        only cover the area up to their farthest location. The points are that far north, south, east and west of
+        the seed point so the searches overlap it"""
+        search_limit = max([len(locations) for locations in search_results], default=0)
+        points = []
+        for (latitude, longitude), locations in zip(seed_points, search_results):
+            if locations and len(locations) == search_limit:
+                covered_radius = max(location.distance_in_meters for location in locations)
+                latitude_offset = covered_radius / METERS_PER_DEGREE_LATITUDE
+                longitude_offset = covered_radius / (METERS_PER_DEGREE_LATITUDE
+                                                     * max(math.cos(math.radians(latitude)), 0.01))
+                points.extend([(latitude + latitude_offset, longitude), (latitude - latitude_offset, longitude),
+                               (latitude, longitude + longitude_offset), (latitude, longitude - longitude_offset)])
+
+        return points
+
+    def replace(self, search_results: List[List[Location]], seed_points: List[Tuple[float, float]]):
+        """Replaces the catalogue with the locations from the given locations/search results, search_results[i]
+        being the result of searching around seed_points[i]. The number of locations and the distance searches
+        return are learned from the results so local searches match them"""
+        search_limit = max([len(locations) for locations in search_results], default=0)
+        search_radius = max([location.distance_in_meters for locations in search_results for location in locations],
+                            default=0.0)
+        covered_cells = set()
+        for (latitude, longitude), locations in zip(seed_points, search_results):
+            # a search that came back full only returned the locations up to its farthest one, the others
+            # returned every location within the search radius
+            covered_cells.update(self._cells_within(latitude, longitude,
+                                                    max(location.distance_in_meters for location in locations)
+                                                    if locations and len(locations) == search_limit
+                                                    else search_radius))
+
+        cells = {}
+        seen = set()
+        for location in [location for locations in search_results for location in locations]:
+            if location.location_id in seen or location.latitude is None or location.longitude is None:
+                continue
+
+            seen.add(location.location_id)
+            cells.setdefault(self._cell(location.latitude, location.longitude), []).append(location)
+
+        refreshed_at = self.timer()
+        with self._lock:
+            self.cells = cells
+            self.covered_cells = covered_cells
+            self.search_limit = search_limit
+            self.search_radius = search_radius
+            self.refreshed_at = refreshed_at
+
+        if self.backend is not None:
+            try:
+                self.backend.store({
+                    'refreshed_at': refreshed_at,
+                    'search_limit': search_limit,
+                    'search_radius': search_radius,
+                    'covered_cells': [list(cell) for cell in covered_cells],
+                    'locations': [[location.location_id, location.name, location.booking_type, location.vaccine_data,
+                                   location.distance_in_meters, location.address, location.latitude,
+                                   location.longitude] for locations in cells.values() for location in locations]
+                })
+            except PyMongoError as e:
+                self.logger.warning(f'failed to share location catalogue, only this process will use it: {e}')
+
+    def nearby(self, latitude: float, longitude: float) -> Optional[List[Location]]:
+        """Returns the locations near the given coordinates sorted by distance, or None if the catalogue
+        might be missing some of them and the API has to be searched instead"""
+        with self._lock:
+            cells, covered_cells = self.cells, self.covered_cells
+            search_limit, search_radius = self.search_limit, self.search_radius
+
+        candidates = []
+        for cell in self._cells_near(latitude, longitude, search_radius):
+            for location in cells.get(cell, []):
+                distance = haversine_distance(latitude, longitude, location.latitude, location.longitude)
+                if distance <= search_radius:
+                    candidates.append((distance, location))
+
+        candidates.sort(key=lambda candidate: candidate[0])
+        candidates = candidates[:search_limit]
+        # every location closer than the farthest one returned has to be known, or every location within the
+        # search radius if fewer than search_limit were found
+        needed_radius = candidates[-1][0] if candidates and len(candidates) == search_limit else search_radius
+        if not all(cell in covered_cells for cell in self._cells_near(latitude, longitude, needed_radius)):
+            return None
+
+        return [Location(location_id=location.location_id, name=location.name, booking_type=location.booking_type,
+                         vaccine_data=location.vaccine_data, distance=distance, address=location.address,
+                         latitude=location.latitude, longitude=location.longitude)
+                for distance, location in candidates]
+
+    def _is_recent(self, at: Optional[float]) -> bool:
+        """Private helper function to check if the given time is within max_age"""
+        return at is not None and self.timer() - at < self.max_age
+
+    def _lease(self) -> bool:
+        """Private helper function to take the lease to rebuild the shared catalogue, the catalogue is rebuilt
+        by this process alone when the backend can't be reached"""
+        if self.backend is None:
+            return True
+
+        now = self.timer()
+        try:
+            return self.backend.try_lease(now=now, lease_seconds=self.lease_seconds, fresh_after=now - self.max_age)
+        except PyMongoError as e:
+            self.logger.warning(f'failed to lease shared location catalogue, rebuilding it in this process: {e}')
+            return True
+
+    def _load(self):
+        """Private helper function to adopt the backend's catalogue if it was rebuilt more recently"""
+        if self.backend is None:
+            return
+
+        try:
+            stored_at = self.backend.refreshed_at()
+            if stored_at is None or (self.refreshed_at is not None and stored_at <= self.refreshed_at):
+                return
+            snapshot = self.backend.load()
+            if snapshot is None:
+                return
+        except PyMongoError as e:
+            self.logger.warning(f'failed to load shared location catalogue, falling back to this process\' copy: {e}')
+            return
+
+        cells = {}
+        for location_id, name, booking_type, vaccine_data, distance, address, latitude, longitude \
+                in snapshot['locations']:
+            cells.setdefault(self._cell(latitude, longitude), []).append(
+                Location(location_id=location_id, name=name, booking_type=booking_type, vaccine_data=vaccine_data,
+                         distance=distance, address=address, latitude=latitude, longitude=longitude))
+
+        with self._lock:
+            self.cells = cells
+            self.covered_cells = {tuple(cell) for cell in snapshot['covered_cells']}
+            self.search_limit = snapshot['search_limit']
+            self.search_radius = snapshot['search_radius']
+            self.refreshed_at = snapshot['refreshed_at']
+
+    def _cells_near(self, latitude: float, longitude: float, radius: float) -> List[Tuple[int, int]]:
+        """Private helper function to find the grid cells with any point within radius meters of the given
+        coordinates"""
+        latitude_cells, longitude_cells = self._cell_span(latitude, radius)
+        center_latitude_cell, center_longitude_cell = self._cell(latitude, longitude)
+
+        cells = []
+        for latitude_cell in range(center_latitude_cell - latitude_cells, center_latitude_cell + latitude_cells + 1):
+            for longitude_cell in range(center_longitude_cell - longitude_cells,
+                                        center_longitude_cell + longitude_cells + 1):
+                # distance to the closest point of the cell
+                closest_latitude = min(max(latitude, latitude_cell * self.cell_size),
+                                       (latitude_cell + 1) * self.cell_size)
+                closest_longitude = min(max(longitude, longitude_cell * self.cell_size),
+                                        (longitude_cell + 1) * self.cell_size)
+                if haversine_distance(latitude, longitude, closest_latitude, closest_longitude) <= radius:
+                    cells.append((latitude_cell, longitude_cell))
+
+        return cells
+
+    def _cells_within(self, latitude: float, longitude: float, radius: float) -> List[Tuple[int, int]]:
+        """Private helper function to find the grid cells entirely within radius meters of the given coordinates,
+        which are the cells whose 4 corners are"""
+        latitude_cells, longitude_cells = self._cell_span(latitude, radius)
+        center_latitude_cell, center_longitude_cell = self._cell(latitude, longitude)
+        latitude_range = range(center_latitude_cell - latitude_cells, center_latitude_cell + latitude_cells + 1)
+        longitude_range = range(center_longitude_cell - longitude_cells, center_longitude_cell + longitude_cells + 1)
+        # neighbouring cells share corners, so each corner is only checked once
+        corners_within = {(corner_latitude, corner_longitude):
+                          haversine_distance(latitude, longitude, corner_latitude * self.cell_size,
+                                             corner_longitude * self.cell_size) <= radius
+                          for corner_latitude in range(latitude_range.start, latitude_range.stop + 1)
+                          for corner_longitude in range(longitude_range.start, longitude_range.stop + 1)}
+
+        return [(latitude_cell, longitude_cell) for latitude_cell in latitude_range for longitude_cell in longitude_range
+                if corners_within[(latitude_cell, longitude_cell)] and corners_within[(latitude_cell + 1, longitude_cell)]
+                and corners_within[(latitude_cell, longitude_cell + 1)]
+                and corners_within[(latitude_cell + 1, longitude_cell + 1)]]
+
+    def _cell_span(self, latitude: float, radius: float) -> Tuple[int, int]:
+        """Private helper function to find the number of cells to scan in each direction to cover radius meters"""
+        return math.ceil(radius / METERS_PER_DEGREE_LATITUDE / self.cell_size), \
+            math.ceil(radius / self.cell_size
+                      / (METERS_PER_DEGREE_LATITUDE * max(math.cos(math.radians(latitude)), 0.01)))
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        """Private helper function to find the grid cell containing the given coordinates"""
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size)
@@ -0,0 +1,45 @@
+"""Helpers to format Discord messages"""
+from typing import List
+
+from .constants import DISCORD_MESSAGE_LIMIT, MENTION_PLACEHOLDER
+
+
+def split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT) -> List[str]:
+    """Splits text into as few messages under limit characters as possible, preferring to split between lines"""
+    messages = []
+    current = ''
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                messages.append(current)
+                current = ''
+            messages.append(line[:limit])
+            line = line[limit:]
+
+        if len(current) + len(line) > limit:
+            messages.append(current)
+            current = ''
+        current += line
+
+    if current or not messages:
+        messages.append(current)
+    return messages
+
+
+def render_notification(message: str, user_ids: List[int], limit: int = DISCORD_MESSAGE_LIMIT) -> List[str]:
+    """Fills in a notification message's mention with every one of the given users, the users are spread
+    across as many messages as it takes to keep each one under limit characters"""
+    base_length = len(message) - len(MENTION_PLACEHOLDER) if MENTION_PLACEHOLDER in message else len(message)
+    groups = [[]]
+    group_length = 0
+    for mention in [f'<@{user_id}>' for user_id in user_ids]:
+        added_length = len(mention) + (2 if groups[-1] else 0)
+        if groups[-1] and base_length + group_length + added_length > limit:
+            groups.append([])
+            group_length = 0
+            added_length = len(mention)
+        groups[-1].append(mention)
+        group_length += added_length
+
+    return [part for group in groups
+            for part in split_message(message.replace(MENTION_PLACEHOLDER, ', '.join(group)), limit)]
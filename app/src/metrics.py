@@ -0,0 +1,53 @@
+"""Prometheus metrics shared by the bot and notification workers"""
+from typing import Iterable, Optional, Union
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from .constants import METRICS_BIND_ADDRESS
+from .singleFlight import SingleFlight, AsyncSingleFlight
+from .ttlCache import TTLCache
+
+MY_TURN_REQUEST_LATENCY = Histogram('myturn_request_latency_seconds',
+                                    'Latency of MyTurn API requests including retries', ['endpoint'])
+MY_TURN_REQUEST_ERRORS = Counter('myturn_request_errors_total',
+                                 'MyTurn API responses that were rate limited, server errors or connection errors',
+                                 ['endpoint', 'status'])
+COMMAND_LATENCY = Histogram('bot_command_latency_seconds', 'Time taken to handle each bot command', ['command'])
+LOOP_ITERATION_DURATION = Histogram('loop_iteration_duration_seconds',
+                                    'Time taken by each iteration of a background loop', ['loop'])
+PENDING_NOTIFICATIONS = Gauge('pending_notifications', 'Notification requests that haven\'t been fulfilled yet')
+ACTIVE_JOBS = Gauge('active_notification_jobs', 'Notification jobs that are still running')
+CACHE_HITS = Gauge('response_cache_hits', 'Response cache hits', ['cache'])
+CACHE_MISSES = Gauge('response_cache_misses', 'Response cache misses', ['cache'])
+CACHE_SIZE = Gauge('response_cache_size', 'Entries in the response cache', ['cache'])
+COALESCED_CALLS = Gauge('coalesced_calls', 'Cache misses that shared another caller\'s in-flight request', ['cache'])
+IN_FLIGHT_CALLS = Gauge('in_flight_calls', 'Distinct requests currently in flight after coalescing', ['cache'])
+
+
+def start_metrics_server(port: int):
+    """Serves every metric in Prometheus text format on the given port, only reachable locally"""
+    start_http_server(port, addr=METRICS_BIND_ADDRESS)
+
+
+def observe_request(endpoint: str, statuses: Iterable[Optional[int]], latency: float):
+    """Records a finished MyTurn request, statuses holds the status of every attempt with None for
+    connection errors"""
+    MY_TURN_REQUEST_LATENCY.labels(endpoint).observe(latency)
+    for status in statuses:
+        if status is None:
+            MY_TURN_REQUEST_ERRORS.labels(endpoint, 'connection_error').inc()
+        elif status == 429 or status >= 500:
+            MY_TURN_REQUEST_ERRORS.labels(endpoint, str(status)).inc()
+
+
+def register_cache(name: str, cache: TTLCache):
+    """Exposes the given cache's counters, they're read whenever metrics are scraped"""
+    CACHE_HITS.labels(name).set_function(lambda: cache.hits)
+    CACHE_MISSES.labels(name).set_function(lambda: cache.misses)
+    CACHE_SIZE.labels(name).set_function(lambda: len(cache))
+
+
+def register_single_flight(name: str, single_flight: Union[SingleFlight, AsyncSingleFlight]):
+    """Exposes the given single flight's counters, they're read whenever metrics are scraped"""
+    COALESCED_CALLS.labels(name).set_function(lambda: single_flight.coalesced)
+    IN_FLIGHT_CALLS.labels(name).set_function(lambda: len(single_flight))
@@ -1,141 +1,472 @@
 """Python API wrapper around My Turn CA API"""
+import asyncio
 import functools
 import json
 import logging
-import operator
-from datetime import date, datetime
-from typing import List
+import random
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, Future, wait
+from datetime import date, datetime, time
+from time import perf_counter
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Tuple, Optional, TYPE_CHECKING
 
-import pytz
 from requests.adapters import HTTPAdapter
 from requests.models import Response
 from requests_toolbelt.sessions import BaseUrlSession
+from urllib3.util import Retry
 
+from .apiExceptions import VaccineDataRejected
 from .constants import MY_TURN_URL, ELIGIBLE_REQUEST_BODY, DEFAULT_RETRY_STRATEGY, ELIGIBILITY_URL, LOCATIONS_URL, \
     LOCATION_AVAILABILITY_URL, LOCATION_AVAILABILITY_SLOTS_URL, JSON_DECODE_ERROR_MSG, GOOD_BOT_HEADER, \
-    REQUEST_HEADERS, LOCATION_POOLS
+    REQUEST_HEADERS, LOCATION_POOLS, DEFAULT_MAX_WORKERS, RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MAX_SIZE, \
+    LOCATION_COORDINATE_PRECISION, DEFAULT_RETRY_PARAMETERS, ERROR_RATE_WINDOW, PACIFIC_TIMEZONE, \
+    REQUEST_LOG_SAMPLE_RATE, VACCINE_DATA_REJECTED_STATUS
+from .metrics import observe_request
+from .rateLimiter import RateLimiter, RateLimitedRetry, endpoint_name
+from .singleFlight import SingleFlight, AsyncSingleFlight
+from .trafficArchive import TrafficRecorder, RecordingAdapter, ReplayAdapter, load_archive
+from .ttlCache import TTLCache, MISSING
+from .vaccineDataCache import VaccineDataCache
+
+if TYPE_CHECKING:
+    import aiohttp
+    from .locationCatalogue import LocationCatalogue
 
 
 class Location:
-    """Class to represent a vaccination location"""
+    """Class to represent a vaccination location, instances are immutable and hashable"""
+    __slots__ = ('location_id', 'name', 'booking_type', 'vaccine_data', 'distance_in_meters', 'address', 'latitude',
+                 'longitude')
+    # the slots are set through object.__setattr__, so they're declared here for linters and type checkers
+    location_id: str
+    name: str
+    booking_type: str
+    vaccine_data: str
+    distance_in_meters: float
+    address: str
+    latitude: Optional[float]
+    longitude: Optional[float]
+
     def __init__(self, location_id: str, name: str, booking_type: str, vaccine_data: str,
-                 distance: float, address: str):
-        self.location_id = location_id
-        self.name = name
-        self.booking_type = booking_type
-        self.vaccine_data = vaccine_data
-        self.distance_in_meters = distance
-        self.address = address
+                 distance: float, address: str, latitude: Optional[float] = None, longitude: Optional[float] = None):
+        object.__setattr__(self, 'location_id', location_id)
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'booking_type', booking_type)
+        object.__setattr__(self, 'vaccine_data', vaccine_data)
+        object.__setattr__(self, 'distance_in_meters', distance)
+        object.__setattr__(self, 'address', address)
+        object.__setattr__(self, 'latitude', latitude)
+        object.__setattr__(self, 'longitude', longitude)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __reduce__(self):
+        return type(self), (self.location_id, self.name, self.booking_type, self.vaccine_data,
+                            self.distance_in_meters, self.address, self.latitude, self.longitude)
 
     def __eq__(self, other):
-        return self.location_id == other.location_id \
-               and self.name == other.name \
-               and self.booking_type == other.booking_type \
-               and self.vaccine_data == other.vaccine_data \
-               and self.distance_in_meters == other.distance_in_meters \
-               and self.address == other.address
+        if self is other:
+            return True
+        if not isinstance(other, Location):
+            return NotImplemented
+        # the ids differ for nearly every pair that isn't equal, so they're compared first
+        return self.location_id == other.location_id and self._identity() == other._identity()
+
+    def __hash__(self):
+        return hash(self._identity())
+
+    def _identity(self) -> tuple:
+        """Private helper function returning the fields locations are compared on, the coordinates
+        aren't part of a location's identity"""
+        return self.location_id, self.name, self.booking_type, self.vaccine_data, self.distance_in_meters, \
+            self.address
 
     def __str__(self):
         return f'{self.name} {self.distance_in_meters * 0.000621:.2f} mile(s) away'
 
 
 class LocationAvailability:
-    """Class to represent a vaccination location's availability"""
+    """Class to represent a vaccination location's availability, instances are immutable and hashable"""
+    __slots__ = ('location', 'dates_available')
+    location: Location
+    dates_available: Tuple[date, ...]
+
+    def __init__(self, location: Location, dates_available: Iterable[date]):
+        object.__setattr__(self, 'location', location)
+        object.__setattr__(self, 'dates_available', tuple(dates_available))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __reduce__(self):
+        return type(self), (self.location, self.dates_available)
+
     def __eq__(self, other):
+        if not isinstance(other, LocationAvailability):
+            return NotImplemented
         return self.location == other.location and self.dates_available == other.dates_available
 
-    def __init__(self, location: Location, dates_available: List[date]):
-        self.location = location
-        self.dates_available = dates_available
+    def __hash__(self):
+        return hash((self.location, self.dates_available))
 
 
 class LocationAvailabilitySlots:
-    """Class to represent individual available appointments at a given vaccination location"""
-    def __init__(self, location: Location, slots: List[datetime]):
-        self.location = location
-        self.slots = slots
+    """Class to represent individual available appointments at a given vaccination location, instances are
+    immutable and hashable. Slots are stored as an array of epoch seconds, slots converts them back to datetimes"""
+    __slots__ = ('location', 'epochs')
+    location: Location
+    epochs: array
+
+    def __init__(self, location: Location, slots: Iterable[datetime] = (), epochs: Optional[Iterable[int]] = None):
+        object.__setattr__(self, 'location', location)
+        object.__setattr__(self, 'epochs', array('q', epochs if epochs is not None
+                                                 else (int(slot.timestamp()) for slot in slots)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __reduce__(self):
+        return type(self), (self.location, (), self.epochs)
+
+    @property
+    def slots(self) -> List[datetime]:
+        """The slots as Pacific datetimes"""
+        return [datetime.fromtimestamp(epoch, tz=PACIFIC_TIMEZONE) for epoch in self.epochs]
 
     def __eq__(self, other):
-        return self.location == other.location and self.slots == other.slots
+        if not isinstance(other, LocationAvailabilitySlots):
+            return NotImplemented
+        return self.location == other.location and self.epochs == other.epochs
+
+    def __hash__(self):
+        return hash((self.location, self.epochs.tobytes()))
+
+
+def _eligibility_vaccine_data(response_json: dict) -> str:
+    """Private helper function to pull the vaccine data out of an /eligibility response"""
+    if response_json['eligible'] is False:
+        raise RuntimeError('something is wrong, default /eligibility body returned \'eligible\' = False')
+
+    return response_json['vaccineData']
+
+
+def _locations_cache_key(latitude: float, longitude: float, from_date: str,
+                         precision: Optional[int] = LOCATION_COORDINATE_PRECISION) -> tuple:
+    """Private helper function to build a location search's cache key, nearby coordinates are rounded to the same
+    point so they share cached results while the search itself is sent with the exact coordinates. Without a
+    precision only searches from the exact same point share results"""
+    if precision is not None:
+        latitude, longitude = round(float(latitude), precision), round(float(longitude), precision)
+    return LOCATIONS_URL, latitude, longitude, from_date
+
+
+def _locations_body(latitude: float, longitude: float, from_date: str, vaccine_data: str) -> dict:
+    """Private helper function to build a locations/search request body"""
+    return {
+        'location': {
+            'lat': latitude,
+            'lng': longitude
+        },
+        'fromDate': from_date,
+        'vaccineData': vaccine_data,
+        'locationQuery': {
+            'includePools': LOCATION_POOLS,
+            'excludeTags': [],
+            'includeTags': []
+        }
+    }
+
+
+def _parse_locations(response_json: dict) -> List[Location]:
+    """Private helper function to deserialize a locations/search response"""
+    return [Location(location_id=x['extId'], name=x['name'], address=x['displayAddress'], booking_type=x['type'],
+                     vaccine_data=x['vaccineData'], distance=x['distanceInMeters'],
+                     latitude=(x.get('location') or {}).get('lat'), longitude=(x.get('location') or {}).get('lng'))
+            for x in response_json['locations']]
+
+
+def _availability_body(location: Location, start_date: date, end_date: date) -> dict:
+    """Private helper function to build an availability request body"""
+    return {
+        'startDate': start_date.strftime('%Y-%m-%d'),
+        'endDate': end_date.strftime('%Y-%m-%d'),
+        'vaccineData': location.vaccine_data,
+        'doseNumber': 1
+    }
+
+
+def _parse_availability(location: Location, response_json: dict) -> LocationAvailability:
+    """Private helper function to deserialize an availability response"""
+    return LocationAvailability(location=location,
+                                dates_available=[date.fromisoformat(x['date'])
+                                                 for x in response_json['availability'] if x['available'] is True])
+
+
+def _slots_url(location: Location, start_date: date) -> str:
+    """Private helper function to build a slots url"""
+    return LOCATION_AVAILABILITY_SLOTS_URL.format(location_id=location.location_id,
+                                                  start_date=start_date.strftime('%Y-%m-%d'))
+
+
+def _parse_slots(location: Location, start_date: date, response_json: dict) -> LocationAvailabilitySlots:
+    """Private helper function to deserialize a slots response, filtering out slots that already occurred"""
+    day_start = _combine_date_and_time(start_date, '0:00:00').timestamp()
+    cutoff = datetime.now(tz=PACIFIC_TIMEZONE).timestamp()
+    epochs = array('q')
+    for x in response_json['slotsWithAvailability']:
+        epoch = day_start + _parse_seconds(x['localStartTime'])
+        if epoch > cutoff:
+            epochs.append(int(epoch))
+
+    return LocationAvailabilitySlots(location=location, epochs=epochs)
+
+
+def _combine_date_and_time(start_date: date, timestamp: str) -> datetime:
+    """Private helper function to combine a date and timestamp"""
+    seconds = _parse_seconds(timestamp)
+    return datetime.combine(start_date, time(seconds // 3600, seconds // 60 % 60, seconds % 60),
+                            tzinfo=PACIFIC_TIMEZONE)
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_seconds(timestamp: str) -> int:
+    """Private helper function to parse an H:M:S timestamp into seconds since midnight, slots start at the same
+    handful of times every day so each timestamp is only parsed once"""
+    hour, minute, second = timestamp.split(':')
+    return int(hour) * 3600 + int(minute) * 60 + int(second)
+
+
+def _merge_appointments(location_dates: List[Tuple[int, Location, date]],
+                        all_slots: List[LocationAvailabilitySlots]) -> List[LocationAvailabilitySlots]:
+    """Private helper function to combine per-day slots into per-location appointments, location_dates holds
+    the position of each location so the original location order is preserved"""
+    slots_by_location = {}
+    for (index, _, _), location_slots in zip(location_dates, all_slots):
+        if location_slots.epochs:
+            # combines appointments on different days for the same location
+            _, epochs = slots_by_location.setdefault(index, (location_slots.location, array('q')))
+            epochs.extend(location_slots.epochs)
+
+    return [LocationAvailabilitySlots(location=location, epochs=epochs)
+            for location, epochs in (slots_by_location[index] for index in sorted(slots_by_location))]
+
+
+def _record_request(logger: logging.Logger, sample_rate: float, endpoint: str, statuses: List[Optional[int]],
+                    size: int, latency: float):
+    """Private helper function to log and count a finished request, statuses holds the status of every attempt
+    with None for connection errors. Failed and retried requests are always logged while the rest are sampled,
+    the fields are also passed as extra so structured log handlers can pick them up"""
+    observe_request(endpoint=endpoint, statuses=statuses, latency=latency)
+    status = statuses[-1]
+    retries = len(statuses) - 1
+    failed = status is None or status >= 400
+    if not (failed or retries or random.random() < sample_rate):
+        return
+
+    logger.log(logging.WARNING if failed else logging.INFO,
+               'request endpoint=%s status=%s bytes=%d retries=%d latency_ms=%.1f',
+               endpoint, status, size, retries, latency * 1000,
+               extra={'endpoint': endpoint, 'status': status, 'bytes': size, 'retries': retries, 'latency': latency})
 
 
 class MyTurnCA:
-    """Main API class"""
-    def __init__(self, api_key: str):
+    """Main API class, its traffic can be recorded to an archive with record_to and served back from one
+    with replay_from"""
+    def __init__(self, api_key: str, max_workers: int = DEFAULT_MAX_WORKERS,
+                 cache_ttl: float = RESPONSE_CACHE_TTL_SECONDS, cache_size: int = RESPONSE_CACHE_MAX_SIZE,
+                 location_catalogue: Optional['LocationCatalogue'] = None, rate_limiter: Optional[RateLimiter] = None,
+                 log_sample_rate: float = REQUEST_LOG_SAMPLE_RATE, base_url: str = MY_TURN_URL,
+                 record_to: Optional[str] = None, replay_from: Optional[str] = None, replay_realtime: bool = False,
+                 vaccine_data_cache: Optional[VaccineDataCache] = None):
         self.logger = logging.getLogger(__name__)
-        self.session = BaseUrlSession(base_url=MY_TURN_URL)
-        self.session.mount('https://', HTTPAdapter(max_retries=DEFAULT_RETRY_STRATEGY))
+        self.log_sample_rate = log_sample_rate
+        self.base_url = base_url
+        self.max_workers = max_workers
+        self.cache = TTLCache(ttl=cache_ttl, max_size=cache_size)
+        # cache misses for the same key share one request, keyed the same way as the cache
+        self.single_flight = SingleFlight()
+        self.location_catalogue = location_catalogue
+        self.rate_limiter = rate_limiter
+        self.vaccine_data_cache = vaccine_data_cache if vaccine_data_cache is not None else VaccineDataCache()
+        # True for each recent request that failed or had to be retried, see error_rate
+        self.request_errors = deque(maxlen=ERROR_RATE_WINDOW)
+        self.session = BaseUrlSession(base_url=base_url)
+        retry_strategy = DEFAULT_RETRY_STRATEGY if rate_limiter is None \
+            else RateLimitedRetry(rate_limiter=rate_limiter, **DEFAULT_RETRY_PARAMETERS)
+        # the connection pool has to be at least as big as the worker pool, otherwise
+        # concurrent requests end up throwing away and re-opening connections
+        adapter_options = {'max_retries': retry_strategy, 'pool_maxsize': max(max_workers, 1)}
+        if replay_from is not None:
+            adapter = ReplayAdapter(load_archive(replay_from), realtime=replay_realtime)
+        elif record_to is not None:
+            adapter = RecordingAdapter(TrafficRecorder(record_to), **adapter_options)
+        else:
+            adapter = HTTPAdapter(**adapter_options)
+        self.session.mount(base_url, adapter)
         self.session.headers.update({**REQUEST_HEADERS, GOOD_BOT_HEADER: api_key})
-        self.vaccine_data = self._get_vaccine_data()
+        # only blocks when no process has fetched vaccine data yet, otherwise it's refreshed in the background
+        if self.vaccine_data_cache.get() is None:
+            self.vaccine_data_cache.refresh(self._get_vaccine_data)
+
+    def close(self):
+        """Closes the underlying HTTP session, this is what finishes writing the archive in record mode"""
+        self.session.close()
+
+    @property
+    def error_rate(self) -> float:
+        """Fraction of recent requests that failed or had to be retried"""
+        request_errors = list(self.request_errors)
+        return sum(request_errors) / len(request_errors) if request_errors else 0.0
+
+    @property
+    def vaccine_data(self) -> str:
+        """vaccineData sent with location searches, refreshed in the background once it's about to expire"""
+        if self.vaccine_data_cache.needs_refresh():
+            self.vaccine_data_cache.refresh_in_background(self._get_vaccine_data)
+        return self.vaccine_data_cache.get()
+
+    @vaccine_data.setter
+    def vaccine_data(self, vaccine_data: str):
+        self.vaccine_data_cache.put(vaccine_data)
 
     def _get_vaccine_data(self) -> str:
         """Retrieve initial vaccine data"""
-        response = self._send_request(url=ELIGIBILITY_URL, body=ELIGIBLE_REQUEST_BODY).json()
-        if response['eligible'] is False:
-            raise RuntimeError('something is wrong, default /eligibility body returned \'eligible\' = False')
-
-        return response['vaccineData']
+        return _eligibility_vaccine_data(self._send_request(url=ELIGIBILITY_URL, body=ELIGIBLE_REQUEST_BODY).json())
 
     def get_locations(self, latitude: float, longitude: float) -> List[Location]:
-        """Gets available locations near the given coordinates"""
-        body = {
-            'location': {
-                'lat': latitude,
-                'lng': longitude
-            },
-            'fromDate': datetime.now(tz=pytz.timezone('US/Pacific')).strftime('%Y-%m-%d'),
-            'vaccineData': self.vaccine_data,
-            'locationQuery': {
-                'includePools': LOCATION_POOLS,
-                'excludeTags': [],
-                'includeTags': []
-            }
-        }
+        """Gets available locations near the given coordinates, served from the location catalogue when it's fresh
+        and knows every location near them"""
+        if self.location_catalogue is not None and self.location_catalogue.is_fresh():
+            locations = self.location_catalogue.nearby(latitude=latitude, longitude=longitude)
+            if locations is not None:
+                return locations
+
+        return self._search_locations(latitude=latitude, longitude=longitude)
+
+    def refresh_location_catalogue(self, seed_points: List[Tuple[float, float]]):
+        """Rebuilds the location catalogue from location searches around each of the given seed points, plus
+        a round of searches around the seed points whose search came back full, unless it isn't due or another
+        process is already rebuilding it"""
+        # searches are only shared with searches from the exact same point, since the catalogue measures what
+        # they cover from the point they were sent from
+        def search(points: List[Tuple[float, float]]) -> List[List[Location]]:
+            return self._map(lambda point: self._search_locations(latitude=point[0], longitude=point[1],
+                                                                  precision=None), points)
+
+        if not self.location_catalogue.start_refresh():
+            return
 
-        response = self._send_request(url=LOCATIONS_URL, body=body)
         try:
-            return [Location(location_id=x['extId'], name=x['name'], address=x['displayAddress'], booking_type=x['type'],
-                             vaccine_data=x['vaccineData'], distance=x['distanceInMeters'])
-                    for x in response.json()['locations']]
-        except json.JSONDecodeError:
-            self.logger.error(JSON_DECODE_ERROR_MSG.format(body=response.text))
-            return []
+            search_results = search(seed_points)
+            refinement_points = self.location_catalogue.refinement_points(search_results, seed_points)
+            search_results += search(refinement_points)
+            self.location_catalogue.replace(search_results, seed_points + refinement_points)
+        finally:
+            self.location_catalogue.finish_refresh()
+        self.logger.info(f'refreshed location catalogue with {len(self.location_catalogue)} location(s) '
+                         f'from {len(search_results)} search(es)')
+
+    def _search_locations(self, latitude: float, longitude: float,
+                          precision: Optional[int] = LOCATION_COORDINATE_PRECISION) -> List[Location]:
+        """Private helper function to search for locations near the given coordinates using the API, results are
+        cached for searches within precision decimal places of the coordinates"""
+        from_date = datetime.now(tz=PACIFIC_TIMEZONE).strftime('%Y-%m-%d')
+        cache_key = _locations_cache_key(latitude=latitude, longitude=longitude, from_date=from_date,
+                                         precision=precision)
+        locations = self.cache.get(cache_key)
+        if locations is not MISSING:
+            return locations
+
+        def fetch() -> List[Location]:
+            def send() -> Response:
+                return self._send_request(url=LOCATIONS_URL,
+                                          body=_locations_body(latitude=latitude, longitude=longitude,
+                                                               from_date=from_date, vaccine_data=self.vaccine_data))
+
+            try:
+                response = send()
+            except VaccineDataRejected:
+                # the rejected vaccine data was expired, so it's retried once with freshly fetched vaccine data,
+                # concurrent searches rejected at the same time all wait on the same refresh
+                self.vaccine_data_cache.refresh(self._get_vaccine_data)
+                try:
+                    response = send()
+                except VaccineDataRejected:
+                    self.logger.error('upstream rejected freshly fetched vaccine data, giving up on location search')
+                    return []
+
+            try:
+                fetched = _parse_locations(response.json())
+            except json.JSONDecodeError:
+                self.logger.error(JSON_DECODE_ERROR_MSG.format(body=response.text))
+                return []
+
+            self.cache.put(cache_key, fetched)
+            return fetched
+
+        return self.single_flight.do(cache_key, fetch)
 
     def get_availability(self, location: Location, start_date: date, end_date: date) -> LocationAvailability:
         """Gets a given vaccination location's availability"""
-        body = {
-            'startDate': start_date.strftime('%Y-%m-%d'),
-            'endDate': end_date.strftime('%Y-%m-%d'),
-            'vaccineData': location.vaccine_data,
-            'doseNumber': 1
-        }
+        cache_key = (LOCATION_AVAILABILITY_URL, location.location_id, start_date, end_date)
+        # only the dates_available are cached since the same location is returned with a different distance
+        # depending on where it was searched from
+        cached = self.cache.get(cache_key)
+        if cached is not MISSING:
+            return LocationAvailability(location=location, dates_available=cached)
 
-        response = self._send_request(url=LOCATION_AVAILABILITY_URL.format(location_id=location.location_id), body=body)
-        try:
-            return LocationAvailability(location=location,
-                                        dates_available=[datetime.strptime(x['date'], '%Y-%m-%d').date()
-                                                         for x in response.json()['availability'] if x['available'] is True])
-        except json.JSONDecodeError:
-            self.logger.error(JSON_DECODE_ERROR_MSG.format(body=response.text))
-            return LocationAvailability(location=location, dates_available=[])
+        def fetch() -> Tuple[date, ...]:
+            response = self._send_request(url=LOCATION_AVAILABILITY_URL.format(location_id=location.location_id),
+                                          body=_availability_body(location=location, start_date=start_date,
+                                                                  end_date=end_date))
+            try:
+                availability = _parse_availability(location=location, response_json=response.json())
+            except json.JSONDecodeError:
+                self.logger.error(JSON_DECODE_ERROR_MSG.format(body=response.text))
+                return ()
+
+            self.cache.put(cache_key, availability.dates_available)
+            return availability.dates_available
+
+        return LocationAvailability(location=location, dates_available=self.single_flight.do(cache_key, fetch))
 
     def get_slots(self, location: Location, start_date: date) -> LocationAvailabilitySlots:
         """Gets a given location's available appointments"""
-        body = {
-            'vaccineData': location.vaccine_data
-        }
+        cache_key = (LOCATION_AVAILABILITY_SLOTS_URL, location.location_id, start_date)
+        cached = self.cache.get(cache_key)
+        if cached is not MISSING:
+            return LocationAvailabilitySlots(location=location, epochs=cached)
 
-        response = self._send_request(url=LOCATION_AVAILABILITY_SLOTS_URL.format(location_id=location.location_id,
-                                                                                 start_date=start_date.strftime('%Y-%m-%d')),
-                                      body=body)
-        try:
-            return LocationAvailabilitySlots(location=location,
-                                             slots=[self._combine_date_and_time(start_date, x['localStartTime'])
-                                                    for x in response.json()['slotsWithAvailability']
-                                                    if self._combine_date_and_time(start_date, x['localStartTime']) > datetime.now(tz=pytz.timezone('US/Pacific'))])
-        except json.JSONDecodeError:
-            self.logger.error(JSON_DECODE_ERROR_MSG.format(body=response.text))
-            return LocationAvailabilitySlots(location=location, slots=[])
+        def fetch() -> array:
+            response = self._send_request(url=_slots_url(location=location, start_date=start_date),
+                                          body={'vaccineData': location.vaccine_data})
+            try:
+                slots = _parse_slots(location=location, start_date=start_date, response_json=response.json())
+            except json.JSONDecodeError:
+                self.logger.error(JSON_DECODE_ERROR_MSG.format(body=response.text))
+                return array('q')
+
+            self.cache.put(cache_key, slots.epochs)
+            return slots.epochs
+
+        return LocationAvailabilitySlots(location=location, epochs=self.single_flight.do(cache_key, fetch))
+
+    def get_locations_for_coordinates(self, coordinates: List[Tuple[float, float]]) -> List[List[Location]]:
+        """Gets the locations near each (latitude, longitude) pair, results are in the same order as the pairs"""
+        return self._map(lambda point: self.get_locations(latitude=point[0], longitude=point[1]), coordinates)
+
+    def get_availabilities(self, locations: List[Location], start_date: date,
+                           end_date: date) -> List[LocationAvailability]:
+        """Gets the availability of each of the given locations, results are in the same order as the locations"""
+        return self._map(lambda location: self.get_availability(location=location, start_date=start_date,
+                                                                end_date=end_date), locations)
+
+    def get_slots_for_dates(self, location_dates: List[Tuple[Location, date]]) -> List[LocationAvailabilitySlots]:
+        """Gets the available appointments for each (location, date) pair, results are in the same order as the pairs"""
+        return self._map(lambda location_date: self.get_slots(location=location_date[0], start_date=location_date[1]),
+                         location_dates)
 
     def get_appointments(self, latitude: float, longitude: float, start_date: date, end_date: date) -> List[LocationAvailabilitySlots]:
         """Retrieves available appointments from all vaccination locations near the given coordinates"""
@@ -146,34 +477,440 @@ class MyTurnCA:
         if start_date > end_date:
             raise ValueError('Provided start_date must be before end_date')
 
-        appointments = []
-        for location in locations:
-            days_available = self.get_availability(location=location, start_date=start_date, end_date=end_date).dates_available
-            if not days_available:
-                continue
+        return self.get_appointments_for_locations(locations=locations, start_date=start_date, end_date=end_date)
 
-            location_appointments = [location_appointment for location_appointment in
-                                     [self.get_slots(location=location, start_date=day_available)
-                                      for day_available in days_available] if location_appointment.slots]
-            if not location_appointments:
-                continue
+    def get_appointments_for_locations(self, locations: List[Location], start_date: date,
+                                       end_date: date) -> List[LocationAvailabilitySlots]:
+        """Retrieves available appointments from the given vaccination locations, preserving their order"""
+        availabilities = self.get_availabilities(locations=locations, start_date=start_date, end_date=end_date)
+        location_dates = [(index, availability.location, day_available)
+                          for index, availability in enumerate(availabilities)
+                          for day_available in availability.dates_available]
+        if not location_dates:
+            return []
 
-            # combines appointments on different days for the same location
-            appointments.append(LocationAvailabilitySlots(location=location_appointments[0].location,
-                                                          slots=functools.reduce(operator.add,
-                                                                                 [location_appointment.slots for location_appointment in location_appointments])))
+        return _merge_appointments(location_dates=location_dates,
+                                   all_slots=self.get_slots_for_dates([(location, day)
+                                                                       for _, location, day in location_dates]))
 
-        return appointments
+    def iter_appointments(self, latitude: float, longitude: float, start_date: date,
+                          end_date: date) -> Iterator[LocationAvailabilitySlots]:
+        """Same as get_appointments but yields each location's appointments as soon as they're resolved"""
+        locations = self.get_locations(latitude=latitude, longitude=longitude)
+        if not locations:
+            return
+
+        if start_date > end_date:
+            raise ValueError('Provided start_date must be before end_date')
+
+        yield from self.iter_appointments_for_locations(locations=locations, start_date=start_date, end_date=end_date)
+
+    def iter_appointments_for_locations(self, locations: List[Location], start_date: date,
+                                        end_date: date) -> Iterator[LocationAvailabilitySlots]:
+        """Yields the available appointments of each of the given locations in the order they're resolved,
+        locations without any are skipped. Closing the generator early cancels the requests that haven't started"""
+        if self.max_workers <= 1 or len(locations) <= 1:
+            for location in locations:
+                days = self.get_availability(location=location, start_date=start_date,
+                                             end_date=end_date).dates_available
+                yield from _merge_appointments(location_dates=[(0, location, day) for day in days],
+                                               all_slots=[self.get_slots(location=location, start_date=day)
+                                                          for day in days])
+            return
+
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(locations)))
+        # availability requests map to their location's index, slots requests to the index and date
+        requests: Dict[Future, Tuple[int, Optional[date]]] = {
+            executor.submit(self.get_availability, location=location, start_date=start_date, end_date=end_date):
+                (index, None)
+            for index, location in enumerate(locations)}
+        # location index -> number of dates whose slots are still being fetched and the slots fetched so far
+        remaining: Dict[int, int] = {}
+        fetched: Dict[int, List[Tuple[date, LocationAvailabilitySlots]]] = {}
+        try:
+            while requests:
+                done, _ = wait(requests, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, day = requests.pop(future)
+                    if day is None:
+                        # slots are requested from the same pool as soon as the location's availability is known
+                        for day_available in future.result().dates_available:
+                            requests[executor.submit(self.get_slots, location=locations[index],
+                                                     start_date=day_available)] = (index, day_available)
+                            remaining[index] = remaining.get(index, 0) + 1
+                        continue
+
+                    fetched.setdefault(index, []).append((day, future.result()))
+                    remaining[index] -= 1
+                    if not remaining[index]:
+                        location_slots = sorted(fetched.pop(index), key=lambda day_slots: day_slots[0])
+                        yield from _merge_appointments(
+                            location_dates=[(0, locations[index], day) for day, _ in location_slots],
+                            all_slots=[slots for _, slots in location_slots])
+        finally:
+            for future in requests:
+                future.cancel()
+            executor.shutdown(wait=False)
 
-    @staticmethod
-    def _combine_date_and_time(start_date: date, timestamp: str) -> datetime:
-        """Private helper function to combine a date and timestamp"""
-        return datetime.combine(start_date, datetime.strptime(timestamp, '%H:%M:%S').time(),
-                                tzinfo=pytz.timezone('US/Pacific'))
+    def _map(self, func: Callable, items: Iterable) -> list:
+        """Private helper function to apply func to each item using the worker pool, preserving order"""
+        items = list(items)
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as executor:
+            return list(executor.map(func, items))
 
     def _send_request(self, url: str, body: dict) -> Response:
-        """Private helper function to make HTTP POST requests"""
-        self.logger.info(f'sending request to {MY_TURN_URL}{url} with body - {body}')
-        response = self.session.post(url=url, json=body)
-        self.logger.info(f'got response from /{url} - {response.__dict__}')
-        return response
\ No newline at end of file
+        """Private helper function to make HTTP POST requests, raises VaccineDataRejected if a location search's
+        vaccineData was rejected"""
+        endpoint = endpoint_name(url)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(endpoint)
+        start = perf_counter()
+        try:
+            response = self.session.post(url=url, json=body)
+        except Exception:
+            self.request_errors.append(True)
+            _record_request(self.logger, self.log_sample_rate, endpoint=endpoint, statuses=[None], size=0,
+                            latency=perf_counter() - start)
+            raise
+
+        latency = perf_counter() - start
+        retries = getattr(response.raw, 'retries', None)
+        statuses = [attempt.status for attempt in retries.history] if retries is not None else []
+        statuses.append(response.status_code)
+        self.request_errors.append(response.status_code >= 400 or len(statuses) > 1)
+        _record_request(self.logger, self.log_sample_rate, endpoint=endpoint, statuses=statuses,
+                        size=len(response.content), latency=latency)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('request to %s%s with body %s got response %s', self.base_url, url, body,
+                              response.text)
+        if endpoint == 'locations' and response.status_code == VACCINE_DATA_REJECTED_STATUS:
+            self.vaccine_data_cache.expire(body['vaccineData'])
+            raise VaccineDataRejected
+        return response
+
+
+class AsyncMyTurnCA:
+    """Asyncio API class with the same surface as MyTurnCA, requests share a pooled keep-alive connection
+    and are retried the same way DEFAULT_RETRY_STRATEGY retries MyTurnCA's requests"""
+    def __init__(self, api_key: str, max_connections: int = DEFAULT_MAX_WORKERS,
+                 retry_strategy: Retry = DEFAULT_RETRY_STRATEGY, cache_ttl: float = RESPONSE_CACHE_TTL_SECONDS,
+                 cache_size: int = RESPONSE_CACHE_MAX_SIZE, location_catalogue: Optional['LocationCatalogue'] = None,
+                 rate_limiter: Optional[RateLimiter] = None, log_sample_rate: float = REQUEST_LOG_SAMPLE_RATE,
+                 base_url: str = MY_TURN_URL, vaccine_data_cache: Optional[VaccineDataCache] = None):
+        self.logger = logging.getLogger(__name__)
+        self.log_sample_rate = log_sample_rate
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.cache = TTLCache(ttl=cache_ttl, max_size=cache_size)
+        # cache misses for the same key share one request, keyed the same way as the cache
+        self.single_flight = AsyncSingleFlight()
+        self.location_catalogue = location_catalogue
+        self.rate_limiter = rate_limiter
+        self.retry_strategy = retry_strategy
+        self.headers = {**REQUEST_HEADERS, GOOD_BOT_HEADER: api_key}
+        self.session: Optional['aiohttp.ClientSession'] = None
+        self.vaccine_data_cache = vaccine_data_cache if vaccine_data_cache is not None else VaccineDataCache()
+        self._vaccine_data_lock: Optional[asyncio.Lock] = None
+        self._vaccine_data_refresh: Optional[asyncio.Task] = None
+
+    async def close(self):
+        """Closes the underlying HTTP session"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def _get_session(self) -> 'aiohttp.ClientSession':
+        """Private helper function to lazily create the HTTP session, it has to be created inside the event loop"""
+        # aiohttp is only imported once it's used so processes that only use MyTurnCA don't pay for it
+        import aiohttp
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections),
+                                                 headers=self.headers)
+        return self.session
+
+    @property
+    def vaccine_data(self) -> Optional[str]:
+        """vaccineData sent with location searches, None until it's been fetched or loaded from the shared cache"""
+        return self.vaccine_data_cache.get()
+
+    @vaccine_data.setter
+    def vaccine_data(self, vaccine_data: str):
+        self.vaccine_data_cache.put(vaccine_data)
+
+    async def _get_vaccine_data(self) -> str:
+        """Retrieve vaccine data, only the first caller actually sends the request when none is cached and
+        it's refreshed in the background once it's about to expire"""
+        if self.vaccine_data_cache.get() is None:
+            if self._vaccine_data_lock is None:
+                self._vaccine_data_lock = asyncio.Lock()
+            async with self._vaccine_data_lock:
+                if self.vaccine_data_cache.get() is None:
+                    self.vaccine_data_cache.put(await self._fetch_vaccine_data())
+        elif self.vaccine_data_cache.needs_refresh():
+            self._start_vaccine_data_refresh()
+        return self.vaccine_data_cache.get()
+
+    async def _fetch_vaccine_data(self) -> str:
+        """Private helper function to request new vaccine data"""
+        return _eligibility_vaccine_data(json.loads(await self._send_request(url=ELIGIBILITY_URL,
+                                                                             body=ELIGIBLE_REQUEST_BODY)))
+
+    def _start_vaccine_data_refresh(self) -> asyncio.Future:
+        """Private helper function to start refreshing the cached vaccine data in the background, or return the
+        refresh already in progress so every caller shares it"""
+        if self._vaccine_data_refresh is None or self._vaccine_data_refresh.done():
+            self._vaccine_data_refresh = asyncio.ensure_future(self._refresh_vaccine_data())
+        return self._vaccine_data_refresh
+
+    async def _refresh_vaccine_data(self):
+        """Private helper function to refresh the cached vaccine data, failures are retried on the next call"""
+        if not self.vaccine_data_cache.start_refresh():
+            return
+
+        vaccine_data = None
+        try:
+            vaccine_data = await self._fetch_vaccine_data()
+        except Exception as e:
+            self.logger.warning(f'failed to refresh vaccine data, still using the old one: {e}')
+        finally:
+            self.vaccine_data_cache.finish_refresh(vaccine_data)
+
+    async def get_locations(self, latitude: float, longitude: float) -> List[Location]:
+        """Gets available locations near the given coordinates, served from the location catalogue when it's fresh
+        and knows every location near them"""
+        if self.location_catalogue is not None and self.location_catalogue.is_fresh():
+            locations = self.location_catalogue.nearby(latitude=latitude, longitude=longitude)
+            if locations is not None:
+                return locations
+
+        return await self._search_locations(latitude=latitude, longitude=longitude)
+
+    async def refresh_location_catalogue(self, seed_points: List[Tuple[float, float]]):
+        """Rebuilds the location catalogue from location searches around each of the given seed points, plus
+        a round of searches around the seed points whose search came back full, unless it isn't due or another
+        process is already rebuilding it"""
+        # searches are only shared with searches from the exact same point, since the catalogue measures what
+        # they cover from the point they were sent from
+        async def search(points: List[Tuple[float, float]]) -> List[List[Location]]:
+            return list(await asyncio.gather(*[self._search_locations(latitude=latitude, longitude=longitude,
+                                                                      precision=None)
+                                               for latitude, longitude in points]))
+
+        # the catalogue's lease and storage are blocking database calls, so they're kept off the event loop
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(None, self.location_catalogue.start_refresh):
+            return
+
+        try:
+            search_results = await search(seed_points)
+            refinement_points = self.location_catalogue.refinement_points(search_results, seed_points)
+            search_results += await search(refinement_points)
+            await loop.run_in_executor(None, self.location_catalogue.replace, search_results,
+                                       seed_points + refinement_points)
+        finally:
+            self.location_catalogue.finish_refresh()
+        self.logger.info(f'refreshed location catalogue with {len(self.location_catalogue)} location(s) '
+                         f'from {len(search_results)} search(es)')
+
+    async def _search_locations(self, latitude: float, longitude: float,
+                                precision: Optional[int] = LOCATION_COORDINATE_PRECISION) -> List[Location]:
+        """Private helper function to search for locations near the given coordinates using the API, results are
+        cached for searches within precision decimal places of the coordinates"""
+        from_date = datetime.now(tz=PACIFIC_TIMEZONE).strftime('%Y-%m-%d')
+        cache_key = _locations_cache_key(latitude=latitude, longitude=longitude, from_date=from_date,
+                                         precision=precision)
+        locations = self.cache.get(cache_key)
+        if locations is not MISSING:
+            return locations
+
+        async def fetch() -> List[Location]:
+            async def send() -> str:
+                return await self._send_request(url=LOCATIONS_URL,
+                                                body=_locations_body(latitude=latitude, longitude=longitude,
+                                                                     from_date=from_date,
+                                                                     vaccine_data=await self._get_vaccine_data()))
+
+            try:
+                text = await send()
+            except VaccineDataRejected:
+                # the rejected vaccine data was expired, so it's retried once with freshly fetched vaccine data,
+                # concurrent searches rejected at the same time all wait on the same refresh
+                await asyncio.shield(self._start_vaccine_data_refresh())
+                try:
+                    text = await send()
+                except VaccineDataRejected:
+                    self.logger.error('upstream rejected freshly fetched vaccine data, giving up on location search')
+                    return []
+
+            try:
+                fetched = _parse_locations(json.loads(text))
+            except json.JSONDecodeError:
+                self.logger.error(JSON_DECODE_ERROR_MSG.format(body=text))
+                return []
+
+            self.cache.put(cache_key, fetched)
+            return fetched
+
+        return await self.single_flight.do(cache_key, fetch)
+
+    async def get_availability(self, location: Location, start_date: date, end_date: date) -> LocationAvailability:
+        """Gets a given vaccination location's availability"""
+        cache_key = (LOCATION_AVAILABILITY_URL, location.location_id, start_date, end_date)
+        cached = self.cache.get(cache_key)
+        if cached is not MISSING:
+            return LocationAvailability(location=location, dates_available=cached)
+
+        async def fetch() -> Tuple[date, ...]:
+            text = await self._send_request(url=LOCATION_AVAILABILITY_URL.format(location_id=location.location_id),
+                                            body=_availability_body(location=location, start_date=start_date,
+                                                                    end_date=end_date))
+            try:
+                availability = _parse_availability(location=location, response_json=json.loads(text))
+            except json.JSONDecodeError:
+                self.logger.error(JSON_DECODE_ERROR_MSG.format(body=text))
+                return ()
+
+            self.cache.put(cache_key, availability.dates_available)
+            return availability.dates_available
+
+        return LocationAvailability(location=location, dates_available=await self.single_flight.do(cache_key, fetch))
+
+    async def get_slots(self, location: Location, start_date: date) -> LocationAvailabilitySlots:
+        """Gets a given location's available appointments"""
+        cache_key = (LOCATION_AVAILABILITY_SLOTS_URL, location.location_id, start_date)
+        cached = self.cache.get(cache_key)
+        if cached is not MISSING:
+            return LocationAvailabilitySlots(location=location, epochs=cached)
+
+        async def fetch() -> array:
+            text = await self._send_request(url=_slots_url(location=location, start_date=start_date),
+                                            body={'vaccineData': location.vaccine_data})
+            try:
+                slots = _parse_slots(location=location, start_date=start_date, response_json=json.loads(text))
+            except json.JSONDecodeError:
+                self.logger.error(JSON_DECODE_ERROR_MSG.format(body=text))
+                return array('q')
+
+            self.cache.put(cache_key, slots.epochs)
+            return slots.epochs
+
+        return LocationAvailabilitySlots(location=location, epochs=await self.single_flight.do(cache_key, fetch))
+
+    async def get_appointments(self, latitude: float, longitude: float, start_date: date,
+                               end_date: date) -> List[LocationAvailabilitySlots]:
+        """Retrieves available appointments from all vaccination locations near the given coordinates"""
+        locations = await self.get_locations(latitude=latitude, longitude=longitude)
+        if not locations:
+            return []
+
+        if start_date > end_date:
+            raise ValueError('Provided start_date must be before end_date')
+
+        return await self.get_appointments_for_locations(locations=locations, start_date=start_date,
+                                                         end_date=end_date)
+
+    async def get_appointments_for_locations(self, locations: List[Location], start_date: date,
+                                             end_date: date) -> List[LocationAvailabilitySlots]:
+        """Retrieves available appointments from the given vaccination locations, preserving their order"""
+        availabilities = await asyncio.gather(*[self.get_availability(location=location, start_date=start_date,
+                                                                      end_date=end_date)
+                                                for location in locations])
+        location_dates = [(index, availability.location, day_available)
+                          for index, availability in enumerate(availabilities)
+                          for day_available in availability.dates_available]
+        if not location_dates:
+            return []
+
+        return _merge_appointments(location_dates=location_dates,
+                                   all_slots=await asyncio.gather(*[self.get_slots(location=location, start_date=day)
+                                                                    for _, location, day in location_dates]))
+
+    async def iter_appointments(self, latitude: float, longitude: float, start_date: date,
+                                end_date: date) -> AsyncIterator[LocationAvailabilitySlots]:
+        """Same as get_appointments but yields each location's appointments as soon as they're resolved"""
+        locations = await self.get_locations(latitude=latitude, longitude=longitude)
+        if not locations:
+            return
+
+        if start_date > end_date:
+            raise ValueError('Provided start_date must be before end_date')
+
+        async for appointment in self.iter_appointments_for_locations(locations=locations, start_date=start_date,
+                                                                      end_date=end_date):
+            yield appointment
+
+    async def iter_appointments_for_locations(self, locations: List[Location], start_date: date,
+                                              end_date: date) -> AsyncIterator[LocationAvailabilitySlots]:
+        """Yields the available appointments of each of the given locations in the order they're resolved,
+        locations without any are skipped. Closing the generator early cancels the outstanding requests"""
+        pending = [asyncio.ensure_future(self._get_location_appointments(location=location, start_date=start_date,
+                                                                         end_date=end_date))
+                   for location in locations]
+        try:
+            for next_resolved in asyncio.as_completed(pending):
+                for appointment in await next_resolved:
+                    yield appointment
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _get_location_appointments(self, location: Location, start_date: date,
+                                         end_date: date) -> List[LocationAvailabilitySlots]:
+        """Private helper function to get a single location's appointments, empty if it doesn't have any"""
+        availability = await self.get_availability(location=location, start_date=start_date, end_date=end_date)
+        return _merge_appointments(location_dates=[(0, location, day) for day in availability.dates_available],
+                                   all_slots=await asyncio.gather(*[self.get_slots(location=location, start_date=day)
+                                                                    for day in availability.dates_available]))
+
+    async def _send_request(self, url: str, body: dict) -> str:
+        """Private helper function to make HTTP POST requests, returns the response body and raises
+        VaccineDataRejected if a location search's vaccineData was rejected"""
+        import aiohttp
+        session = await self._get_session()
+        retries = self.retry_strategy
+        endpoint = endpoint_name(url)
+        start = perf_counter()
+        statuses = []
+        while True:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async(endpoint)
+            try:
+                async with session.post(f'{self.base_url}{url}', json=body) as response:
+                    content = await response.read()
+                    text = content.decode(response.get_encoding())
+                    statuses.append(response.status)
+                    if not retries.is_retry('POST', response.status, 'Retry-After' in response.headers):
+                        _record_request(self.logger, self.log_sample_rate, endpoint=endpoint, statuses=statuses,
+                                        size=len(content), latency=perf_counter() - start)
+                        if self.logger.isEnabledFor(logging.DEBUG):
+                            self.logger.debug('request to %s%s with body %s got response %s', self.base_url, url, body,
+                                              text)
+                        if endpoint == 'locations' and response.status == VACCINE_DATA_REJECTED_STATUS:
+                            self.vaccine_data_cache.expire(body['vaccineData'])
+                            raise VaccineDataRejected
+                        return text
+
+                    # raises MaxRetryError once the retry budget is exhausted, same as urllib3 would
+                    retries = self._increment(retries, endpoint=endpoint, url=url, start=start, statuses=statuses)
+                    retry_after = response.headers.get('Retry-After')
+                    backoff = retries.parse_retry_after(retry_after) if retry_after else retries.get_backoff_time()
+                    if retry_after and self.rate_limiter is not None:
+                        await self.rate_limiter.retry_after_async(endpoint, backoff)
+            except aiohttp.ClientConnectionError as e:
+                statuses.append(None)
+                retries = self._increment(retries, endpoint=endpoint, url=url, start=start, statuses=statuses, error=e)
+                backoff = retries.get_backoff_time()
+
+            await asyncio.sleep(backoff)
+
+    def _increment(self, retries: Retry, endpoint: str, url: str, start: float, statuses: List[Optional[int]],
+                   error: Optional[Exception] = None) -> Retry:
+        """Private helper function to count a retry, recording the request once retries are exhausted"""
+        try:
+            return retries.increment(method='POST', url=url, error=error)
+        except Exception:
+            _record_request(self.logger, self.log_sample_rate, endpoint=endpoint, statuses=statuses, size=0,
+                            latency=perf_counter() - start)
+            raise
@@ -1,81 +1,209 @@
 """Discord bot to help you find a COVID-19 vaccination appointment in CA"""
-import functools
+import asyncio
 import logging
+import threading
+import time
+from time import perf_counter
 from datetime import timedelta, datetime
-from typing import Callable, Any
+from typing import Awaitable, Callable, Tuple, Dict, List, Optional
 
-import pgeocode
+import discord
 import pymongo
+from pymongo import DeleteOne, UpdateMany
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure, PyMongoError
 import pytz
 from discord.errors import NotFound, Forbidden
 from discord.ext import commands, tasks
 from kubernetes import client, config
-from pandas import isnull, DataFrame
 
 from .constants import COMMAND_PREFIX, BOT_DESCRIPTION, CANCEL_NOTIFICATION_BRIEF, CANCEL_NOTIFICATION_DESCRIPTION, \
     NOTIFY_BRIEF, NOTIFY_DESCRIPTION, GET_NOTIFICATIONS_DESCRIPTION, GET_LOCATIONS_DESCRIPTION, \
     GET_APPOINTMENTS_BRIEF, GET_APPOINTMENTS_DESCRIPTION, MONGO_USER, \
     MONGO_PASSWORD, MONGO_HOST, MONGO_PORT, JOB_MAX_RETRIES, JOB_TTL_SECONDS_AFTER_FINISHED, JOB_NAME_PREFIX, \
-    JOB_RESTART_POLICY, JOB_DELETION_PROPAGATION_POLICY, JOB_RESOURCE_REQUESTS, MY_TURN_API_KEY
+    JOB_RESTART_POLICY, JOB_DELETION_PROPAGATION_POLICY, JOB_RESOURCE_REQUESTS, MY_TURN_API_KEY, JOB_LABELS, \
+    JOB_LABEL_SELECTOR, \
+    LOCATION_CATALOGUE_CHECK_SECONDS, NOTIFICATION_CHANGE_STREAM_PIPELINE, \
+    CHANGE_STREAM_UNSUPPORTED_ERROR_CODES, CHANGE_STREAM_RETRY_SECONDS, APPOINTMENTS_EDIT_INTERVAL_SECONDS
+from .database import ensure_notification_indexes
 from .exceptions import InvalidZipCode
-from .myTurnCA import MyTurnCA
+from .jobCache import JobCache
+from .locationCatalogue import LocationCatalogue, MongoLocationCatalogueBackend
+from .messageFormatting import render_notification, split_message
+from .metrics import COMMAND_LATENCY, LOOP_ITERATION_DURATION, PENDING_NOTIFICATIONS, ACTIVE_JOBS, register_cache, \
+    register_single_flight
+from .myTurnCA import AsyncMyTurnCA, LocationAvailabilitySlots
+from .rateLimiter import RateLimiter, MongoRateLimitBackend
+from .startupTimer import StartupTimer
+from .vaccineDataCache import VaccineDataCache, MongoVaccineDataBackend
+from .zipCodeIndex import ZipCodeIndex
 
 
 class MyTurnCABot(commands.Bot):
     """Main bot class"""
-    def __init__(self, command_prefix, namespace, **options):
+    def __init__(self, command_prefix, namespace, my_turn_ca: AsyncMyTurnCA, **options):
         config.load_incluster_config()
         self.k8s_batch = client.BatchV1Api()
         self.namespace = namespace
+        self.my_turn_ca = my_turn_ca
+        self.job_cache = JobCache(k8s_batch=self.k8s_batch, namespace=namespace)
         super().__init__(command_prefix, **options)
 
     async def close(self):
         """Cleans up notification jobs to avoid leaving running jobs in cluster"""
-        [self.k8s_batch.delete_namespaced_job(namespace=self.namespace,
-                                              name=job.metadata.labels['job-name'],
-                                              body=client.V1DeleteOptions(
-                                                  propagation_policy=JOB_DELETION_PROPAGATION_POLICY))
-         for job in [job for job in self.k8s_batch.list_namespaced_job(namespace=self.namespace).items
-                     if job.metadata.labels['job-name'].startswith(JOB_NAME_PREFIX)]]
-
+        self.job_cache.stop()
+        # the job cache only labels jobs created before jobs were labelled if it was started
+        self.job_cache.label_unlabelled_jobs()
+        self.k8s_batch.delete_collection_namespaced_job(namespace=self.namespace,
+                                                        label_selector=JOB_LABEL_SELECTOR,
+                                                        propagation_policy=JOB_DELETION_PROPAGATION_POLICY)
+
+        await self.my_turn_ca.close()
         await super().close()
 
 
-def run(token: str, namespace: str, job_image: str, mongodb_user: str,
-        mongodb_password: str, mongodb_host: str, mongodb_port: str, my_turn_api_key: str):
-    """Main bot driver method"""
-    bot = MyTurnCABot(command_prefix=COMMAND_PREFIX, namespace=namespace, description=BOT_DESCRIPTION)
+def watch_notifications(notifications: Collection, is_closed: Callable[[], bool], on_change: Callable[[], None],
+                        on_unsupported: Callable[[], None]):
+    """Blocking helper run on its own thread that calls on_change whenever a notification gets a message, calls
+    on_unsupported and returns if the database doesn't support change streams so the caller can fall back to
+    polling"""
     logger = logging.getLogger(__name__)
-    my_turn_ca = MyTurnCA(api_key=my_turn_api_key)
-    nomi = pgeocode.Nominatim('us')
+    resume_token = None
+    while not is_closed():
+        try:
+            with notifications.watch(NOTIFICATION_CHANGE_STREAM_PIPELINE, resume_after=resume_token) as stream:
+                # catches up on any messages written before the stream was opened
+                on_change()
+                for _ in stream:
+                    resume_token = stream.resume_token
+                    on_change()
+        except OperationFailure as e:
+            if e.code in CHANGE_STREAM_UNSUPPORTED_ERROR_CODES:
+                logger.info('change streams aren\'t supported by the database, falling back to polling')
+                on_unsupported()
+                return
+            logger.error('got error from notification change stream, reopening it')
+            logger.error(e)
+            resume_token = None
+        except PyMongoError as e:
+            logger.error('lost notification change stream, reopening it')
+            logger.error(e)
+        time.sleep(CHANGE_STREAM_RETRY_SECONDS)
+
+
+async def deliver_ready_notifications(notifications: Collection,
+                                      get_channel: Callable[[int], Awaitable[discord.abc.Messageable]],
+                                      forget_channel: Callable[[int], None]):
+    """Sends every notification whose job has populated its message and removes it from the database,
+    notifications with the same message in the same channel are sent together as one message mentioning
+    all of their users"""
+    logger = logging.getLogger(__name__)
+    delivered = []
+    try:
+        groups = {}
+        for notification in notifications.find({'message': {'$exists': True}}):
+            groups.setdefault((notification['channel_id'], notification['message']), []).append(notification)
+
+        for (channel_id, message), channel_notifications in groups.items():
+            try:
+                logger.info(f'found {len(channel_notifications)} populated notification(s) in database, '
+                            f'sending message to channel {channel_id} - {message}')
+                channel = await get_channel(channel_id)
+                user_ids = [notification['user_id'] for notification in channel_notifications]
+                for text in render_notification(message, user_ids):
+                    await channel.send(text)
+            except NotFound:
+                forget_channel(channel_id)
+                logger.error(f'channel {channel_id} was not found, maybe it was deleted...?')
+            except Forbidden:
+                forget_channel(channel_id)
+                logger.error(f'we don\'t have sufficient privileges to fetch channel {channel_id}')
+
+            delivered.extend(DeleteOne({'_id': notification['_id']}) for notification in channel_notifications)
+    finally:
+        # deletes whatever was handled even if delivery broke part way through so nothing is sent twice
+        if delivered:
+            notifications.bulk_write(delivered, ordered=False)
+
+
+def assign_notification_jobs(notifications: Collection, job_cache: JobCache,
+                             create_job: Callable[[int], client.V1Job]):
+    """Points every pending notification at the active job for its zip code, creating a job for at most one zip
+    code without an active job per call"""
+    pending = list(notifications.find({'message': {'$exists': False}}, projection={'zip_code': 1, 'job_name': 1}))
+    PENDING_NOTIFICATIONS.set(len(pending))
+    ACTIVE_JOBS.set(len(job_cache.active_job_names()))
+    active_jobs = {notification['zip_code']: notification['job_name'] for notification in pending
+                   if job_cache.is_active(notification.get('job_name'))}
+    # if job exists and hasn't permanently failed, no need to do anything
+    zip_codes = sorted({notification['zip_code'] for notification in pending
+                        if not job_cache.is_active(notification.get('job_name'))})
+
+    reassignments = []
+    created_job = False
+    for zip_code in zip_codes:
+        # if we didn't find any existing jobs, create one
+        if zip_code not in active_jobs:
+            # let's only create one job per loop to avoid spawning all the jobs at once and blowing up myturn
+            if created_job:
+                continue
+            active_jobs[zip_code] = create_job(zip_code).metadata.name
+            created_job = True
+
+        # points every pending notification for the zip code at its active job
+        reassignments.append(UpdateMany({'zip_code': zip_code,
+                                         'message': {'$exists': False},
+                                         'job_name': {'$ne': active_jobs[zip_code]}},
+                                        {'$set': {'job_name': active_jobs[zip_code]}}))
+
+    if reassignments:
+        notifications.bulk_write(reassignments, ordered=False)
+
+
+def run(token: str, namespace: str, job_image: str, mongodb_user: str,
+        mongodb_password: str, mongodb_host: str, mongodb_port: str, my_turn_api_key: str,
+        create_jobs: bool = True, startup_timer: Optional[StartupTimer] = None):
+    """Main bot driver method, if create_jobs is False notification requests are expected
+    to be fulfilled by a separate scheduler process instead of per zip code jobs"""
+    startup_timer = startup_timer if startup_timer is not None else StartupTimer()
+    zip_code_index = ZipCodeIndex.load()
+    startup_timer.phase('zip code index')
     mongodb = pymongo.MongoClient(f'mongodb://{mongodb_user}:{mongodb_password}@{mongodb_host}:{mongodb_port}')
     my_turn_ca_db = mongodb.my_turn_ca
+    ensure_notification_indexes(my_turn_ca_db.notifications)
+    startup_timer.phase('mongo indexes')
+    my_turn_ca = AsyncMyTurnCA(api_key=my_turn_api_key,
+                               location_catalogue=LocationCatalogue(
+                                   backend=MongoLocationCatalogueBackend(my_turn_ca_db.location_catalogue)),
+                               rate_limiter=RateLimiter(MongoRateLimitBackend(my_turn_ca_db.rate_limits)),
+                               vaccine_data_cache=VaccineDataCache(MongoVaccineDataBackend(my_turn_ca_db.vaccine_data)))
+    register_cache('my_turn_ca', my_turn_ca.cache)
+    register_single_flight('my_turn_ca', my_turn_ca.single_flight)
+    bot = MyTurnCABot(command_prefix=COMMAND_PREFIX, namespace=namespace, my_turn_ca=my_turn_ca,
+                      description=BOT_DESCRIPTION)
+    logger = logging.getLogger(__name__)
 
-    async def run_blocking(func: Callable, *args, **kwargs) -> Any:
-        """Async helper method to make blocking calls asynchronously"""
-        return await bot.loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+    def get_coordinates(zip_code: int) -> Tuple[float, float]:
+        """Returns the given zip code's (latitude, longitude), raises InvalidZipCode if it isn't a valid CA zip code"""
+        coordinates = zip_code_index.lookup(zip_code)
+        if coordinates is None:
+            raise InvalidZipCode
 
-    def is_zip_code_valid(zip_code_result: DataFrame):
-        """Returns whether or not the provided DataFrame represents a valid CA zip code"""
-        return not any([
-            isnull(zip_code_result['latitude']),
-            isnull(zip_code_result['longitude']),
-            isnull(zip_code_result['state_code']),
-            zip_code_result['state_code'] != 'CA'
-        ])
+        return coordinates
 
     def create_notification_job(zip_code: int) -> client.V1Job:
         """Creates job to fulfill requested notification"""
-        return bot.k8s_batch.create_namespaced_job(
+        job = bot.k8s_batch.create_namespaced_job(
             namespace=namespace,
             body=client.V1Job(
                 api_version='batch/v1',
                 kind='Job',
-                metadata=client.V1ObjectMeta(generate_name=JOB_NAME_PREFIX),
+                metadata=client.V1ObjectMeta(generate_name=JOB_NAME_PREFIX, labels=JOB_LABELS),
                 spec=client.V1JobSpec(
                     ttl_seconds_after_finished=JOB_TTL_SECONDS_AFTER_FINISHED,
                     backoff_limit=JOB_MAX_RETRIES,
                     template=client.V1PodTemplateSpec(
+                        metadata=client.V1ObjectMeta(labels=JOB_LABELS),
                         spec=client.V1PodSpec(
                             restart_policy=JOB_RESTART_POLICY,
                             containers=[client.V1Container(
@@ -106,6 +234,18 @@ def run(token: str, namespace: str, job_image: str, mongodb_user: str,
                 )
             )
         )
+        bot.job_cache.add(job)
+        return job
+
+    @bot.before_invoke
+    async def start_command_timer(ctx: commands.Context):
+        """Bot hook to note when a command started being handled"""
+        ctx.started_at = perf_counter()
+
+    @bot.after_invoke
+    async def record_command_latency(ctx: commands.Context):
+        """Bot hook to record how long a command took to handle, runs whether or not the command failed"""
+        COMMAND_LATENCY.labels(ctx.command.name).observe(perf_counter() - ctx.started_at)
 
     @bot.command(brief=CANCEL_NOTIFICATION_BRIEF, description=CANCEL_NOTIFICATION_DESCRIPTION)
     async def cancel_notification(ctx: commands.Context, zip_code: int):
@@ -116,10 +256,11 @@ def run(token: str, namespace: str, job_image: str, mongodb_user: str,
             return
 
         try:
-            bot.k8s_batch.delete_namespaced_job(name=notification['job_name'],
-                                                namespace=namespace,
-                                                body=client.V1DeleteOptions(
-                                                    propagation_policy=JOB_DELETION_PROPAGATION_POLICY))
+            if notification.get('job_name'):
+                bot.k8s_batch.delete_namespaced_job(name=notification['job_name'],
+                                                    namespace=namespace,
+                                                    body=client.V1DeleteOptions(
+                                                        propagation_policy=JOB_DELETION_PROPAGATION_POLICY))
         except client.exceptions.ApiException as e:
             logger.info(f'caught exception while attempting to delete job {notification["job_name"]}, '
                         f'maybe it doesn\'t exist...?')
@@ -132,9 +273,7 @@ def run(token: str, namespace: str, job_image: str, mongodb_user: str,
     @bot.command(brief=NOTIFY_BRIEF, description=NOTIFY_DESCRIPTION)
     async def notify(ctx: commands.Context, zip_code: int):
         """Bot command to request to be notified when appointments are available near the given zip code"""
-        city = nomi.query_postal_code(zip_code)
-        if not is_zip_code_valid(city):
-            raise InvalidZipCode
+        get_coordinates(zip_code)
 
         if my_turn_ca_db.notifications.find_one({'user_id': ctx.author.id}):
             await ctx.reply('You already have an outstanding notification request, '
@@ -143,8 +282,12 @@ def run(token: str, namespace: str, job_image: str, mongodb_user: str,
 
         await ctx.reply(f'OK, I\'ll let you know when I find appointments in your area')
         existing_notification = my_turn_ca_db.notifications.find_one({'zip_code': zip_code})
-        job_name = existing_notification['job_name'] if existing_notification is not None \
-            else create_notification_job(zip_code).metadata.name
+        if not create_jobs:
+            job_name = None
+        elif existing_notification is not None and existing_notification.get('job_name'):
+            job_name = existing_notification['job_name']
+        else:
+            job_name = create_notification_job(zip_code).metadata.name
         my_turn_ca_db.notifications.insert_one({
             'user_id': ctx.author.id,
             'zip_code': zip_code,
@@ -164,21 +307,43 @@ def run(token: str, namespace: str, job_image: str, mongodb_user: str,
         await ctx.reply(f'You\'ve asked to be notified when appointments become available near these zip codes '
                         f'- {", ".join([str(notification["zip_code"]) for notification in notifications])}')
 
+    notifications_changed = asyncio.Event()
+    delivery_lock = asyncio.Lock()
+
+    channels: Dict[int, discord.abc.Messageable] = {}
+
+    async def get_channel(channel_id: int) -> discord.abc.Messageable:
+        """Returns the given channel, only fetching it from Discord if it isn't cached"""
+        if channel_id not in channels:
+            channels[channel_id] = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+        return channels[channel_id]
+
+    async def deliver_notifications():
+        """Delivers ready notifications, only one delivery runs at a time so nothing is sent twice"""
+        async with delivery_lock:
+            await deliver_ready_notifications(my_turn_ca_db.notifications, get_channel=get_channel,
+                                              forget_channel=lambda channel_id: channels.pop(channel_id, None))
+
+    @tasks.loop(seconds=0)
+    async def deliver_notification_changes():
+        """Background task to deliver notifications as soon as the change stream reports them, bursts of
+        changes (e.g. a job updating every notification for its zip code) are delivered together"""
+        await notifications_changed.wait()
+        notifications_changed.clear()
+        try:
+            with LOOP_ITERATION_DURATION.labels('deliver_notification_changes').time():
+                await deliver_notifications()
+        except Exception as e:
+            logger.error('got unrecognized exception, silently catching it to avoid breaking loop')
+            logger.error(e)
+
     @tasks.loop(seconds=5)
     async def poll_notifications():
-        """Background task to check if notification jobs have completed successfully and notify user"""
+        """Background task to check if notification jobs have completed successfully and notify user, only used
+        when change streams aren't available"""
         try:
-            for notification in my_turn_ca_db.notifications.find({'message': {'$exists': True}}):
-                try:
-                    logger.info(f'found populated notification in database, sending message to channel - {notification}')
-                    channel = await bot.fetch_channel(notification['channel_id'])
-                    await channel.send(notification['message'].format(user_id=notification['user_id']))
-                except NotFound:
-                    logger.error(f'channel {notification["channel_id"]} was not found, maybe it was deleted...?')
-                except Forbidden:
-                    logger.error(f'we don\'t have sufficient privileges to fetch channel {notification["channel_id"]}')
-
-                my_turn_ca_db.notifications.delete_one({'_id': notification['_id']})
+            with LOOP_ITERATION_DURATION.labels('poll_notifications').time():
+                await deliver_notifications()
         except Exception as e:
             logger.error('got unrecognized exception, silently catching it to avoid breaking loop')
             logger.error(e)
@@ -187,34 +352,28 @@ def run(token: str, namespace: str, job_image: str, mongodb_user: str,
     async def check_jobs():
         """Background task to create notification jobs if there isn't currently a job handling a user's
         notification or the job failed"""
+        # decisions are made from the job cache, so wait until it has listed the jobs at least once
+        if not bot.job_cache.synced.is_set():
+            return
+
+        started_at = perf_counter()
         try:
-            for notification in my_turn_ca_db.notifications.find({'message': {'$exists': False}}):
-                current_job = bot.k8s_batch.list_namespaced_job(namespace=namespace,
-                                                                label_selector=f'job-name={notification["job_name"]}')
-
-                # if job exists and hasn't permanently failed, no need to do anything
-                if current_job.items and not current_job.items[0].status.failed:
-                    continue
-
-                found_existing_job = False
-                for similar_notification in my_turn_ca_db.notifications.find({'zip_code': notification['zip_code'],
-                                                                              'message': {'$exists': False},
-                                                                              '_id': {'$ne': notification['_id']}}):
-                    existing_job = bot.k8s_batch.list_namespaced_job(namespace=namespace,
-                                                                     label_selector=f'job-name={similar_notification["job_name"]}')
-                    # if there is an existing job for the same zip code, let's use that
-                    if existing_job.items and not existing_job.items[0].status.failed:
-                        found_existing_job = True
-                        my_turn_ca_db.notifications.update_one({'_id': notification['_id']},
-                                                               {'$set': {'job_name': similar_notification['job_name']}})
-                        break
-                # if we didn't find any existing jobs, create one
-                if not found_existing_job:
-                    job = create_notification_job(notification['zip_code'])
-                    my_turn_ca_db.notifications.update_one({'_id': notification['_id']},
-                                                           {'$set': {'job_name': job.metadata.name}})
-                    # let's only create one job per loop to avoid spawning all the jobs at once and blowing up myturn
-                    return
+            assign_notification_jobs(my_turn_ca_db.notifications, job_cache=bot.job_cache,
+                                     create_job=create_notification_job)
+        except Exception as e:
+            logger.error('got unrecognized exception, silently catching it to avoid breaking loop')
+            logger.error(e)
+        LOOP_ITERATION_DURATION.labels('check_jobs').observe(perf_counter() - started_at)
+
+    @tasks.loop(seconds=LOCATION_CATALOGUE_CHECK_SECONDS)
+    async def refresh_location_catalogue():
+        """Background task to keep the location catalogue fresh so location searches can be answered locally, it
+        only rebuilds the catalogue once it's due and picks up catalogues shared by other processes in between"""
+        try:
+            if not await asyncio.get_running_loop().run_in_executor(None, my_turn_ca.location_catalogue.needs_refresh):
+                return
+            await my_turn_ca.refresh_location_catalogue(
+                zip_code_index.seed_points(my_turn_ca.location_catalogue.seed_spacing()))
         except Exception as e:
             logger.error('got unrecognized exception, silently catching it to avoid breaking loop')
             logger.error(e)
@@ -222,13 +381,9 @@ def run(token: str, namespace: str, job_image: str, mongodb_user: str,
     @bot.command(brief=GET_LOCATIONS_DESCRIPTION, description=GET_LOCATIONS_DESCRIPTION)
     async def get_locations(ctx: commands.Context, zip_code: int):
         """Bot command to list available vaccination locations near the given zip code"""
-        city = nomi.query_postal_code(zip_code)
-        if not is_zip_code_valid(city):
-            raise InvalidZipCode
+        latitude, longitude = get_coordinates(zip_code)
 
-        locations = await run_blocking(func=my_turn_ca.get_locations,
-                                       latitude=city['latitude'],
-                                       longitude=city['longitude'])
+        locations = await my_turn_ca.get_locations(latitude=latitude, longitude=longitude)
         if not locations:
             await ctx.reply('Sorry, I didn\'t find any vaccination locations in your area')
             return
@@ -242,29 +397,48 @@ def run(token: str, namespace: str, job_image: str, mongodb_user: str,
     @bot.command(brief=GET_APPOINTMENTS_BRIEF, description=GET_APPOINTMENTS_DESCRIPTION)
     async def get_appointments(ctx: commands.Context, zip_code: int):
         """Bot command to list available appointments at vaccination locations near the given zip code"""
-        city = nomi.query_postal_code(zip_code)
-        if not is_zip_code_valid(city):
-            raise InvalidZipCode
+        latitude, longitude = get_coordinates(zip_code)
 
         start_date = datetime.now(tz=pytz.timezone('US/Pacific')).date()
         end_date = start_date + timedelta(weeks=1)
-        appointments = await run_blocking(func=my_turn_ca.get_appointments,
-                                          latitude=city['latitude'],
-                                          longitude=city['longitude'],
-                                          start_date=start_date,
-                                          end_date=end_date)
+        replies: List[Tuple[discord.Message, str]] = []
+
+        async def show(text: str):
+            """Helper function to update the replies to the given text, only parts that changed are edited"""
+            for index, part in enumerate(split_message(text)):
+                if index == len(replies):
+                    replies.append((await ctx.reply(part), part))
+                elif replies[index][1] != part:
+                    await replies[index][0].edit(content=part)
+                    replies[index] = (replies[index][0], part)
+
+        def render(appointments: List[LocationAvailabilitySlots]) -> str:
+            """Helper function to build the reply listing the given appointments in order"""
+            return f'Found available openings at these locations from ' \
+                   f'{start_date.strftime("%x")} to {end_date.strftime("%x")}, ' \
+                   f'go to https://myturn.ca.gov to make an appointment!\n' + \
+                   ''.join(f'  * {str(appointment.location)} - {len(appointment.epochs)} appointment(s) available\n'
+                           for appointment in appointments)
+
+        appointments = []
+        shown_at = perf_counter()
+        # locations are listed as soon as their slots are known, the reply is edited as more of them finish
+        async for appointment in my_turn_ca.iter_appointments(latitude=latitude,
+                                                              longitude=longitude,
+                                                              start_date=start_date,
+                                                              end_date=end_date):
+            appointments.append(appointment)
+            if len(appointments) == 1 or perf_counter() - shown_at >= APPOINTMENTS_EDIT_INTERVAL_SECONDS:
+                await show(render(appointments))
+                shown_at = perf_counter()
+
         if not appointments:
             await ctx.reply('Sorry, I didn\'t find any vaccination appointments in your area')
             return
 
-        message = f'Found available openings at these locations from ' \
-                  f'{start_date.strftime("%x")} to {end_date.strftime("%x")}, ' \
-                  f'go to https://myturn.ca.gov to make an appointment!\n'
-
-        for appointment in appointments:
-            message += f'  * {str(appointment.location)} - {len(appointment.slots)} appointment(s) available\n'
-
-        await ctx.reply(message)
+        # results arrive in the order locations finish, the final reply lists the closest ones first
+        appointments.sort(key=lambda appointment: appointment.location.distance_in_meters)
+        await show(render(appointments))
 
     @get_locations.error
     @get_appointments.error
@@ -300,6 +474,23 @@ def run(token: str, namespace: str, job_image: str, mongodb_user: str,
     @bot.event
     async def on_ready():
         """Bot event to start background tasks"""
-        [task.start() for task in [poll_notifications, check_jobs] if not task.is_running()]
+        if not startup_timer.reported:
+            startup_timer.phase('discord login')
+            startup_timer.report(logger)
+
+        if create_jobs:
+            bot.job_cache.start()
+
+        if not deliver_notification_changes.is_running():
+            deliver_notification_changes.start()
+            threading.Thread(target=watch_notifications, name='notification-change-stream', daemon=True, kwargs={
+                'notifications': my_turn_ca_db.notifications,
+                'is_closed': bot.is_closed,
+                'on_change': lambda: bot.loop.call_soon_threadsafe(notifications_changed.set),
+                'on_unsupported': lambda: bot.loop.call_soon_threadsafe(poll_notifications.start)
+            }).start()
+
+        [task.start() for task in [refresh_location_catalogue] + ([check_jobs] if create_jobs else [])
+         if not task.is_running()]
 
     bot.run(token)
\ No newline at end of file
@@ -1,46 +1,281 @@
 import logging
+import threading
 import time
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 
-import pgeocode
 import pymongo
 import pytz
 
-from .constants import NOTIFICATION_WAIT_PERIOD
-from .myTurnCA import MyTurnCA
+from .availabilityTracker import AvailabilityTracker
+from .constants import MENTION_PLACEHOLDER, SCHEDULER_TICK_SECONDS, WORK_QUEUE_BATCH_SIZE, WORK_QUEUE_SYNC_SECONDS, \
+    NOTIFICATION_ENOUGH_SLOTS
+from .database import ensure_notification_indexes, ensure_poll_task_indexes
+from .locationCatalogue import LocationCatalogue, MongoLocationCatalogueBackend
+from .metrics import LOOP_ITERATION_DURATION, PENDING_NOTIFICATIONS, register_cache, register_single_flight
+from .myTurnCA import MyTurnCA, Location, LocationAvailabilitySlots
+from .pollScheduler import PollScheduler
+from .rateLimiter import RateLimiter, MongoRateLimitBackend
+from .startupTimer import StartupTimer
+from .vaccineDataCache import VaccineDataCache, MongoVaccineDataBackend
+from .workQueue import WorkQueue
+from .zipCodeIndex import ZipCodeIndex
 
 
 class NotificationGenerator:
     """Class to fulfill a requested notification"""
     def __init__(self, mongodb_user: str, mongodb_password: str, mongodb_host: str,
-                 mongodb_port: str, my_turn_api_key: str):
-        self.nomi = pgeocode.Nominatim('us')
-        self.mongodb = pymongo.MongoClient(f'mongodb://{mongodb_user}:{mongodb_password}@{mongodb_host}:{mongodb_port}')
-        self.my_turn_ca = MyTurnCA(api_key=my_turn_api_key)
+                 mongodb_port: str, my_turn_api_key: str, my_turn_ca: Optional[MyTurnCA] = None,
+                 startup_timer: Optional[StartupTimer] = None):
         self.logger = logging.getLogger(__name__)
+        # the breakdown is logged once the first poll finishes
+        self.startup_timer = startup_timer if startup_timer is not None else StartupTimer()
+        self.zip_code_index = ZipCodeIndex.load()
+        self.startup_timer.phase('zip code index')
+        self.mongodb = pymongo.MongoClient(f'mongodb://{mongodb_user}:{mongodb_password}@{mongodb_host}:{mongodb_port}')
+        self.startup_timer.phase('mongo client')
+        self.my_turn_ca = my_turn_ca or MyTurnCA(
+            api_key=my_turn_api_key,
+            location_catalogue=LocationCatalogue(
+                backend=MongoLocationCatalogueBackend(self.mongodb.my_turn_ca.location_catalogue)),
+            rate_limiter=RateLimiter(MongoRateLimitBackend(self.mongodb.my_turn_ca.rate_limits)),
+            vaccine_data_cache=VaccineDataCache(MongoVaccineDataBackend(self.mongodb.my_turn_ca.vaccine_data)))
+        self.startup_timer.phase('my turn client')
+        register_cache('my_turn_ca', self.my_turn_ca.cache)
+        register_single_flight('my_turn_ca', self.my_turn_ca.single_flight)
+        # location_id -> (zip code, location as seen from that zip code) for every zip code whose nearby
+        # locations include it, rebuilt every poll
+        self.location_subscribers: Dict[str, List[Tuple[int, Location]]] = {}
+        self.poll_scheduler = PollScheduler()
+        self.availability_tracker = AvailabilityTracker(self.my_turn_ca)
+        self.location_catalogue_refresh: Optional[threading.Thread] = None
 
     def generate_notification(self, zip_code: int):
         """Checks if appointments are available near the given zip code and updates
-        the notification document when they are found"""
-        zip_code_query = self.nomi.query_postal_code(zip_code)
+        the notification document when they are found. The subscriber count is reloaded before every poll so the
+        poll interval follows new and canceled requests, and polling stops once none are left"""
+        while True:
+            subscribers = self.mongodb.my_turn_ca.notifications.count_documents(
+                {'zip_code': zip_code, 'message': {'$exists': False}})
+            if not subscribers:
+                self.logger.info(f'no outstanding notification requests left for {zip_code}, stopping')
+                return
+
+            self.poll_scheduler.update({zip_code: subscribers})
+            if self.poll_zip_code(zip_code):
+                return
+            time.sleep(self.poll_scheduler.seconds_until_next_poll())
+
+    def run_scheduler(self):
+        """Polls every zip code with an outstanding notification request from a single process, the pending
+        zip codes are reloaded every tick so new and canceled requests are picked up without a restart and
+        each zip code is only polled once the poll scheduler says it's due"""
+        ensure_notification_indexes(self.mongodb.my_turn_ca.notifications)
         while True:
-            start_date = datetime.now(tz=pytz.timezone('US/Pacific')).date()
-            end_date = start_date + timedelta(weeks=1)
-            appointments = self.my_turn_ca.get_appointments(latitude=zip_code_query['latitude'],
-                                                            longitude=zip_code_query['longitude'],
-                                                            start_date=start_date, end_date=end_date)
-            if not appointments:
-                time.sleep(NOTIFICATION_WAIT_PERIOD)
-                continue
-
-            message = 'Hey <@{user_id}>, I found available openings at these locations from ' \
-                      f'{start_date.strftime("%x")} to {end_date.strftime("%x")}, ' \
-                      'go to https://myturn.ca.gov to make an appointment!\n'
-
-            for appointment in appointments:
-                message += f'  * {str(appointment.location)} - {len(appointment.slots)} appointment(s) available\n'
-
-            self.logger.info(f'found appointments, updating notifications '
-                             f'for zip_code {zip_code} with message - {message}')
-            self.mongodb.my_turn_ca.notifications.update({'zip_code': zip_code}, {'$set': {'message': message}})
-            return
\ No newline at end of file
+            self.run_scheduler_tick()
+            next_poll = self.poll_scheduler.seconds_until_next_poll()
+            time.sleep(SCHEDULER_TICK_SECONDS if next_poll is None else min(next_poll, SCHEDULER_TICK_SECONDS))
+
+    def run_scheduler_tick(self):
+        """Runs a single iteration of run_scheduler, reloading the pending zip codes and polling the ones that
+        are due. Errors are logged rather than raised so the loop keeps going"""
+        try:
+            subscriber_counts = self.get_pending_subscriber_counts()
+            PENDING_NOTIFICATIONS.set(sum(subscriber_counts.values()))
+            self.poll_scheduler.update(subscriber_counts)
+            zip_codes = self.poll_scheduler.due()
+            if zip_codes:
+                self.logger.info(f'polling {len(zip_codes)} of {len(self.poll_scheduler.schedules)} zip code(s) '
+                                 f'with outstanding notification requests')
+                with LOOP_ITERATION_DURATION.labels('run_scheduler').time():
+                    self._refresh_location_catalogue()
+                    self.poll_zip_codes(zip_codes)
+        except Exception as e:
+            self.logger.error('got unrecognized exception, silently catching it to avoid breaking loop')
+            self.logger.error(e)
+
+    def run_queue_worker(self):
+        """Polls zip codes claimed from the shared work queue, any number of these workers can run side by side
+        and a crashed worker's zip codes are picked up by the others once their leases expire"""
+        ensure_notification_indexes(self.mongodb.my_turn_ca.notifications)
+        ensure_poll_task_indexes(self.mongodb.my_turn_ca.poll_tasks)
+        work_queue = WorkQueue(self.mongodb.my_turn_ca.poll_tasks)
+        self.logger.info(f'starting queue worker {work_queue.worker_id}')
+        synced_at = None
+        while True:
+            tasks = []
+            try:
+                if synced_at is None or time.monotonic() - synced_at >= WORK_QUEUE_SYNC_SECONDS:
+                    subscriber_counts = self.get_pending_subscriber_counts()
+                    PENDING_NOTIFICATIONS.set(sum(subscriber_counts.values()))
+                    work_queue.sync(subscriber_counts)
+                    synced_at = time.monotonic()
+
+                tasks = work_queue.claim(WORK_QUEUE_BATCH_SIZE)
+                if tasks:
+                    self.poll_claimed_tasks(work_queue, tasks)
+            except Exception as e:
+                self.logger.error('got unrecognized exception, silently catching it to avoid breaking loop')
+                self.logger.error(e)
+
+            # goes straight back for more while there's a backlog
+            if len(tasks) < WORK_QUEUE_BATCH_SIZE:
+                time.sleep(SCHEDULER_TICK_SECONDS)
+
+    def poll_claimed_tasks(self, work_queue: WorkQueue, tasks: List[dict]):
+        """Polls the zip codes of the given claimed tasks, scheduling their next polls with the poll scheduler"""
+        zip_codes = [task['_id'] for task in tasks]
+        self.logger.info(f'polling {len(zip_codes)} claimed zip code(s)')
+        # the queue is what tracks every zip code, so the scheduler only needs to know about these ones
+        self.poll_scheduler.update({task['_id']: task['subscribers'] for task in tasks})
+        try:
+            with work_queue.leased(zip_codes), LOOP_ITERATION_DURATION.labels('run_queue_worker').time():
+                self._refresh_location_catalogue()
+                self.poll_zip_codes(zip_codes)
+        except Exception:
+            work_queue.release(zip_codes)
+            raise
+
+        now = time.time()
+        work_queue.complete({zip_code: now + delay
+                             for zip_code, delay in self.poll_scheduler.delays(zip_codes).items()})
+
+    def get_pending_subscriber_counts(self) -> Dict[int, int]:
+        """Returns how many notification requests are waiting on each zip code"""
+        return {result['_id']: result['subscribers'] for result in self.mongodb.my_turn_ca.notifications.aggregate([
+            {'$match': {'message': {'$exists': False}}},
+            {'$group': {'_id': '$zip_code', 'subscribers': {'$sum': 1}}}
+        ])}
+
+    def poll_zip_code(self, zip_code: int) -> bool:
+        """Checks once if appointments are available near the given zip code, updating the notification
+        documents and returning True when they are found. Locations are checked closest first through the
+        availability tracker and the remaining ones are skipped once NOTIFICATION_ENOUGH_SLOTS slots were found"""
+        if not self.zip_code_index.is_valid(zip_code):
+            return zip_code in self.poll_zip_codes([zip_code])
+
+        start_date = datetime.now(tz=pytz.timezone('US/Pacific')).date()
+        end_date = start_date + timedelta(weeks=1)
+        latitude, longitude = self.zip_code_index.lookup(zip_code)
+        locations = sorted(self.my_turn_ca.get_locations(latitude=latitude, longitude=longitude),
+                           key=lambda location: location.distance_in_meters)
+        appointments = self.availability_tracker.get_appointments(locations=locations, start_date=start_date,
+                                                                  end_date=end_date,
+                                                                  enough_slots=NOTIFICATION_ENOUGH_SLOTS)
+
+        self.poll_scheduler.record_poll(
+            zip_code_location_ids={zip_code: [location.location_id for location in locations]},
+            available_location_ids={appointment.location.location_id for appointment in appointments},
+            error_rate=self.my_turn_ca.error_rate)
+        if appointments:
+            self._publish_notification(zip_code, self._build_message(start_date, end_date, appointments))
+
+        self._report_startup()
+        return bool(appointments)
+
+    def poll_zip_codes(self, zip_codes: List[int]) -> List[int]:
+        """Checks once if appointments are available near each of the given zip codes, updating the notification
+        documents of the zip codes that have appointments and returning them. Each location shared by several
+        zip codes only has its availability and slots fetched once, and slots are only re-fetched for dates whose
+        availability changed since the last poll or whose slots are stale"""
+        invalid_zip_codes = [zip_code for zip_code in zip_codes if not self.zip_code_index.is_valid(zip_code)]
+        if invalid_zip_codes:
+            self.logger.error(f'skipping zip code(s) that don\'t exist in California - {invalid_zip_codes}')
+            self.poll_scheduler.record_poll(zip_code_location_ids={zip_code: [] for zip_code in invalid_zip_codes},
+                                            available_location_ids=set(), error_rate=self.my_turn_ca.error_rate)
+            zip_codes = [zip_code for zip_code in zip_codes if zip_code not in invalid_zip_codes]
+        if not zip_codes:
+            return []
+
+        start_date = datetime.now(tz=pytz.timezone('US/Pacific')).date()
+        end_date = start_date + timedelta(weeks=1)
+        zip_code_locations = dict(zip(zip_codes, self.my_turn_ca.get_locations_for_coordinates(
+            [self.zip_code_index.lookup(zip_code) for zip_code in zip_codes])))
+        unique_locations = self._index_locations(zip_code_locations)
+        slots_by_location = {appointment.location.location_id: appointment.epochs
+                             for appointment in self.availability_tracker.get_appointments(
+                                 locations=unique_locations, start_date=start_date, end_date=end_date)}
+
+        self.poll_scheduler.record_poll(
+            zip_code_location_ids={zip_code: [location.location_id for location in locations]
+                                   for zip_code, locations in zip_code_locations.items()},
+            available_location_ids={location_id for location_id, slots in slots_by_location.items() if slots},
+            error_rate=self.my_turn_ca.error_rate)
+
+        # fans each location with slots out to the zip codes subscribed to it, each zip code gets its own
+        # Location objects back since the distances differ per zip code
+        zip_code_appointments: Dict[int, List[LocationAvailabilitySlots]] = {}
+        for location_id, epochs in slots_by_location.items():
+            for zip_code, location in self.location_subscribers[location_id]:
+                zip_code_appointments.setdefault(zip_code, []).append(
+                    LocationAvailabilitySlots(location=location, epochs=epochs))
+
+        found = []
+        for zip_code in [zip_code for zip_code in zip_codes if zip_code in zip_code_appointments]:
+            appointments = sorted(zip_code_appointments[zip_code],
+                                  key=lambda appointment: appointment.location.distance_in_meters)
+            self._publish_notification(zip_code, self._build_message(start_date, end_date, appointments))
+            found.append(zip_code)
+
+        self._report_startup()
+        return found
+
+    def _report_startup(self):
+        """Private helper function to log how long startup took once the first poll finishes"""
+        if not self.startup_timer.reported:
+            self.startup_timer.phase('first poll')
+            self.startup_timer.report(self.logger)
+
+    def _refresh_location_catalogue(self):
+        """Private helper function to rebuild the location catalogue in the background once it's due, searches go
+        to the API until it's fresh. Does nothing when my_turn_ca doesn't have a catalogue since its searches
+        always go to the API"""
+        location_catalogue = self.my_turn_ca.location_catalogue
+        if location_catalogue is None or location_catalogue.refreshing or not location_catalogue.needs_refresh():
+            return
+
+        seed_points = self.zip_code_index.seed_points(location_catalogue.seed_spacing())
+
+        def run():
+            try:
+                self.my_turn_ca.refresh_location_catalogue(seed_points)
+            except Exception as e:
+                self.logger.warning(f'failed to refresh location catalogue, searches will keep going to the API: {e}')
+
+        self.location_catalogue_refresh = threading.Thread(target=run, name='location-catalogue-refresh', daemon=True)
+        self.location_catalogue_refresh.start()
+
+    def _index_locations(self, zip_code_locations: Dict[int, List[Location]]) -> List[Location]:
+        """Private helper function to rebuild the location -> subscribed zip codes index, returns each
+        location once"""
+        self.location_subscribers = {}
+        unique_locations = []
+        for zip_code, locations in zip_code_locations.items():
+            for location in locations:
+                if location.location_id not in self.location_subscribers:
+                    self.location_subscribers[location.location_id] = []
+                    unique_locations.append(location)
+                self.location_subscribers[location.location_id].append((zip_code, location))
+
+        self.logger.info(f'polling {len(unique_locations)} unique location(s) '
+                         f'for {len(zip_code_locations)} zip code(s)')
+        return unique_locations
+
+    def _publish_notification(self, zip_code: int, message: str):
+        """Private helper function to update every pending notification document for the given zip code"""
+        self.logger.info(f'found appointments, updating notifications '
+                         f'for zip_code {zip_code} with message - {message}')
+        self.mongodb.my_turn_ca.notifications.update_many({'zip_code': zip_code, 'message': {'$exists': False}},
+                                                          {'$set': {'message': message}})
+
+    @staticmethod
+    def _build_message(start_date: date, end_date: date, appointments: List[LocationAvailabilitySlots]) -> str:
+        """Private helper function to build the notification message"""
+        message = f'Hey {MENTION_PLACEHOLDER}, I found available openings at these locations from ' \
+                  f'{start_date.strftime("%x")} to {end_date.strftime("%x")}, ' \
+                  'go to https://myturn.ca.gov to make an appointment!\n'
+
+        for appointment in appointments:
+            message += f'  * {str(appointment.location)} - {len(appointment.epochs)} appointment(s) available\n'
+
+        return message
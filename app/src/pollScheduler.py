@@ -0,0 +1,93 @@
+"""Adaptive scheduling of zip code polls"""
+import heapq
+import math
+import random
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from .constants import NOTIFICATION_WAIT_PERIOD, POLL_MIN_INTERVAL_SECONDS, POLL_MAX_INTERVAL_SECONDS, \
+    POLL_HOT_WINDOW_SECONDS, POLL_HOT_FACTOR, POLL_COLD_AFTER_SECONDS, POLL_COLD_FACTOR, POLL_ERROR_FACTOR, \
+    POLL_JITTER
+
+
+class ZipCodeSchedule:
+    """Class to represent a zip code's polling state"""
+    def __init__(self, zip_code: int, subscribers: int, next_poll_at: float):
+        self.zip_code = zip_code
+        self.subscribers = subscribers
+        self.next_poll_at = next_poll_at
+        self.location_ids: List[str] = []
+
+
+class PollScheduler:
+    """Decides when each zip code should be polled next, zip codes with more subscribers or whose locations
+    recently had slots are polled more often, and everything slows down while upstream is returning errors"""
+    def __init__(self, timer: Callable[[], float] = time.monotonic, jitter: Callable[[], float] = random.random):
+        self.timer = timer
+        self.jitter = jitter
+        self.schedules: Dict[int, ZipCodeSchedule] = {}
+        # location_id -> last time the location had slots
+        self.location_last_available: Dict[str, float] = {}
+
+    def update(self, subscriber_counts: Dict[int, int]):
+        """Syncs the scheduled zip codes with the given zip code -> subscriber count, new zip codes are due
+        immediately and zip codes that no longer have subscribers are dropped"""
+        now = self.timer()
+        for zip_code in [zip_code for zip_code in self.schedules if zip_code not in subscriber_counts]:
+            del self.schedules[zip_code]
+
+        for zip_code, subscribers in subscriber_counts.items():
+            if zip_code in self.schedules:
+                self.schedules[zip_code].subscribers = subscribers
+            else:
+                self.schedules[zip_code] = ZipCodeSchedule(zip_code=zip_code, subscribers=subscribers, next_poll_at=now)
+
+    def due(self) -> List[int]:
+        """Returns the zip codes that should be polled now, most overdue first"""
+        now = self.timer()
+        return [schedule.zip_code for schedule in sorted(self.schedules.values(), key=lambda x: x.next_poll_at)
+                if schedule.next_poll_at <= now]
+
+    def seconds_until_next_poll(self) -> Optional[float]:
+        """Returns how long until the next zip code is due, or None if nothing is scheduled"""
+        next_poll_at = heapq.nsmallest(1, [schedule.next_poll_at for schedule in self.schedules.values()])
+        return max(next_poll_at[0] - self.timer(), 0.0) if next_poll_at else None
+
+    def delays(self, zip_codes: List[int]) -> Dict[int, float]:
+        """Returns how many seconds until each of the given scheduled zip codes is due"""
+        now = self.timer()
+        return {zip_code: max(self.schedules[zip_code].next_poll_at - now, 0.0)
+                for zip_code in zip_codes if zip_code in self.schedules}
+
+    def record_poll(self, zip_code_location_ids: Dict[int, List[str]], available_location_ids: Set[str],
+                    error_rate: float):
+        """Records the outcome of polling the given zip codes and schedules their next poll"""
+        now = self.timer()
+        for location_id in available_location_ids:
+            self.location_last_available[location_id] = now
+
+        for zip_code, location_ids in zip_code_location_ids.items():
+            schedule = self.schedules.get(zip_code)
+            if schedule is None:
+                continue
+
+            schedule.location_ids = location_ids
+            schedule.next_poll_at = now + self.next_delay(schedule, error_rate)
+
+    def next_delay(self, schedule: ZipCodeSchedule, error_rate: float) -> float:
+        """Returns how many seconds to wait before polling the given zip code again"""
+        now = self.timer()
+        # every doubling of subscribers shortens the delay
+        delay = NOTIFICATION_WAIT_PERIOD / (1 + math.log2(max(schedule.subscribers, 1)))
+
+        last_available = max([self.location_last_available.get(location_id, -math.inf)
+                              for location_id in schedule.location_ids], default=-math.inf)
+        if now - last_available <= POLL_HOT_WINDOW_SECONDS:
+            delay *= POLL_HOT_FACTOR
+        elif now - last_available > POLL_COLD_AFTER_SECONDS:
+            delay *= POLL_COLD_FACTOR
+
+        delay *= 1 + POLL_ERROR_FACTOR * error_rate
+        delay = min(max(delay, POLL_MIN_INTERVAL_SECONDS), POLL_MAX_INTERVAL_SECONDS)
+        # spreads polls out so zip codes scheduled together don't keep hitting upstream together
+        return delay * (1 + POLL_JITTER * (2 * self.jitter() - 1))
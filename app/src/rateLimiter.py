@@ -0,0 +1,188 @@
+"""Token bucket rate limiting for My Turn API requests, shareable across processes"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+from urllib3.util import Retry
+
+from .constants import RATE_LIMIT_QUOTAS, RATE_LIMIT_FALLBACK_SHARE, RATE_LIMIT_FALLBACK_SECONDS
+
+
+def endpoint_name(url: str) -> Optional[str]:
+    """Returns the name of the API endpoint the given url or path belongs to, used to look up its quota"""
+    if url.endswith('/slots'):
+        return 'slots'
+    if url.endswith('/availability'):
+        return 'availability'
+    if url.endswith('locations/search'):
+        return 'locations'
+    if url.endswith('eligibility'):
+        return 'eligibility'
+    return None
+
+
+class InMemoryRateLimitBackend:
+    """Token bucket state for a single process"""
+    def __init__(self):
+        self.buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, bucket: str, rate: float, capacity: float, now: float) -> float:
+        """Takes a token from the given bucket, returns 0 if one was taken or how long to wait for one otherwise"""
+        with self._lock:
+            tokens, updated_at, blocked_until = self.buckets.get(bucket, (capacity, now, 0.0))
+            tokens = min(capacity, tokens + max(now - updated_at, 0.0) * rate)
+            granted = blocked_until <= now and tokens >= 1
+            self.buckets[bucket] = (tokens - 1 if granted else tokens, now, blocked_until)
+
+        if granted:
+            return 0.0
+        return max(blocked_until - now, (1 - tokens) / rate)
+
+    def block(self, bucket: str, until: float):
+        """Stops the given bucket from handing out tokens until the given time"""
+        with self._lock:
+            tokens, updated_at, blocked_until = self.buckets.get(bucket, (0.0, until, 0.0))
+            self.buckets[bucket] = (tokens, updated_at, max(blocked_until, until))
+
+
+class MongoRateLimitBackend:
+    """Token bucket state shared by every process through a Mongo collection, each take is a single atomic
+    update so concurrent processes never hand out the same token (requires MongoDB 4.2+)"""
+    def __init__(self, collection: Collection):
+        self.collection = collection
+
+    def take(self, bucket: str, rate: float, capacity: float, now: float) -> float:
+        """Takes a token from the given bucket, returns 0 if one was taken or how long to wait for one otherwise"""
+        blocked = {'$gt': [{'$ifNull': ['$blocked_until', 0]}, now]}
+        elapsed = {'$max': [0, {'$subtract': [now, {'$ifNull': ['$updated_at', now]}]}]}
+        document = self.collection.find_one_and_update(
+            {'_id': bucket},
+            [
+                {'$set': {'tokens': {'$min': [capacity, {'$add': [{'$ifNull': ['$tokens', capacity]},
+                                                                  {'$multiply': [elapsed, rate]}]}]},
+                          'updated_at': now}},
+                {'$set': {'granted': {'$and': [{'$not': [blocked]}, {'$gte': ['$tokens', 1]}]}}},
+                {'$set': {'tokens': {'$cond': ['$granted', {'$subtract': ['$tokens', 1]}, '$tokens']}}}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER)
+
+        if document['granted']:
+            return 0.0
+        return max(document.get('blocked_until', 0) - now, (1 - document['tokens']) / rate)
+
+    def block(self, bucket: str, until: float):
+        """Stops the given bucket from handing out tokens until the given time"""
+        self.collection.update_one({'_id': bucket}, {'$max': {'blocked_until': until}}, upsert=True)
+
+
+class RateLimiter:
+    """Token bucket rate limiter with a (requests per second, burst) quota per endpoint, endpoints without
+    a quota aren't limited. When the backend can't be reached, the process keeps to fallback_share of each quota
+    on its own for fallback_seconds before trying the backend again"""
+    def __init__(self, backend=None, quotas: Dict[str, Tuple[float, float]] = None,
+                 fallback_share: float = RATE_LIMIT_FALLBACK_SHARE,
+                 fallback_seconds: float = RATE_LIMIT_FALLBACK_SECONDS, timer: Callable[[], float] = time.time):
+        self.logger = logging.getLogger(__name__)
+        self.backend = backend if backend is not None else InMemoryRateLimitBackend()
+        self.quotas = quotas if quotas is not None else RATE_LIMIT_QUOTAS
+        self.fallback_share = fallback_share
+        self.fallback_seconds = fallback_seconds
+        self.timer = timer
+        self.fallback_backend = InMemoryRateLimitBackend()
+        # when the backend can be tried again after failing
+        self.fallback_until = 0.0
+
+    def try_acquire(self, endpoint: Optional[str]) -> float:
+        """Takes a token for the given endpoint, returns 0 if one was taken or how long to wait for one otherwise"""
+        if endpoint not in self.quotas:
+            return 0.0
+
+        rate, capacity = self.quotas[endpoint]
+        now = self.timer()
+        if now >= self.fallback_until:
+            try:
+                return self.backend.take(bucket=endpoint, rate=rate, capacity=capacity, now=now)
+            except PyMongoError as e:
+                self._fall_back(e)
+
+        return self.fallback_backend.take(bucket=endpoint, rate=rate * self.fallback_share,
+                                          capacity=max(capacity * self.fallback_share, 1), now=now)
+
+    def acquire(self, endpoint: Optional[str]):
+        """Blocks until a token for the given endpoint is taken"""
+        wait = self.try_acquire(endpoint)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.try_acquire(endpoint)
+
+    async def acquire_async(self, endpoint: Optional[str]):
+        """Waits without blocking the event loop until a token for the given endpoint is taken, tokens are taken
+        on the default executor since the backend may be a blocking database call"""
+        if endpoint not in self.quotas:
+            return
+
+        loop = asyncio.get_running_loop()
+        wait = await loop.run_in_executor(None, self.try_acquire, endpoint)
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = await loop.run_in_executor(None, self.try_acquire, endpoint)
+
+    def retry_after(self, endpoint: Optional[str], seconds: float):
+        """Pauses the given endpoint for every process sharing the backend, used when upstream sends Retry-After"""
+        if endpoint in self.quotas and seconds > 0:
+            self.logger.info(f'upstream asked us to back off /{endpoint} for {seconds} second(s)')
+            until = self.timer() + seconds
+            self.fallback_backend.block(bucket=endpoint, until=until)
+            if self.timer() >= self.fallback_until:
+                try:
+                    self.backend.block(bucket=endpoint, until=until)
+                except PyMongoError as e:
+                    self._fall_back(e)
+
+    async def retry_after_async(self, endpoint: Optional[str], seconds: float):
+        """Same as retry_after, without blocking the event loop on the backend"""
+        await asyncio.get_running_loop().run_in_executor(None, self.retry_after, endpoint, seconds)
+
+    def _fall_back(self, error: PyMongoError):
+        """Private helper function to keep to this process' share of the quotas for a while after the backend
+        failed, instead of waiting on an unreachable database on every request"""
+        self.logger.warning(f'failed to reach shared rate limits, keeping to this process\' share of the quotas '
+                            f'for {self.fallback_seconds} second(s): {error}')
+        self.fallback_until = self.timer() + self.fallback_seconds
+
+
+class RateLimitedRetry(Retry):
+    """Retry strategy that shares Retry-After responses with a rate limiter and takes a token from it
+    before every retried request, so retries count against the same budget as first attempts"""
+    def __init__(self, rate_limiter: Optional[RateLimiter] = None, endpoint: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.rate_limiter = rate_limiter
+        self.endpoint = endpoint
+
+    def new(self, **kw) -> 'RateLimitedRetry':
+        kw.setdefault('rate_limiter', self.rate_limiter)
+        kw.setdefault('endpoint', self.endpoint)
+        return super().new(**kw)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        endpoint = endpoint_name(url) if url else self.endpoint
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if self.rate_limiter is not None and retry_after:
+            self.rate_limiter.retry_after(endpoint, self.parse_retry_after(retry_after))
+
+        new_retry = super().increment(method=method, url=url, response=response, error=error, _pool=_pool,
+                                      _stacktrace=_stacktrace)
+        new_retry.endpoint = endpoint
+        return new_retry
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(self.endpoint)
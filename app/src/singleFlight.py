@@ -0,0 +1,90 @@
+"""Request coalescing, concurrent callers asking for the same key share a single in-flight call"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """Class to coalesce concurrent calls across threads, a call made while another one with the same key is
+    running waits for it and gets its result or exception instead of running again"""
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """Returns func's result, or the result of the call already in flight for key"""
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+
+class _AsyncCall:
+    """Private class to track an in-flight coroutine and how many callers are waiting on it"""
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """Class to coalesce concurrent calls within an event loop, a call made while another one with the same key
+    is running awaits it instead of running again. The shared call is only cancelled once every caller waiting
+    on it has been cancelled"""
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight: Dict[Hashable, _AsyncCall] = {}
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns the result of awaiting func(), or the result of the call already in flight for key"""
+        self.calls += 1
+        call = self._in_flight.get(key)
+        if call is None:
+            call = self._in_flight[key] = _AsyncCall(asyncio.ensure_future(func()))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            # shielded so one caller being cancelled doesn't cancel the call for everyone else
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1:
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: Hashable, call: _AsyncCall):
+        """Private helper function to stop sharing a call once it's done"""
+        if self._in_flight.get(key) is call:
+            del self._in_flight[key]
@@ -0,0 +1,29 @@
+"""Startup phase timing"""
+import logging
+import time
+from typing import Callable, List, Tuple
+
+
+class StartupTimer:
+    """Class to measure how long each phase of a process' startup takes, each phase runs from the end of
+    the previous one"""
+    def __init__(self, timer: Callable[[], float] = time.perf_counter):
+        self.timer = timer
+        self.started_at = timer()
+        self.marked_at = self.started_at
+        self.phases: List[Tuple[str, float]] = []
+        self.reported = False
+
+    def phase(self, name: str):
+        """Ends the named phase"""
+        now = self.timer()
+        self.phases.append((name, now - self.marked_at))
+        self.marked_at = now
+
+    def report(self, logger: logging.Logger):
+        """Logs the total startup time and each phase, only the first call logs anything"""
+        if self.reported:
+            return
+        self.reported = True
+        logger.info(f'startup took {(self.marked_at - self.started_at) * 1000:.0f}ms - '
+                    f'{", ".join(f"{name} {duration * 1000:.0f}ms" for name, duration in self.phases)}')
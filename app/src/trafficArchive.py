@@ -0,0 +1,146 @@
+"""Recording and replaying MyTurn API traffic through requests transport adapters"""
+import gzip
+import json
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from http import HTTPStatus
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from requests import PreparedRequest, Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from .rateLimiter import endpoint_name
+
+# only the headers MyTurnCA looks at are kept to keep archives small
+RECORDED_HEADERS = ['Content-Type', 'Retry-After']
+
+
+def _request_body(request: PreparedRequest) -> Optional[dict]:
+    """Private helper function to decode a request's JSON body"""
+    return json.loads(request.body) if request.body else None
+
+
+def _request_key(method: str, path: str, body: Optional[dict]) -> Tuple[str, str, str]:
+    """Private helper function to build the key a request is matched on during replay"""
+    return method, path, json.dumps(body, sort_keys=True)
+
+
+class TrafficRecorder:
+    """Class to append request/response pairs to a gzipped JSON lines archive, safe to share between threads"""
+    def __init__(self, path: str):
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+
+    def record(self, request: PreparedRequest, response: Response, elapsed: float):
+        """Appends a request and the response it got"""
+        line = json.dumps({
+            'offset': round(time.monotonic() - self.started_at - elapsed, 6),
+            'elapsed': round(elapsed, 6),
+            'method': request.method,
+            'path': urlsplit(request.url).path,
+            'body': _request_body(request),
+            'status': response.status_code,
+            'headers': {key: response.headers[key] for key in RECORDED_HEADERS if key in response.headers},
+            'content': response.text
+        }, separators=(',', ':'))
+        with self.lock:
+            self.file.write(line + '\n')
+
+    def close(self):
+        """Flushes and closes the archive"""
+        with self.lock:
+            self.file.close()
+
+
+def load_archive(path: str) -> List[dict]:
+    """Reads every record from an archive, an archive that wasn't closed properly (e.g. the recording process
+    was killed) is read up to where it was cut off"""
+    records = []
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        try:
+            for line in file:
+                records.append(json.loads(line))
+        except (EOFError, json.JSONDecodeError):
+            pass
+
+    return records
+
+
+class RecordingAdapter(HTTPAdapter):
+    """HTTPAdapter that records every final response, retries happen inside the adapter so they aren't recorded"""
+    def __init__(self, recorder: TrafficRecorder, **kwargs):
+        self.recorder = recorder
+        super().__init__(**kwargs)
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        started_at = time.monotonic()
+        response = super().send(request, **kwargs)
+        self.recorder.record(request, response, elapsed=time.monotonic() - started_at)
+        return response
+
+    def close(self):
+        super().close()
+        self.recorder.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """Adapter that answers requests from an archive instead of the network. Requests are matched on method, path
+    and body, requests that were never recorded as-is (e.g. because the dates in them moved on) fall back to
+    the responses recorded for the same endpoint. Matching responses are served in recorded order, wrapping
+    around once they run out, so replays are deterministic. With realtime the recording's pacing is kept, each
+    response takes as long as it originally did and isn't returned before it was in the recording (counted from
+    the first request), otherwise responses are returned as fast as possible"""
+    def __init__(self, records: List[dict], realtime: bool = False, timer: Callable[[], float] = time.monotonic):
+        super().__init__()
+        self.realtime = realtime
+        self.timer = timer
+        self.lock = threading.Lock()
+        # replay time 0 lines up with the first recorded request, set once the first request is sent
+        self.first_offset = min((record['offset'] for record in records), default=0.0)
+        self.started_at: Optional[float] = None
+        self.by_request: Dict[Tuple[str, str, str], Deque[dict]] = {}
+        self.by_endpoint: Dict[Tuple[str, Optional[str]], Deque[dict]] = {}
+        for record in records:
+            self.by_request.setdefault(_request_key(record['method'], record['path'], record['body']),
+                                       deque()).append(record)
+            self.by_endpoint.setdefault((record['method'], endpoint_name(record['path'])), deque()).append(record)
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        path = urlsplit(request.url).path
+        now = self.timer()
+        with self.lock:
+            if self.started_at is None:
+                self.started_at = now
+            records = self.by_request.get(_request_key(request.method, path, _request_body(request))) \
+                or self.by_endpoint.get((request.method, endpoint_name(path)))
+            if not records:
+                raise LookupError(f'no recorded responses for {request.method} {path}')
+            record = records[0]
+            records.rotate(-1)
+
+        if self.realtime:
+            received_at = self.started_at + record['offset'] - self.first_offset + record['elapsed']
+            time.sleep(max(record['elapsed'], received_at - now))
+        return self._build_response(request, record)
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _build_response(request: PreparedRequest, record: dict) -> Response:
+        """Private helper function to turn a record back into a response"""
+        response = Response()
+        response.status_code = record['status']
+        response.reason = HTTPStatus(record['status']).phrase
+        response.headers = CaseInsensitiveDict(record['headers'])
+        response._content = record['content'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=record['elapsed'])
+        return response
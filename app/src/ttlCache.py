@@ -0,0 +1,57 @@
+"""Thread-safe LRU cache with per-entry expiration"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Tuple
+
+MISSING = object()
+
+
+class TTLCache:
+    """LRU cache whose entries expire ttl seconds after they were stored, a ttl of 0 disables caching"""
+    def __init__(self, ttl: float, max_size: int, timer: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        """Returns whether or not the cache stores anything"""
+        return self.ttl > 0 and self.max_size > 0
+
+    def get(self, key: Hashable) -> Any:
+        """Returns the cached value for key, or MISSING if it isn't cached or has expired"""
+        with self._lock:
+            entry = self._entries.get(key, MISSING)
+            if entry is not MISSING and entry[0] > self.timer():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if entry is not MISSING:
+                del self._entries[key]
+            self.misses += 1
+            return MISSING
+
+    def put(self, key: Hashable, value: Any):
+        """Stores value under key, evicting the least recently used entry if the cache is full"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries[key] = (self.timer() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes every entry from the cache"""
+        with self._lock:
+            self._entries.clear()
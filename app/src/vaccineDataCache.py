@@ -0,0 +1,159 @@
+"""Shared cache for the vaccineData eligibility token, so new processes don't have to wait on /eligibility"""
+import logging
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+
+from .constants import VACCINE_DATA_TTL_SECONDS, VACCINE_DATA_REFRESH_AHEAD_SECONDS, VACCINE_DATA_DOCUMENT_ID
+
+
+class MongoVaccineDataBackend:
+    """vaccineData shared by every process through a single document in a Mongo collection"""
+    def __init__(self, collection: Collection):
+        self.collection = collection
+
+    def load(self) -> Optional[Tuple[str, float]]:
+        """Returns the stored (vaccine_data, fetched_at) pair, None if nothing has been stored yet"""
+        document = self.collection.find_one({'_id': VACCINE_DATA_DOCUMENT_ID})
+        if document is None:
+            return None
+        return document['vaccine_data'], document['fetched_at']
+
+    def store(self, vaccine_data: str, fetched_at: float):
+        """Stores the given vaccine_data unless a more recently fetched one is already stored"""
+        self.collection.update_one({'_id': VACCINE_DATA_DOCUMENT_ID, 'fetched_at': {'$lt': fetched_at}},
+                                   {'$set': {'vaccine_data': vaccine_data, 'fetched_at': fetched_at}})
+        self.collection.update_one({'_id': VACCINE_DATA_DOCUMENT_ID},
+                                   {'$setOnInsert': {'vaccine_data': vaccine_data, 'fetched_at': fetched_at}},
+                                   upsert=True)
+
+    def expire(self, vaccine_data: str):
+        """Marks the given vaccine_data as expired if it's still the stored one"""
+        self.collection.update_one({'_id': VACCINE_DATA_DOCUMENT_ID, 'vaccine_data': vaccine_data},
+                                   {'$set': {'fetched_at': 0}})
+
+
+class VaccineDataCache:
+    """Cache for vaccineData with a ttl and refresh-ahead, values are kept in-process and in the optional shared
+    backend, expired values keep being served until a refresh succeeds and the backend is skipped while it's
+    unreachable"""
+    def __init__(self, backend: Optional[MongoVaccineDataBackend] = None, ttl: float = VACCINE_DATA_TTL_SECONDS,
+                 refresh_ahead: float = VACCINE_DATA_REFRESH_AHEAD_SECONDS, timer: Callable[[], float] = time.time):
+        self.logger = logging.getLogger(__name__)
+        self.backend = backend
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.timer = timer
+        self.vaccine_data: Optional[str] = None
+        self.fetched_at = 0.0
+        self.refreshing = False
+        self._lock = threading.Lock()
+        # notified whenever a refresh finishes
+        self._refreshed = threading.Condition(self._lock)
+
+    def get(self) -> Optional[str]:
+        """Returns the cached vaccine_data, loading it from the backend the first time, None if there is none"""
+        if self.vaccine_data is None:
+            self._load()
+        return self.vaccine_data
+
+    def put(self, vaccine_data: str):
+        """Caches a freshly fetched vaccine_data"""
+        fetched_at = self.timer()
+        with self._lock:
+            self.vaccine_data, self.fetched_at = vaccine_data, fetched_at
+
+        if self.backend is not None:
+            try:
+                self.backend.store(vaccine_data=vaccine_data, fetched_at=fetched_at)
+            except PyMongoError as e:
+                self.logger.warning(f'failed to share vaccine data, only this process will use it: {e}')
+
+    def needs_refresh(self) -> bool:
+        """Returns whether or not the cached vaccine_data is missing or about to expire"""
+        return self.vaccine_data is None or self.timer() - self.fetched_at >= self.ttl - self.refresh_ahead
+
+    def expire(self, vaccine_data: str):
+        """Expires the given vaccine_data after upstream rejected it, newer values are left alone"""
+        with self._lock:
+            if self.vaccine_data != vaccine_data:
+                return
+            self.fetched_at = 0.0
+
+        self.logger.info('upstream rejected our vaccine data, refreshing it')
+        if self.backend is not None:
+            try:
+                self.backend.expire(vaccine_data)
+            except PyMongoError as e:
+                self.logger.warning(f'failed to expire shared vaccine data: {e}')
+
+    def start_refresh(self) -> bool:
+        """Returns True if the caller should fetch a new vaccine_data and then call finish_refresh, False if another
+        caller already is or another process already stored one that doesn't need refreshing"""
+        with self._lock:
+            if self.refreshing:
+                return False
+            self.refreshing = True
+
+        self._load()
+        if not self.needs_refresh():
+            self.finish_refresh()
+            return False
+        return True
+
+    def finish_refresh(self, vaccine_data: Optional[str] = None):
+        """Ends a refresh started with start_refresh, vaccine_data is None if it failed"""
+        try:
+            if vaccine_data is not None:
+                self.put(vaccine_data)
+        finally:
+            with self._lock:
+                self.refreshing = False
+                self._refreshed.notify_all()
+
+    def wait_for_refresh(self):
+        """Blocks until the refresh in progress in this process, if any, finishes"""
+        with self._lock:
+            self._refreshed.wait_for(lambda: not self.refreshing)
+
+    def refresh(self, fetch: Callable[[], str]):
+        """Fetches and caches a new vaccine_data, or waits for the refresh already in progress to finish and
+        uses its result"""
+        if not self.start_refresh():
+            self.wait_for_refresh()
+            return
+
+        vaccine_data = None
+        try:
+            vaccine_data = fetch()
+        finally:
+            self.finish_refresh(vaccine_data)
+
+    def refresh_in_background(self, fetch: Callable[[], str]):
+        """Refreshes the cached vaccine_data on a separate thread, failures are logged and retried on the next call"""
+        def run():
+            try:
+                self.refresh(fetch)
+            except Exception as e:
+                self.logger.warning(f'failed to refresh vaccine data, still using the old one: {e}')
+
+        if not self.refreshing:
+            threading.Thread(target=run, name='vaccine-data-refresh', daemon=True).start()
+
+    def _load(self):
+        """Private helper function to adopt the backend's vaccine_data if it was fetched more recently"""
+        if self.backend is None:
+            return
+
+        try:
+            stored = self.backend.load()
+        except PyMongoError as e:
+            self.logger.warning(f'failed to load shared vaccine data, falling back to this process\' copy: {e}')
+            return
+
+        with self._lock:
+            if stored is not None and (self.vaccine_data is None or stored[1] > self.fetched_at):
+                self.vaccine_data, self.fetched_at = stored
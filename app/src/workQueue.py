@@ -0,0 +1,105 @@
+"""Lease-based queue of zip code poll tasks shared by every queue worker through Mongo"""
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List
+
+from pymongo import ASCENDING, DeleteMany, ReturnDocument, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+from .constants import WORK_QUEUE_LEASE_SECONDS, WORK_QUEUE_HEARTBEAT_SECONDS, DUPLICATE_KEY_ERROR_CODE
+
+
+def default_worker_id() -> str:
+    """Returns an id unique to this process, pod names are unique so the hostname is used"""
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class WorkQueue:
+    """Class to claim zip code poll tasks, each task is leased to one worker at a time and the lease has to be
+    kept alive with heartbeats, tasks whose lease expired (e.g. because their worker crashed) are claimable again.
+    A task document looks like {_id: zip code, subscribers, next_poll_at, lease_owner, lease_expires_at}"""
+    def __init__(self, collection: Collection, worker_id: str = None, lease_seconds: float = WORK_QUEUE_LEASE_SECONDS,
+                 timer: Callable[[], float] = time.time):
+        self.logger = logging.getLogger(__name__)
+        self.collection = collection
+        self.worker_id = worker_id if worker_id is not None else default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.timer = timer
+
+    def sync(self, subscriber_counts: Dict[int, int]):
+        """Creates a task for every zip code with pending notification requests and removes the tasks of zip
+        codes without any, safe to call from every worker at once"""
+        requests = [UpdateOne({'_id': zip_code},
+                              {'$set': {'subscribers': subscribers},
+                               '$setOnInsert': {'next_poll_at': 0, 'lease_owner': None, 'lease_expires_at': 0}},
+                              upsert=True)
+                    for zip_code, subscribers in subscriber_counts.items()]
+        requests.append(DeleteMany({'_id': {'$nin': list(subscriber_counts)}}))
+        try:
+            self.collection.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            # another worker upserted the same new task first, which is just as good
+            if any(error['code'] != DUPLICATE_KEY_ERROR_CODE for error in e.details['writeErrors']):
+                raise
+
+    def claim(self, limit: int) -> List[dict]:
+        """Leases up to limit tasks that are due, most overdue first"""
+        tasks = []
+        while len(tasks) < limit:
+            now = self.timer()
+            task = self.collection.find_one_and_update(
+                {'next_poll_at': {'$lte': now}, 'lease_expires_at': {'$lte': now}},
+                {'$set': {'lease_owner': self.worker_id, 'lease_expires_at': now + self.lease_seconds}},
+                sort=[('next_poll_at', ASCENDING)],
+                return_document=ReturnDocument.AFTER)
+            if task is None:
+                break
+            tasks.append(task)
+
+        return tasks
+
+    def heartbeat(self, zip_codes: List[int]):
+        """Extends this worker's leases on the given zip codes"""
+        self.collection.update_many({'_id': {'$in': zip_codes}, 'lease_owner': self.worker_id},
+                                    {'$set': {'lease_expires_at': self.timer() + self.lease_seconds}})
+
+    @contextmanager
+    def leased(self, zip_codes: List[int]) -> Iterator[None]:
+        """Context manager that keeps this worker's leases on the given zip codes alive while it's open"""
+        stopped = threading.Event()
+
+        def beat():
+            while not stopped.wait(WORK_QUEUE_HEARTBEAT_SECONDS):
+                try:
+                    self.heartbeat(zip_codes)
+                except Exception as e:
+                    self.logger.error('got unrecognized exception, silently catching it to avoid breaking loop')
+                    self.logger.error(e)
+
+        thread = threading.Thread(target=beat, name='work-queue-heartbeat', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def complete(self, next_poll_at: Dict[int, float]):
+        """Releases this worker's leases on the given zip codes, scheduling each one's next poll"""
+        if not next_poll_at:
+            return
+        self.collection.bulk_write([UpdateOne({'_id': zip_code, 'lease_owner': self.worker_id},
+                                              {'$set': {'next_poll_at': poll_at, 'lease_owner': None,
+                                                        'lease_expires_at': 0}})
+                                    for zip_code, poll_at in next_poll_at.items()], ordered=False)
+
+    def release(self, zip_codes: List[int]):
+        """Releases this worker's leases on the given zip codes without rescheduling them, e.g. after a failed
+        poll, so any worker can retry them straight away"""
+        self.collection.update_many({'_id': {'$in': zip_codes}, 'lease_owner': self.worker_id},
+                                    {'$set': {'lease_owner': None, 'lease_expires_at': 0}})
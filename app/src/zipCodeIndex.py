@@ -0,0 +1,92 @@
+"""Compact, bundled index of California zip code coordinates"""
+import math
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .constants import CA_ZIP_CODE_INDEX_PATH
+
+# file layout is a little endian header of (first zip code, number of zip codes) followed by a
+# (latitude, longitude) float32 pair for every zip code in that range, NaN marks zip codes that don't exist
+HEADER_FORMAT = '<II'
+
+
+class ZipCodeIndex:
+    """Array backed zip code -> (latitude, longitude) index with O(1) lookups"""
+    def __init__(self, first_zip_code: int, coordinates: array):
+        self.first_zip_code = first_zip_code
+        self.coordinates = coordinates
+
+    @classmethod
+    def load(cls, path: str = CA_ZIP_CODE_INDEX_PATH) -> 'ZipCodeIndex':
+        """Loads an index previously written with write"""
+        with open(path, 'rb') as index_file:
+            first_zip_code, _ = struct.unpack(HEADER_FORMAT, index_file.read(struct.calcsize(HEADER_FORMAT)))
+            coordinates = array('f')
+            coordinates.frombytes(index_file.read())
+
+        if sys.byteorder != 'little':
+            coordinates.byteswap()
+        return cls(first_zip_code=first_zip_code, coordinates=coordinates)
+
+    @staticmethod
+    def write(path: str, zip_codes: Dict[int, Tuple[float, float]]):
+        """Writes the given zip code coordinates to path in the format load expects"""
+        first_zip_code, last_zip_code = min(zip_codes), max(zip_codes)
+        coordinates = array('f', [math.nan, math.nan] * (last_zip_code - first_zip_code + 1))
+        for zip_code, (latitude, longitude) in zip_codes.items():
+            coordinates[(zip_code - first_zip_code) * 2] = latitude
+            coordinates[(zip_code - first_zip_code) * 2 + 1] = longitude
+
+        if sys.byteorder != 'little':
+            coordinates.byteswap()
+        with open(path, 'wb') as index_file:
+            index_file.write(struct.pack(HEADER_FORMAT, first_zip_code, last_zip_code - first_zip_code + 1))
+            index_file.write(coordinates.tobytes())
+
+    def __len__(self):
+        return sum(1 for _ in self.items())
+
+    def lookup(self, zip_code: int) -> Optional[Tuple[float, float]]:
+        """Returns the given zip code's (latitude, longitude), or None if it isn't a CA zip code"""
+        position = (zip_code - self.first_zip_code) * 2
+        if position < 0 or position >= len(self.coordinates) or math.isnan(self.coordinates[position]):
+            return None
+
+        return self.coordinates[position], self.coordinates[position + 1]
+
+    def is_valid(self, zip_code: int) -> bool:
+        """Returns whether or not the given zip code exists in California"""
+        return self.lookup(zip_code) is not None
+
+    def seed_points(self, spacing: float) -> List[Tuple[float, float]]:
+        """Returns one point per spacing x spacing degree cell containing zip codes, placed at the
+        mean of that cell's zip codes, useful for covering the state with as few searches as possible"""
+        cells = {}
+        for _, (latitude, longitude) in self.items():
+            cells.setdefault((math.floor(latitude / spacing), math.floor(longitude / spacing)), []) \
+                .append((latitude, longitude))
+
+        return [(sum(point[0] for point in points) / len(points), sum(point[1] for point in points) / len(points))
+                for _, points in sorted(cells.items())]
+
+    def items(self) -> Iterator[Tuple[int, Tuple[float, float]]]:
+        """Iterates over every (zip code, (latitude, longitude)) in the index"""
+        for position in range(0, len(self.coordinates), 2):
+            if not math.isnan(self.coordinates[position]):
+                yield self.first_zip_code + position // 2, (self.coordinates[position], self.coordinates[position + 1])
+
+
+if __name__ == '__main__':
+    # rebuilds the bundled index from pgeocode's copy of the GeoNames dataset, pgeocode (and pandas)
+    # are only needed to run this, not at runtime
+    import pgeocode
+
+    data = pgeocode.Nominatim('us')._data_frame
+    data = data[(data['state_code'] == 'CA') & data['latitude'].notnull() & data['longitude'].notnull()]
+    output_path = sys.argv[1] if len(sys.argv) > 1 else CA_ZIP_CODE_INDEX_PATH
+    ZipCodeIndex.write(output_path, {int(row.postal_code): (row.latitude, row.longitude)
+                                     for row in data.itertuples()})
+    print(f'wrote {len(data)} zip codes to {os.path.abspath(output_path)}')
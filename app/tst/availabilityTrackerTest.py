@@ -0,0 +1,92 @@
+"""Unit tests for AvailabilityTracker"""
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import pytz
+
+from .constants import TEST_LOCATION
+from ..src.availabilityTracker import AvailabilityTracker
+from ..src.myTurnCA import Location, LocationAvailability, LocationAvailabilitySlots
+
+
+class AvailabilityTrackerTest(TestCase):
+    """Main unit test class"""
+    def setUp(self):
+        self.now = 0
+        self.today = datetime.now(tz=pytz.timezone('US/Pacific')).date()
+        self.tomorrow = self.today + timedelta(days=1)
+        self.slot = datetime.now(tz=pytz.timezone('US/Pacific')) + timedelta(days=1)
+        self.my_turn_ca = MagicMock()
+        self.my_turn_ca.get_slots_for_dates = MagicMock(
+            side_effect=lambda location_dates: [LocationAvailabilitySlots(location=location, slots=[self.slot])
+                                                for location, _ in location_dates])
+        self.tracker = AvailabilityTracker(self.my_turn_ca, max_age=60, timer=lambda: self.now)
+
+    def set_dates_available(self, dates_available):
+        """Helper method to set the dates returned by get_availabilities"""
+        self.my_turn_ca.get_availabilities = MagicMock(
+            return_value=[LocationAvailability(location=TEST_LOCATION, dates_available=dates_available)])
+
+    def get_appointments(self):
+        """Helper method to poll TEST_LOCATION"""
+        return self.tracker.get_appointments(locations=[TEST_LOCATION], start_date=self.today, end_date=self.tomorrow)
+
+    def test_unchanged(self):
+        """Tests that slots aren't re-fetched when the available dates didn't change"""
+        self.set_dates_available([self.today])
+        self.assertEqual(self.get_appointments(), [LocationAvailabilitySlots(location=TEST_LOCATION, slots=[self.slot])])
+        self.assertEqual(self.get_appointments(), [LocationAvailabilitySlots(location=TEST_LOCATION, slots=[self.slot])])
+        self.my_turn_ca.get_slots_for_dates.assert_called_with([])
+        self.assertEqual(self.my_turn_ca.get_slots_for_dates.call_count, 2)
+
+    def test_new_date(self):
+        """Tests that only newly available dates have their slots fetched"""
+        self.set_dates_available([self.today])
+        self.get_appointments()
+        self.set_dates_available([self.today, self.tomorrow])
+        self.assertEqual(self.get_appointments(),
+                         [LocationAvailabilitySlots(location=TEST_LOCATION, slots=[self.slot, self.slot])])
+        self.my_turn_ca.get_slots_for_dates.assert_called_with([(TEST_LOCATION, self.tomorrow)])
+
+    def test_stale(self):
+        """Tests that slots are re-fetched once they're older than max_age"""
+        self.set_dates_available([self.today])
+        self.get_appointments()
+        self.now = 60
+        self.get_appointments()
+        self.my_turn_ca.get_slots_for_dates.assert_called_with([(TEST_LOCATION, self.today)])
+
+    def test_past_slots(self):
+        """Tests that previously fetched slots that already occurred are filtered out"""
+        self.set_dates_available([self.today])
+        self.slot = datetime.now(tz=pytz.timezone('US/Pacific')) - timedelta(minutes=1)
+        self.assertEqual(self.get_appointments(), [])
+
+    def test_unavailable_date(self):
+        """Tests that slots for dates that aren't available anymore are forgotten"""
+        self.set_dates_available([self.today])
+        self.get_appointments()
+        self.set_dates_available([])
+        self.assertEqual(self.get_appointments(), [])
+        self.assertEqual(self.tracker.slots, {})
+
+    def test_enough_slots(self):
+        """Tests that slots are fetched a batch at a time in location order and the remaining locations are
+        skipped once enough slots were found, their slots are fetched on the next poll that needs them"""
+        locations = [Location(location_id=str(i), name=str(i), booking_type='TYPE', vaccine_data='VACCINE_DATA',
+                              distance=i, address='ADDRESS') for i in range(0, 5)]
+        self.my_turn_ca.get_availabilities = MagicMock(
+            return_value=[LocationAvailability(location=location, dates_available=[self.today])
+                          for location in locations])
+        self.tracker.batch_size = 2
+        appointments = self.tracker.get_appointments(locations=locations, start_date=self.today,
+                                                     end_date=self.tomorrow, enough_slots=2)
+        self.assertEqual([appointment.location for appointment in appointments], locations[:2])
+        self.my_turn_ca.get_slots_for_dates.assert_called_once_with([(location, self.today)
+                                                                     for location in locations[:2]])
+
+        appointments = self.tracker.get_appointments(locations=locations, start_date=self.today,
+                                                     end_date=self.tomorrow)
+        self.assertEqual([appointment.location for appointment in appointments], locations)
+        self.my_turn_ca.get_slots_for_dates.assert_called_with([(location, self.today) for location in locations[2:]])
@@ -0,0 +1,38 @@
+"""Unit tests for the database helpers"""
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from ..src.database import ensure_notification_indexes, ensure_poll_task_indexes
+
+
+def created_indexes(collection: MagicMock) -> dict:
+    """Helper method to return the index name -> index document of every index the collection was asked to create"""
+    collection.create_indexes.assert_called_once()
+    return {index.document['name']: index.document for index in collection.create_indexes.call_args[0][0]}
+
+
+class DatabaseTest(TestCase):
+    """Main unit test class"""
+    def test_notification_indexes(self):
+        """Tests that the notifications collection gets an index for each of the ways notifications are queried"""
+        notifications = MagicMock()
+        ensure_notification_indexes(notifications)
+        indexes = created_indexes(notifications)
+
+        self.assertEqual({name: list(index['key'].items()) for name, index in indexes.items()},
+                         {'user_id_zip_code': [('user_id', 1), ('zip_code', 1)],
+                          'zip_code_message': [('zip_code', 1), ('message', 1)],
+                          'ready_message': [('message', 1)],
+                          'job_name': [('job_name', 1)]})
+        self.assertEqual(indexes['ready_message']['partialFilterExpression'], {'message': {'$exists': True}})
+        self.assertEqual([name for name, index in indexes.items() if 'partialFilterExpression' in index],
+                         ['ready_message'])
+
+    def test_poll_task_indexes(self):
+        """Tests that the poll_tasks collection gets an index for claiming the most overdue task"""
+        poll_tasks = MagicMock()
+        ensure_poll_task_indexes(poll_tasks)
+        indexes = created_indexes(poll_tasks)
+
+        self.assertEqual({name: list(index['key'].items()) for name, index in indexes.items()},
+                         {'next_poll_at_lease_expires_at': [('next_poll_at', 1), ('lease_expires_at', 1)]})
@@ -0,0 +1,74 @@
+"""Unit tests for JobCache"""
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from kubernetes import client
+
+from ..src.constants import JOB_LABELS, JOB_LABEL_SELECTOR, JOB_NAME_PREFIX
+from ..src.jobCache import JobCache
+
+
+def make_job(name: str, failed: int = None, labels: dict = None) -> client.V1Job:
+    """Helper method to build a job with the given name, failure count and labels"""
+    return client.V1Job(metadata=client.V1ObjectMeta(name=name, labels=labels),
+                        status=client.V1JobStatus(failed=failed))
+
+
+class JobCacheTest(TestCase):
+    """Main unit test class"""
+    def setUp(self):
+        self.k8s_batch = MagicMock()
+        self.k8s_batch.list_namespaced_job.return_value = client.V1JobList(
+            items=[make_job('running'), make_job('failed', failed=1), make_job('deleted')],
+            metadata=client.V1ListMeta(resource_version='1'))
+        self.job_cache = JobCache(k8s_batch=self.k8s_batch, namespace='NAMESPACE')
+
+    def run_cache(self, events):
+        """Helper method to run a single list + watch cycle with the given watch events"""
+        def stream(*args, **kwargs):
+            yield from events
+            self.job_cache.stop()
+
+        with patch('app.src.jobCache.watch.Watch') as mock_watch:
+            mock_watch.return_value.stream.side_effect = stream
+            self.job_cache._run()
+
+    def test_list(self):
+        """Tests that listed jobs are cached and failed jobs aren't considered active"""
+        self.run_cache([])
+        self.assertTrue(self.job_cache.synced.is_set())
+        self.assertTrue(self.job_cache.is_active('running'))
+        self.assertFalse(self.job_cache.is_active('failed'))
+        self.assertFalse(self.job_cache.is_active('missing'))
+        self.assertFalse(self.job_cache.is_active(None))
+        self.assertEqual(len([call for call in self.k8s_batch.list_namespaced_job.call_args_list
+                              if call[1].get('label_selector') == JOB_LABEL_SELECTOR]), 1)
+
+    def test_watch(self):
+        """Tests that watch events keep the cache current"""
+        self.run_cache([{'type': 'ADDED', 'object': make_job('added')},
+                        {'type': 'MODIFIED', 'object': make_job('running', failed=1)},
+                        {'type': 'DELETED', 'object': make_job('deleted')}])
+        self.assertEqual(self.job_cache.active_job_names(), ['added'])
+
+    def test_unlabelled_jobs_labelled(self):
+        """Tests that notification jobs created before jobs were labelled are labelled before they're listed,
+        so they're still considered active"""
+        self.k8s_batch.list_namespaced_job.side_effect = [
+            client.V1JobList(items=[make_job(f'{JOB_NAME_PREFIX}old'),
+                                    make_job(f'{JOB_NAME_PREFIX}new', labels=JOB_LABELS), make_job('unrelated')],
+                             metadata=client.V1ListMeta(resource_version='1')),
+            client.V1JobList(items=[make_job(f'{JOB_NAME_PREFIX}old', labels=JOB_LABELS),
+                                    make_job(f'{JOB_NAME_PREFIX}new', labels=JOB_LABELS)],
+                             metadata=client.V1ListMeta(resource_version='2'))]
+        self.run_cache([])
+
+        self.k8s_batch.patch_namespaced_job.assert_called_once_with(
+            name=f'{JOB_NAME_PREFIX}old', namespace='NAMESPACE', body={'metadata': {'labels': JOB_LABELS}})
+        self.assertNotIn('label_selector', self.k8s_batch.list_namespaced_job.call_args_list[0][1])
+        self.assertTrue(self.job_cache.is_active(f'{JOB_NAME_PREFIX}old'))
+
+    def test_add(self):
+        """Tests that jobs added locally are active before their watch event arrives"""
+        self.job_cache.add(make_job('created'))
+        self.assertTrue(self.job_cache.is_active('created'))
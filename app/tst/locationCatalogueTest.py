@@ -0,0 +1,207 @@
+"""Unit tests for LocationCatalogue"""
+from typing import List, Optional, Tuple
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from pymongo.errors import PyMongoError
+
+from ..src.locationCatalogue import LocationCatalogue, haversine_distance
+from ..src.myTurnCA import Location
+
+SEARCH_LIMIT = 3
+# the edge location is exactly this far from the (37.0, -123.0) seed, so the search radius can be learned
+SEARCH_RADIUS = haversine_distance(37.0, -123.0, 37.4, -123.0)
+WORLD = {
+    # dense clusters where searches come back full, with a location between them no seed finds
+    'a1': (37.800, -122.400), 'a2': (37.803, -122.400), 'a3': (37.800, -122.404),
+    'b1': (38.000, -122.400), 'b2': (38.003, -122.400), 'b3': (38.000, -122.404),
+    'hidden': (37.900, -122.400),
+    # sparse area where searches return every location within the search radius
+    'far': (38.500, -121.500), 'rural': (38.700, -121.000), 'edge': (37.400, -123.000)
+}
+SEED_POINTS = [(37.0 + 0.2 * i, -123.0 + 0.2 * j) for i in range(0, 12) for j in range(0, 13)]
+
+
+def make_location(location_id: str, latitude: float, longitude: float, distance: float = 0.0) -> Location:
+    """Helper method to build a location at the given coordinates"""
+    return Location(location_id=location_id, name=location_id, booking_type='TYPE', vaccine_data='VACCINE_DATA',
+                    distance=distance, address='ADDRESS', latitude=latitude, longitude=longitude)
+
+
+def search(latitude: float, longitude: float) -> List[Location]:
+    """Helper method to search WORLD the way locations/search does, returning the closest SEARCH_LIMIT
+    locations within SEARCH_RADIUS"""
+    distances = sorted((haversine_distance(latitude, longitude, *coordinates), location_id)
+                       for location_id, coordinates in WORLD.items())
+    return [make_location(location_id, *WORLD[location_id], distance)
+            for distance, location_id in distances if distance <= SEARCH_RADIUS][:SEARCH_LIMIT]
+
+
+class FakeBackend:
+    """Stand-in for MongoLocationCatalogueBackend keeping the shared document in memory"""
+    def __init__(self):
+        self.document = {}
+
+    def refreshed_at(self) -> Optional[float]:
+        """Returns when the stored catalogue was rebuilt"""
+        return self.document.get('refreshed_at')
+
+    def load(self) -> Optional[dict]:
+        """Returns the stored catalogue"""
+        return self.document if 'refreshed_at' in self.document else None
+
+    def store(self, snapshot: dict):
+        """Stores the given catalogue unless a more recently rebuilt one is already stored"""
+        if self.document.get('refreshed_at', float('-inf')) < snapshot['refreshed_at']:
+            self.document.update(snapshot, lease_expires_at=0)
+
+    def try_lease(self, now: float, lease_seconds: float, fresh_after: float) -> bool:
+        """Takes the lease unless it's held or the stored catalogue is fresh"""
+        if self.document.get('lease_expires_at', 0) > now or \
+                self.document.get('refreshed_at', float('-inf')) > fresh_after:
+            return False
+        self.document['lease_expires_at'] = now + lease_seconds
+        return True
+
+
+def query_points() -> List[Tuple[float, float]]:
+    """Helper method to return points spread over the area covered by SEED_POINTS"""
+    return [(37.5 + 0.05 * i, -122.7 + 0.05 * j) for i in range(0, 24) for j in range(0, 32)]
+
+
+class LocationCatalogueTest(TestCase):
+    """Main unit test class"""
+    def setUp(self):
+        self.now = 0
+        self.catalogue = LocationCatalogue(max_age=60, timer=lambda: self.now)
+        self.catalogue.replace([search(*point) for point in SEED_POINTS], SEED_POINTS)
+
+    def test_haversine_distance(self):
+        """Tests that distances are computed in meters"""
+        self.assertAlmostEqual(haversine_distance(37.0, -122.0, 38.0, -122.0), 111195, delta=10)
+
+    def test_search_parameters_learned(self):
+        """Tests that the search limit and radius are learned from the search results"""
+        self.assertEqual(len(self.catalogue), len(WORLD) - 1)
+        self.assertEqual(self.catalogue.search_limit, SEARCH_LIMIT)
+        self.assertEqual(self.catalogue.search_radius, SEARCH_RADIUS)
+
+    def test_nearby_sorted_by_distance(self):
+        """Tests that nearby locations are sorted by their locally computed distance"""
+        locations = self.catalogue.nearby(38.6, -121.2)
+        self.assertEqual([location.location_id for location in locations], ['rural', 'far'])
+        self.assertAlmostEqual(locations[0].distance_in_meters, haversine_distance(38.6, -121.2, *WORLD['rural']))
+
+    def test_capped_searches_leave_gaps(self):
+        """Tests that searches whose results depend on locations full searches may have missed aren't answered"""
+        self.assertNotIn('hidden', [location.location_id for locations in self.catalogue.cells.values()
+                                    for location in locations])
+        self.assertIsNone(self.catalogue.nearby(*WORLD['hidden']))
+        self.assertIsNone(self.catalogue.nearby(37.85, -122.40))
+
+    def test_nearby_matches_search(self):
+        """Tests that every search the catalogue answers is answered the same way locations/search would"""
+        answered = 0
+        for latitude, longitude in query_points():
+            locations = self.catalogue.nearby(latitude, longitude)
+            if locations is not None:
+                answered += 1
+                self.assertEqual([location.location_id for location in locations],
+                                 [location.location_id for location in search(latitude, longitude)])
+
+        self.assertGreater(answered, 0)
+
+    def test_refinement_points(self):
+        """Tests that full searches get a search on each side of them, as far out as their farthest location"""
+        seed_points = [(37.8, -122.4), (38.6, -121.2)]
+        points = LocationCatalogue.refinement_points([search(*point) for point in seed_points], seed_points)
+        self.assertEqual(len(points), 4)
+        covered_radius = haversine_distance(37.8, -122.4, *WORLD['a3'])
+        for latitude, longitude in points:
+            self.assertAlmostEqual(haversine_distance(37.8, -122.4, latitude, longitude), covered_radius, delta=1)
+
+    def test_seed_spacing(self):
+        """Tests that seed points are spaced by the learned search radius, within bounds"""
+        self.assertAlmostEqual(self.catalogue.seed_spacing(), 0.4, places=2)
+        self.assertEqual(LocationCatalogue().seed_spacing(), 0.5)
+
+    def test_freshness(self):
+        """Tests that the catalogue is only fresh until max_age has passed"""
+        self.assertTrue(self.catalogue.is_fresh())
+        self.now = 60
+        self.assertFalse(self.catalogue.is_fresh())
+        self.assertFalse(LocationCatalogue().is_fresh())
+
+    def test_locations_without_coordinates_ignored(self):
+        """Tests that locations without coordinates can't make the catalogue fresh"""
+        catalogue = LocationCatalogue()
+        catalogue.replace([[Location(location_id='ID', name='NAME', booking_type='TYPE', vaccine_data='VACCINE_DATA',
+                                     distance=1.0, address='ADDRESS')]], [(1.0, 2.0)])
+        self.assertFalse(catalogue.is_fresh())
+
+    def test_refreshed_at_most_once_per_max_age(self):
+        """Tests that a refresh that came back empty or failed isn't retried until max_age has passed"""
+        catalogue = LocationCatalogue(max_age=60, timer=lambda: self.now)
+        self.assertTrue(catalogue.needs_refresh())
+        self.assertTrue(catalogue.start_refresh())
+        catalogue.replace([], [])
+        catalogue.finish_refresh()
+        self.assertFalse(catalogue.is_fresh())
+        self.assertFalse(catalogue.needs_refresh())
+        self.assertFalse(catalogue.start_refresh())
+
+        self.now = 60
+        self.assertTrue(catalogue.start_refresh())
+        catalogue.finish_refresh()
+        self.now = 90
+        self.assertFalse(catalogue.needs_refresh())
+        self.now = 120
+        self.assertTrue(catalogue.needs_refresh())
+
+    def test_refresh_not_started_twice(self):
+        """Tests that a refresh already in progress in this process isn't started again"""
+        catalogue = LocationCatalogue(max_age=60, timer=lambda: self.now)
+        self.assertTrue(catalogue.start_refresh())
+        self.assertFalse(catalogue.start_refresh())
+
+    def test_shared_catalogue(self):
+        """Tests that only one process rebuilds a shared catalogue and the others adopt it"""
+        backend = FakeBackend()
+        refresher = LocationCatalogue(max_age=60, backend=backend, timer=lambda: self.now)
+        other = LocationCatalogue(max_age=60, backend=backend, timer=lambda: self.now)
+        self.assertTrue(refresher.start_refresh())
+        self.assertFalse(other.start_refresh())
+        refresher.replace([search(*point) for point in SEED_POINTS], SEED_POINTS)
+        refresher.finish_refresh()
+
+        self.now = 10
+        self.assertFalse(other.needs_refresh())
+        self.assertTrue(other.is_fresh())
+        for point in query_points():
+            self.assertEqual(other.nearby(*point), refresher.nearby(*point))
+
+        self.now = 60
+        self.assertTrue(other.start_refresh())
+        self.assertFalse(refresher.start_refresh())
+
+    def test_expired_lease_taken_over(self):
+        """Tests that a lease held by a process that never finished its rebuild is taken over once it expires"""
+        backend = FakeBackend()
+        refresher = LocationCatalogue(max_age=60, backend=backend, lease_seconds=30, timer=lambda: self.now)
+        other = LocationCatalogue(max_age=60, backend=backend, lease_seconds=30, timer=lambda: self.now)
+        self.assertTrue(refresher.start_refresh())
+        self.assertFalse(other.start_refresh())
+        self.now = 30
+        self.assertTrue(other.start_refresh())
+
+    def test_backend_failure_refreshes_locally(self):
+        """Tests that the catalogue is still rebuilt and used by this process when the backend can't be reached"""
+        backend = MagicMock()
+        for method in (backend.refreshed_at, backend.load, backend.store, backend.try_lease):
+            method.side_effect = PyMongoError('unreachable')
+        catalogue = LocationCatalogue(max_age=60, backend=backend, timer=lambda: self.now)
+        self.assertTrue(catalogue.start_refresh())
+        catalogue.replace([search(*point) for point in SEED_POINTS], SEED_POINTS)
+        catalogue.finish_refresh()
+        self.assertTrue(catalogue.is_fresh())
+        self.assertFalse(catalogue.needs_refresh())
@@ -0,0 +1,33 @@
+"""Unit tests for message formatting helpers"""
+from unittest import TestCase
+
+from ..src.messageFormatting import split_message, render_notification
+
+MESSAGE = 'Hey <@{user_id}>, I found appointments!\n  * LOCATION\n'
+
+
+class MessageFormattingTest(TestCase):
+    """Main unit test class"""
+    def test_single_user(self):
+        """Tests that a single user is mentioned the same way as before"""
+        self.assertEqual(render_notification(MESSAGE, [1]), ['Hey <@1>, I found appointments!\n  * LOCATION\n'])
+
+    def test_multiple_users(self):
+        """Tests that every user is mentioned in one message when it fits"""
+        self.assertEqual(render_notification(MESSAGE, [1, 2, 3]),
+                         ['Hey <@1>, <@2>, <@3>, I found appointments!\n  * LOCATION\n'])
+
+    def test_mentions_split_at_limit(self):
+        """Tests that mentions are spread across messages that stay under the limit"""
+        messages = render_notification(MESSAGE, list(range(100, 120)), limit=80)
+        self.assertTrue(all(len(message) <= 80 for message in messages))
+        self.assertEqual(sum(message.count('<@') for message in messages), 20)
+        self.assertTrue(all(message.endswith('  * LOCATION\n') for message in messages))
+
+    def test_split_message_between_lines(self):
+        """Tests that long messages are split between lines"""
+        self.assertEqual(split_message('aaaa\nbbbb\ncc\n', limit=10), ['aaaa\nbbbb\n', 'cc\n'])
+
+    def test_split_message_long_line(self):
+        """Tests that lines longer than the limit are split"""
+        self.assertEqual(split_message('a' * 25, limit=10), ['a' * 10, 'a' * 10, 'a' * 5])
@@ -0,0 +1,44 @@
+"""Unit tests for metrics"""
+from unittest import TestCase
+
+from prometheus_client import REGISTRY
+
+from ..src.metrics import observe_request, register_cache, register_single_flight
+from ..src.singleFlight import SingleFlight
+from ..src.ttlCache import TTLCache
+
+
+class MetricsTest(TestCase):
+    """Main unit test class"""
+    @staticmethod
+    def errors(endpoint: str, status: str) -> float:
+        """Helper method to read the error counter"""
+        return REGISTRY.get_sample_value('myturn_request_errors_total',
+                                         {'endpoint': endpoint, 'status': status}) or 0
+
+    def test_observe_request(self):
+        """Tests that rate limited, server error and connection error attempts are counted, other statuses aren't"""
+        observe_request(endpoint='metrics_test', statuses=[429, None, 503, 404, 200], latency=0.5)
+        self.assertEqual([self.errors('metrics_test', status) for status in ['429', 'connection_error', '503', '404']],
+                         [1, 1, 1, 0])
+        self.assertEqual(REGISTRY.get_sample_value('myturn_request_latency_seconds_count',
+                                                   {'endpoint': 'metrics_test'}), 1)
+
+    def test_register_cache(self):
+        """Tests that cache gauges are read from the cache when scraped"""
+        cache = TTLCache(ttl=10, max_size=10)
+        register_cache('metrics_test', cache)
+        cache.put('key', 'value')
+        cache.get('key')
+        cache.get('missing')
+        self.assertEqual([REGISTRY.get_sample_value(name, {'cache': 'metrics_test'})
+                          for name in ['response_cache_hits', 'response_cache_misses', 'response_cache_size']],
+                         [1, 1, 1])
+
+    def test_register_single_flight(self):
+        """Tests that single flight gauges are read from the single flight when scraped"""
+        single_flight = SingleFlight()
+        register_single_flight('metrics_test', single_flight)
+        single_flight.coalesced = 2
+        self.assertEqual([REGISTRY.get_sample_value(name, {'cache': 'metrics_test'})
+                          for name in ['coalesced_calls', 'in_flight_calls']], [2, 0])
@@ -0,0 +1,177 @@
+"""Unit tests for MyTurnCABot and its background helpers"""
+from unittest import TestCase, IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from discord.errors import NotFound
+from pymongo import DeleteOne, UpdateMany
+from pymongo.errors import OperationFailure
+
+from ..src.constants import NOTIFICATION_CHANGE_STREAM_PIPELINE, JOB_LABEL_SELECTOR, MENTION_PLACEHOLDER
+from ..src.myTurnCABot import MyTurnCABot, assign_notification_jobs, deliver_ready_notifications, \
+    watch_notifications
+
+
+def make_stream(events, resume_token=None) -> MagicMock:
+    """Helper method to build a change stream context manager yielding the given events"""
+    stream = MagicMock(resume_token=resume_token)
+    stream.__iter__.return_value = iter(events)
+    context = MagicMock()
+    context.__enter__.return_value = stream
+    return context
+
+
+class WatchNotificationsTest(TestCase):
+    """Unit tests for watch_notifications"""
+    def setUp(self):
+        self.notifications = MagicMock()
+        self.is_closed = MagicMock(return_value=False)
+        self.on_change = MagicMock()
+        self.on_unsupported = MagicMock()
+
+    @patch('app.src.myTurnCABot.time')
+    def watch(self, _):
+        """Helper method to run watch_notifications without sleeping between reconnects"""
+        watch_notifications(notifications=self.notifications, is_closed=self.is_closed, on_change=self.on_change,
+                            on_unsupported=self.on_unsupported)
+
+    def test_events_signal_changes(self):
+        """Tests that opening the stream and each of its events signal a change, and that the stream is
+        resumed from the last event when it's reopened"""
+        self.is_closed.side_effect = [False, False, True]
+        self.notifications.watch.side_effect = [make_stream([{'_id': 1}, {'_id': 2}], resume_token={'_data': 'a'}),
+                                                make_stream([])]
+        self.watch()
+
+        self.assertEqual(self.on_change.call_count, 4)
+        self.assertEqual(self.notifications.watch.call_args_list[0][0][0], NOTIFICATION_CHANGE_STREAM_PIPELINE)
+        self.assertEqual([call[1]['resume_after'] for call in self.notifications.watch.call_args_list],
+                         [None, {'_data': 'a'}])
+        self.on_unsupported.assert_not_called()
+
+    def test_unsupported_falls_back_to_polling(self):
+        """Tests that databases that don't support change streams fall back to polling"""
+        for code in [40573, 40324]:
+            with self.subTest(code=code):
+                self.on_unsupported.reset_mock()
+                self.notifications.watch.side_effect = OperationFailure('not supported', code=code)
+                self.watch()
+                self.on_unsupported.assert_called_once()
+                self.on_change.assert_not_called()
+
+    def test_other_errors_reopen_stream(self):
+        """Tests that other errors reopen the stream from scratch instead of falling back to polling"""
+        self.is_closed.side_effect = [False, False, True]
+        self.notifications.watch.side_effect = [OperationFailure('history lost', code=286), make_stream([])]
+        self.watch()
+
+        self.assertEqual(self.notifications.watch.call_count, 2)
+        self.on_change.assert_called_once()
+        self.on_unsupported.assert_not_called()
+
+
+class AssignNotificationJobsTest(TestCase):
+    """Unit tests for assign_notification_jobs"""
+    def setUp(self):
+        self.notifications = MagicMock()
+        self.job_cache = MagicMock()
+        self.job_cache.is_active.side_effect = lambda job_name: job_name == 'job-active'
+        self.create_job = MagicMock()
+        self.create_job.return_value.metadata.name = 'job-new'
+
+    def test_reassignments_batched(self):
+        """Tests that pending notifications are pointed at their zip code's active job in one unordered bulk write,
+        and only one job is created per call"""
+        self.notifications.find.return_value = [{'zip_code': 94103, 'job_name': 'job-active'},
+                                                {'zip_code': 94103},
+                                                {'zip_code': 94110, 'job_name': 'job-failed'},
+                                                {'zip_code': 90001}]
+        assign_notification_jobs(self.notifications, job_cache=self.job_cache, create_job=self.create_job)
+
+        self.assertEqual(self.notifications.find.call_args[0][0], {'message': {'$exists': False}})
+        self.create_job.assert_called_once_with(90001)
+        self.notifications.bulk_write.assert_called_once_with(
+            [UpdateMany({'zip_code': 90001, 'message': {'$exists': False}, 'job_name': {'$ne': 'job-new'}},
+                        {'$set': {'job_name': 'job-new'}}),
+             UpdateMany({'zip_code': 94103, 'message': {'$exists': False}, 'job_name': {'$ne': 'job-active'}},
+                        {'$set': {'job_name': 'job-active'}})],
+            ordered=False)
+
+    def test_nothing_to_reassign(self):
+        """Tests that nothing is written when every pending notification already has an active job"""
+        self.notifications.find.return_value = [{'zip_code': 94103, 'job_name': 'job-active'}]
+        assign_notification_jobs(self.notifications, job_cache=self.job_cache, create_job=self.create_job)
+
+        self.create_job.assert_not_called()
+        self.notifications.bulk_write.assert_not_called()
+
+
+class DeliverReadyNotificationsTest(IsolatedAsyncioTestCase):
+    """Unit tests for deliver_ready_notifications"""
+    def setUp(self):
+        self.notifications = MagicMock()
+        self.notifications.find.return_value = [
+            {'_id': 1, 'channel_id': 10, 'user_id': 100, 'message': f'{MENTION_PLACEHOLDER} MESSAGE'},
+            {'_id': 2, 'channel_id': 10, 'user_id': 101, 'message': f'{MENTION_PLACEHOLDER} MESSAGE'},
+            {'_id': 3, 'channel_id': 20, 'user_id': 102, 'message': f'{MENTION_PLACEHOLDER} MESSAGE'},
+            {'_id': 4, 'channel_id': 30, 'user_id': 103, 'message': f'{MENTION_PLACEHOLDER} MESSAGE'}
+        ]
+        self.channels = {channel_id: AsyncMock() for channel_id in [10, 20, 30]}
+        self.forget_channel = MagicMock()
+
+    async def get_channel(self, channel_id: int):
+        """Helper method to look up the test channels, channel 20 was deleted"""
+        if channel_id == 20:
+            raise NotFound(MagicMock(status=404), 'not found')
+        return self.channels[channel_id]
+
+    async def deliver(self):
+        """Helper method to deliver the test notifications"""
+        await deliver_ready_notifications(self.notifications, get_channel=self.get_channel,
+                                          forget_channel=self.forget_channel)
+
+    async def test_deletes_batched(self):
+        """Tests that notifications are sent once per channel and message, and every handled notification is
+        deleted in one unordered bulk write, including ones for missing channels"""
+        await self.deliver()
+
+        self.channels[10].send.assert_awaited_once()
+        self.assertIn('<@100>', self.channels[10].send.call_args[0][0])
+        self.assertIn('<@101>', self.channels[10].send.call_args[0][0])
+        self.channels[30].send.assert_awaited_once()
+        self.forget_channel.assert_called_once_with(20)
+        self.notifications.bulk_write.assert_called_once_with([DeleteOne({'_id': _id}) for _id in [1, 2, 3, 4]],
+                                                              ordered=False)
+
+    async def test_handled_notifications_deleted_when_delivery_breaks(self):
+        """Tests that notifications handled before delivery broke are still deleted so they aren't sent twice"""
+        self.channels[30].send.side_effect = RuntimeError('connection lost')
+        with self.assertRaises(RuntimeError):
+            await self.deliver()
+
+        self.notifications.bulk_write.assert_called_once_with([DeleteOne({'_id': _id}) for _id in [1, 2, 3]],
+                                                              ordered=False)
+
+
+class MyTurnCABotTest(IsolatedAsyncioTestCase):
+    """Unit tests for the bot class"""
+    @patch('app.src.myTurnCABot.client')
+    @patch('app.src.myTurnCABot.config')
+    def setUp(self, *_):
+        self.my_turn_ca = AsyncMock()
+        self.bot = MyTurnCABot(command_prefix='!', namespace='NAMESPACE', my_turn_ca=self.my_turn_ca)
+        self.bot.job_cache = MagicMock()
+        self.bot.k8s_batch = MagicMock()
+
+    async def test_close_deletes_jobs(self):
+        """Tests that closing the bot labels jobs created before jobs were labelled and then deletes every
+        notification job"""
+        calls = MagicMock()
+        calls.attach_mock(self.bot.job_cache.label_unlabelled_jobs, 'label_unlabelled_jobs')
+        calls.attach_mock(self.bot.k8s_batch.delete_collection_namespaced_job, 'delete_collection_namespaced_job')
+        await self.bot.close()
+
+        self.assertEqual([name for name, _, _ in calls.mock_calls],
+                         ['label_unlabelled_jobs', 'delete_collection_namespaced_job'])
+        self.assertEqual(self.bot.k8s_batch.delete_collection_namespaced_job.call_args[1]['label_selector'],
+                         JOB_LABEL_SELECTOR)
+        self.my_turn_ca.close.assert_awaited_once()
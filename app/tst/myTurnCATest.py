@@ -1,7 +1,12 @@
 """Unit tests for MyTurnCA API wrapper"""
-from datetime import datetime, timedelta
-from unittest import TestCase
-from unittest.mock import MagicMock, patch
+import asyncio
+import json
+import pickle
+import threading
+import time
+from datetime import date, datetime, timedelta
+from unittest import TestCase, IsolatedAsyncioTestCase
+from unittest.mock import MagicMock, AsyncMock, patch
 
 import pytz
 import responses
@@ -11,8 +16,16 @@ from .constants import MOCK_VACCINE_DATA, EMPTY_LOCATIONS_RESPONSE, NON_EMPTY_LO
     MIXED_LOCATION_AVAILABILITY_RESPONSE, TEST_LOCATION, EMPTY_AVAILABILITY_SLOTS_RESPONSE, \
     OLD_AVAILABILITY_SLOTS_RESPONSE, MIXED_AVAILABILITY_SLOTS_RESPONSE, AVAILABLE_LOCATION_AVAILABILITY_RESPONSE, \
     NEW_AVAILABILITY_SLOTS_RESPONSE, BAD_JSON_RESPONSE, CURRENT_TIME, TEST_API_KEY
-from ..src.constants import MY_TURN_URL, LOCATIONS_URL, LOCATION_AVAILABILITY_URL, LOCATION_AVAILABILITY_SLOTS_URL
-from ..src.myTurnCA import MyTurnCA, Location, LocationAvailability, LocationAvailabilitySlots
+from ..src.constants import MY_TURN_URL, ELIGIBILITY_URL, LOCATIONS_URL, LOCATION_AVAILABILITY_URL, \
+    LOCATION_AVAILABILITY_SLOTS_URL
+from ..src.apiExceptions import VaccineDataRejected
+from ..src.locationCatalogue import LocationCatalogue
+from ..src.myTurnCA import MyTurnCA, AsyncMyTurnCA, Location, LocationAvailability, LocationAvailabilitySlots
+
+
+def slot_at(day: date) -> datetime:
+    """Helper function to build a slot at midnight on the given day"""
+    return datetime.combine(day, datetime.min.time(), tzinfo=pytz.timezone('US/Pacific'))
 
 
 class MyTurnCATest(TestCase):
@@ -61,6 +74,159 @@ class MyTurnCATest(TestCase):
                                    booking_type=location['type'])
                           for location in NON_EMPTY_LOCATION_RESPONSE['locations']])
 
+    def test_models_hashable(self):
+        """Tests that equal models hash the same so they can be deduplicated with sets"""
+        location = Location(location_id=TEST_LOCATION.location_id, name=TEST_LOCATION.name,
+                            booking_type=TEST_LOCATION.booking_type, vaccine_data=TEST_LOCATION.vaccine_data,
+                            distance=TEST_LOCATION.distance_in_meters, address=TEST_LOCATION.address)
+        self.assertEqual(len({location, TEST_LOCATION}), 1)
+        self.assertEqual(len({LocationAvailability(location=location, dates_available=[self.today]),
+                              LocationAvailability(location=TEST_LOCATION, dates_available=[self.today])}), 1)
+        self.assertEqual(len({LocationAvailabilitySlots(location=location, slots=[slot_at(self.today)]),
+                              LocationAvailabilitySlots(location=TEST_LOCATION, slots=[slot_at(self.today)])}), 1)
+
+    def test_models_immutable(self):
+        """Tests that models can't be modified once built"""
+        with self.assertRaises(AttributeError):
+            TEST_LOCATION.name = 'new name'
+        with self.assertRaises(AttributeError):
+            LocationAvailabilitySlots(location=TEST_LOCATION, slots=[]).location = None
+
+    def test_slots_round_trip(self):
+        """Tests that slots stored as epoch seconds are returned as the same Pacific datetimes"""
+        slots = [slot_at(self.today), slot_at(self.today) + timedelta(minutes=5)]
+        appointments = LocationAvailabilitySlots(location=TEST_LOCATION, slots=slots)
+        self.assertEqual(appointments.slots, slots)
+        self.assertEqual(pickle.loads(pickle.dumps(appointments)), appointments)
+
+    @responses.activate
+    @patch('app.src.myTurnCA.MyTurnCA._get_vaccine_data', MagicMock(return_value=MOCK_VACCINE_DATA))
+    def test_base_url(self):
+        """Tests that requests go to the given base url"""
+        responses.add(responses.POST, f'http://127.0.0.1:8080/public/{LOCATIONS_URL}', json=EMPTY_LOCATIONS_RESPONSE)
+        my_turn_ca = MyTurnCA(api_key=TEST_API_KEY, base_url='http://127.0.0.1:8080/public/')
+        self.assertEqual(my_turn_ca.get_locations(1, 2), [])
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_successful_requests_sampled(self):
+        """Tests that successful requests are only logged when sampled"""
+        responses.add(responses.POST, f'{MY_TURN_URL}{LOCATIONS_URL}', json=EMPTY_LOCATIONS_RESPONSE)
+        self.my_turn_ca.log_sample_rate = 0
+        with patch.object(self.my_turn_ca.logger, 'log') as log:
+            self.my_turn_ca.get_locations(1, 2)
+        log.assert_not_called()
+
+    @responses.activate
+    def test_failed_requests_logged(self):
+        """Tests that failed requests are logged with their endpoint, status and size"""
+        responses.add(responses.POST, f'{MY_TURN_URL}{LOCATIONS_URL}', body=BAD_JSON_RESPONSE, status=404)
+        self.my_turn_ca.log_sample_rate = 0
+        with self.assertLogs(self.my_turn_ca.logger, level='WARNING') as logs:
+            self.my_turn_ca.get_locations(1, 2)
+        self.assertEqual(logs.records[0].endpoint, 'locations')
+        self.assertEqual(logs.records[0].status, 404)
+        self.assertEqual(logs.records[0].bytes, len(BAD_JSON_RESPONSE))
+
+    @responses.activate
+    def test_locations_cached(self):
+        """Tests that repeated searches near the same coordinates only hit the API once"""
+        responses.add(responses.POST, f'{MY_TURN_URL}{LOCATIONS_URL}', json=NON_EMPTY_LOCATION_RESPONSE)
+        self.assertEqual(self.my_turn_ca.get_locations(1.0012, 2.0031), self.my_turn_ca.get_locations(1.001, 2.001))
+        self.assertEqual(len(responses.calls), 1)
+        # only the cache key is rounded, the distances are measured from the exact coordinates searched
+        self.assertEqual(json.loads(responses.calls[0].request.body)['location'], {'lat': 1.0012, 'lng': 2.0031})
+        self.assertEqual((self.my_turn_ca.cache.hits, self.my_turn_ca.cache.misses), (1, 1))
+
+    @responses.activate
+    def test_locations_searched_again_with_fresh_vaccine_data(self):
+        """Tests that a location search rejecting the vaccine data is retried once with freshly fetched vaccine
+        data instead of failing"""
+        responses.add(responses.POST, f'{MY_TURN_URL}{LOCATIONS_URL}', json={'error': 'INVALID'}, status=400)
+        responses.add(responses.POST, f'{MY_TURN_URL}{LOCATIONS_URL}', json=NON_EMPTY_LOCATION_RESPONSE)
+        responses.add(responses.POST, f'{MY_TURN_URL}{ELIGIBILITY_URL}',
+                      json={'eligible': True, 'vaccineData': 'FRESH_VACCINE_DATA'})
+        self.assertEqual(self.my_turn_ca.get_locations(1, 2), [TEST_LOCATION for _ in range(0, 3)])
+        self.assertEqual([json.loads(call.request.body).get('vaccineData') for call in responses.calls],
+                         [MOCK_VACCINE_DATA, None, 'FRESH_VACCINE_DATA'])
+
+    def test_concurrent_rejected_searches_share_refresh(self):
+        """Tests that searches rejected at the same time all wait on a single vaccine data refresh and are retried
+        with its result"""
+        rejected = threading.Barrier(3, timeout=5)
+
+        def send(url, body):
+            if url == ELIGIBILITY_URL:
+                # slow enough for the other searches to find the refresh in progress
+                time.sleep(0.1)
+                return MagicMock(json=MagicMock(return_value={'eligible': True, 'vaccineData': 'FRESH_VACCINE_DATA'}))
+            if body['vaccineData'] == MOCK_VACCINE_DATA:
+                rejected.wait()
+                self.my_turn_ca.vaccine_data_cache.expire(body['vaccineData'])
+                raise VaccineDataRejected
+            return MagicMock(json=MagicMock(return_value=NON_EMPTY_LOCATION_RESPONSE))
+
+        results = {}
+        with patch.object(self.my_turn_ca, '_send_request', side_effect=send) as send_request:
+            threads = [threading.Thread(target=lambda i=i: results.update({i: self.my_turn_ca.get_locations(i, i)}))
+                       for i in range(0, 3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(timeout=5)
+
+        self.assertEqual(results, {i: [TEST_LOCATION for _ in range(0, 3)] for i in range(0, 3)})
+        self.assertEqual([call[1]['url'] for call in send_request.call_args_list].count(ELIGIBILITY_URL), 1)
+
+    @responses.activate
+    def test_location_search_given_up_after_second_rejection(self):
+        """Tests that a location search rejected again after refreshing the vaccine data returns no locations and
+        isn't cached"""
+        responses.add(responses.POST, f'{MY_TURN_URL}{LOCATIONS_URL}', json={'error': 'INVALID'}, status=400)
+        responses.add(responses.POST, f'{MY_TURN_URL}{ELIGIBILITY_URL}',
+                      json={'eligible': True, 'vaccineData': 'FRESH_VACCINE_DATA'})
+        self.assertEqual(self.my_turn_ca.get_locations(1, 2), [])
+        self.assertEqual(len(self.my_turn_ca.cache), 0)
+
+    @responses.activate
+    def test_locations_not_cached_on_decode_error(self):
+        """Tests that failed searches aren't cached"""
+        responses.add(method=responses.POST, url=f'{MY_TURN_URL}{LOCATIONS_URL}', body=BAD_JSON_RESPONSE)
+        self.my_turn_ca.get_locations(1, 2)
+        self.my_turn_ca.get_locations(1, 2)
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_locations_searched_when_catalogue_has_gaps(self):
+        """Tests that searches the location catalogue can't answer go to the API"""
+        responses.add(responses.POST, f'{MY_TURN_URL}{LOCATIONS_URL}', json=NON_EMPTY_LOCATION_RESPONSE)
+        self.my_turn_ca.location_catalogue = LocationCatalogue()
+        # a single full search only covers up to its farthest location
+        self.my_turn_ca.location_catalogue.replace(
+            [[Location(location_id=str(i), name=str(i), booking_type='', vaccine_data='', distance=i * 100.0,
+                       address='', latitude=37.8 + i * 0.001, longitude=-122.4) for i in range(0, 3)]],
+            [(37.8, -122.4)])
+        self.assertTrue(self.my_turn_ca.location_catalogue.is_fresh())
+        self.assertEqual(self.my_turn_ca.get_locations(37.9, -122.4), [TEST_LOCATION for _ in range(0, 3)])
+        self.assertEqual(len(responses.calls), 1)
+
+    def test_refresh_location_catalogue_refines_full_searches(self):
+        """Tests that the catalogue is refreshed from the seed points plus points around full searches"""
+        full = [Location(location_id=str(i), name=str(i), booking_type='', vaccine_data='', distance=i * 1000.0,
+                         address='', latitude=37.8 + i * 0.009, longitude=-122.4) for i in range(0, 3)]
+        self.my_turn_ca.location_catalogue = LocationCatalogue()
+        with patch.object(self.my_turn_ca, '_search_locations',
+                          side_effect=lambda latitude, longitude, precision: full
+                          if (latitude, longitude) == (37.8012, -122.4031) else full[:1]) as search_locations:
+            self.my_turn_ca.refresh_location_catalogue([(37.8012, -122.4031), (38.5, -121.5)])
+
+        searched = [(call[1]['latitude'], call[1]['longitude']) for call in search_locations.call_args_list]
+        self.assertEqual(searched[:2], [(37.8012, -122.4031), (38.5, -121.5)])
+        self.assertEqual(len(searched), 6)
+        # the catalogue's searches aren't served from searches sent from nearby points
+        self.assertTrue(all(call[1]['precision'] is None for call in search_locations.call_args_list))
+        self.assertEqual(self.my_turn_ca.location_catalogue.search_limit, 3)
+
     @responses.activate
     def test_no_availability(self):
         """Tests that no dates are returned given empty response"""
@@ -179,4 +345,189 @@ class MyTurnCATest(TestCase):
                                                  for x in NEW_AVAILABILITY_SLOTS_RESPONSE['slotsWithAvailability']])
         get_availability.side_effect = [availability, availability]
         get_slots.side_effect = [slots, LocationAvailabilitySlots(location=TEST_LOCATION, slots=[])]
-        self.assertEqual(self.my_turn_ca.get_appointments(1, 2, self.today, self.today), [slots])
\ No newline at end of file
+        self.assertEqual(self.my_turn_ca.get_appointments(1, 2, self.today, self.today), [slots])
+
+    @patch('app.src.myTurnCA.MyTurnCA.get_availability')
+    @patch('app.src.myTurnCA.MyTurnCA.get_slots')
+    def test_appointments_preserve_location_order(self, get_slots, get_availability):
+        """Tests that concurrently fetched appointments are returned in the same order as the locations"""
+        locations = [Location(location_id=str(i), name=str(i), booking_type='', vaccine_data='', distance=i, address='')
+                     for i in range(0, 5)]
+
+        def availability(location, start_date, end_date):
+            # makes the first locations finish last
+            time.sleep(0.01 * (len(locations) - int(location.location_id)))
+            return LocationAvailability(location=location, dates_available=[start_date, end_date])
+
+        get_availability.side_effect = availability
+        get_slots.side_effect = lambda location, start_date: LocationAvailabilitySlots(location=location,
+                                                                                      slots=[slot_at(start_date)])
+        with patch('app.src.myTurnCA.MyTurnCA.get_locations', MagicMock(return_value=locations)):
+            appointments = self.my_turn_ca.get_appointments(1, 2, self.today, self.today + timedelta(days=1))
+
+        self.assertEqual([appointment.location for appointment in appointments], locations)
+        self.assertEqual([appointment.slots for appointment in appointments],
+                         [[slot_at(self.today), slot_at(self.today + timedelta(days=1))] for _ in locations])
+
+    @patch('app.src.myTurnCA.MyTurnCA.get_availability')
+    @patch('app.src.myTurnCA.MyTurnCA.get_slots')
+    def test_iter_appointments_as_resolved(self, get_slots, get_availability):
+        """Tests that streamed appointments are yielded in the order locations finish and that closing the
+        generator early stops fetching slots for the remaining locations"""
+        locations = [Location(location_id=str(i), name=str(i), booking_type='', vaccine_data='', distance=i, address='')
+                     for i in range(0, 5)]
+
+        # each location's availability only resolves once the test releases it
+        released = [threading.Event() for _ in locations]
+        finished = [threading.Event() for _ in locations]
+
+        def availability(location, start_date, end_date):
+            index = int(location.location_id)
+            if not released[index].wait(timeout=5):
+                raise AssertionError(f'location {index} was never released')
+            finished[index].set()
+            return LocationAvailability(location=location, dates_available=[end_date, start_date])
+
+        get_availability.side_effect = availability
+        get_slots.side_effect = lambda location, start_date: LocationAvailabilitySlots(location=location,
+                                                                                      slots=[slot_at(start_date)])
+        appointments = self.my_turn_ca.iter_appointments_for_locations(locations, self.today,
+                                                                       self.today + timedelta(days=1))
+        released[4].set()
+        first = next(appointments)
+        appointments.close()
+        # the other locations resolve after the generator was closed, so their slots are never fetched
+        for index in range(0, 4):
+            released[index].set()
+            self.assertTrue(finished[index].wait(timeout=5))
+
+        self.assertEqual(first.location, locations[4])
+        self.assertEqual(first.slots, [slot_at(self.today), slot_at(self.today + timedelta(days=1))])
+        self.assertEqual(get_slots.call_count, 2)
+
+
+class AsyncMyTurnCATest(IsolatedAsyncioTestCase):
+    """Unit tests for the asyncio API class"""
+    def setUp(self):
+        self.my_turn_ca = AsyncMyTurnCA(api_key=TEST_API_KEY)
+        self.my_turn_ca.vaccine_data = MOCK_VACCINE_DATA
+        self.today = datetime.now(tz=pytz.timezone('US/Pacific')).date()
+
+    async def asyncTearDown(self):
+        await self.my_turn_ca.close()
+
+    @patch('app.src.myTurnCA.AsyncMyTurnCA._send_request', AsyncMock(return_value=BAD_JSON_RESPONSE))
+    async def test_no_locations_on_decode_error(self):
+        """Tests that no locations are returned given a non-JSON response"""
+        self.assertEqual(await self.my_turn_ca.get_locations(1, 2), [])
+
+    @patch('app.src.myTurnCA.AsyncMyTurnCA._send_request',
+           AsyncMock(return_value=json.dumps(NON_EMPTY_LOCATION_RESPONSE)))
+    async def test_locations_found(self):
+        """Tests that locations are properly returned given non-empty response"""
+        self.assertEqual(await self.my_turn_ca.get_locations(1, 2), [TEST_LOCATION for _ in range(0, 3)])
+
+    @patch('app.src.myTurnCA.AsyncMyTurnCA._fetch_vaccine_data', AsyncMock(return_value='FRESH_VACCINE_DATA'))
+    async def test_locations_searched_again_with_fresh_vaccine_data(self):
+        """Tests that a location search rejecting the vaccine data is retried once with freshly fetched vaccine
+        data instead of failing"""
+        def send(url, body):
+            if body['vaccineData'] == MOCK_VACCINE_DATA:
+                self.my_turn_ca.vaccine_data_cache.expire(body['vaccineData'])
+                raise VaccineDataRejected
+            return json.dumps(NON_EMPTY_LOCATION_RESPONSE)
+
+        send_request = AsyncMock(side_effect=send)
+        with patch('app.src.myTurnCA.AsyncMyTurnCA._send_request', send_request):
+            self.assertEqual(await self.my_turn_ca.get_locations(1, 2), [TEST_LOCATION for _ in range(0, 3)])
+        self.assertEqual([call[1]['body']['vaccineData'] for call in send_request.call_args_list],
+                         [MOCK_VACCINE_DATA, 'FRESH_VACCINE_DATA'])
+
+    async def test_concurrent_rejected_searches_share_refresh(self):
+        """Tests that searches rejected at the same time all wait on a single vaccine data refresh and are retried
+        with its result"""
+        async def fetch_vaccine_data():
+            # slow enough for the other searches to find the refresh in progress
+            await asyncio.sleep(0.05)
+            return 'FRESH_VACCINE_DATA'
+
+        def send(url, body):
+            if body['vaccineData'] == MOCK_VACCINE_DATA:
+                self.my_turn_ca.vaccine_data_cache.expire(body['vaccineData'])
+                raise VaccineDataRejected
+            return json.dumps(NON_EMPTY_LOCATION_RESPONSE)
+
+        fetch = AsyncMock(side_effect=fetch_vaccine_data)
+        with patch('app.src.myTurnCA.AsyncMyTurnCA._send_request', AsyncMock(side_effect=send)), \
+                patch('app.src.myTurnCA.AsyncMyTurnCA._fetch_vaccine_data', fetch):
+            results = await asyncio.gather(*[self.my_turn_ca.get_locations(i, i) for i in range(0, 3)])
+        self.assertEqual(results, [[TEST_LOCATION for _ in range(0, 3)] for _ in range(0, 3)])
+        fetch.assert_awaited_once()
+
+    @patch('app.src.myTurnCA.AsyncMyTurnCA._send_request',
+           AsyncMock(return_value=json.dumps(MIXED_LOCATION_AVAILABILITY_RESPONSE)))
+    async def test_availability_given_mixed_dates(self):
+        """Tests that unavailable dates are properly filtered out and available dates are returned"""
+        self.assertEqual(await self.my_turn_ca.get_availability(TEST_LOCATION, self.today, self.today),
+                         LocationAvailability(location=TEST_LOCATION,
+                                              dates_available=[datetime.strptime(x['date'], '%Y-%m-%d').date()
+                                                               for x in MIXED_LOCATION_AVAILABILITY_RESPONSE['availability'] if x['available']]))
+
+    @patch('app.src.myTurnCA.AsyncMyTurnCA.get_availability')
+    @patch('app.src.myTurnCA.AsyncMyTurnCA.get_slots')
+    async def test_appointments_preserve_location_order(self, get_slots, get_availability):
+        """Tests that appointments gathered concurrently are returned in the same order as the locations"""
+        locations = [Location(location_id=str(i), name=str(i), booking_type='', vaccine_data='', distance=i, address='')
+                     for i in range(0, 5)]
+
+        async def availability(location, start_date, end_date):
+            # makes the first locations finish last
+            await asyncio.sleep(0.01 * (len(locations) - int(location.location_id)))
+            return LocationAvailability(location=location,
+                                        dates_available=[start_date] if int(location.location_id) % 2 else [])
+
+        get_availability.side_effect = availability
+        get_slots.side_effect = AsyncMock(side_effect=lambda location, start_date:
+                                          LocationAvailabilitySlots(location=location, slots=[slot_at(start_date)]))
+        with patch('app.src.myTurnCA.AsyncMyTurnCA.get_locations', AsyncMock(return_value=locations)):
+            appointments = await self.my_turn_ca.get_appointments(1, 2, self.today, self.today)
+
+        self.assertEqual(appointments, [LocationAvailabilitySlots(location=location, slots=[slot_at(self.today)])
+                                        for location in locations if int(location.location_id) % 2])
+
+    @patch('app.src.myTurnCA.AsyncMyTurnCA.get_availability')
+    @patch('app.src.myTurnCA.AsyncMyTurnCA.get_slots')
+    async def test_iter_appointments_as_resolved(self, get_slots, get_availability):
+        """Tests that streamed appointments are yielded in the order locations finish and that closing the
+        generator early cancels the outstanding locations"""
+        locations = [Location(location_id=str(i), name=str(i), booking_type='', vaccine_data='', distance=i, address='')
+                     for i in range(0, 5)]
+        # each location's availability only resolves once the test releases it
+        released = [asyncio.Event() for _ in locations]
+        cancelled = []
+        all_cancelled = asyncio.Event()
+
+        async def availability(location, start_date, end_date):
+            try:
+                await released[int(location.location_id)].wait()
+            except asyncio.CancelledError:
+                cancelled.append(location)
+                if len(cancelled) == 3:
+                    all_cancelled.set()
+                raise
+            return LocationAvailability(location=location, dates_available=[start_date])
+
+        get_availability.side_effect = availability
+        get_slots.side_effect = AsyncMock(side_effect=lambda location, start_date:
+                                          LocationAvailabilitySlots(location=location, slots=[slot_at(start_date)]))
+        with patch('app.src.myTurnCA.AsyncMyTurnCA.get_locations', AsyncMock(return_value=locations)):
+            appointments = self.my_turn_ca.iter_appointments(1, 2, self.today, self.today)
+            released[4].set()
+            streamed = [await appointments.__anext__()]
+            released[3].set()
+            streamed.append(await appointments.__anext__())
+            await appointments.aclose()
+        await asyncio.wait_for(all_cancelled.wait(), timeout=5)
+
+        self.assertEqual([appointment.location for appointment in streamed], [locations[4], locations[3]])
+        self.assertEqual(sorted(cancelled, key=lambda location: location.location_id), locations[:3])
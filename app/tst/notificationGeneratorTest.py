@@ -0,0 +1,174 @@
+"""Unit tests for NotificationGenerator"""
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import pytz
+
+from ..src.myTurnCA import Location, LocationAvailability, LocationAvailabilitySlots
+from ..src.notificationGenerator import NotificationGenerator
+
+
+def make_location(location_id: str) -> Location:
+    """Helper method to build a location with the given id"""
+    return Location(location_id=location_id, name=location_id, booking_type='TYPE', vaccine_data='VACCINE_DATA',
+                    distance=1.0, address='ADDRESS')
+
+
+class NotificationGeneratorTest(TestCase):
+    """Main unit test class"""
+    @patch('app.src.notificationGenerator.pymongo.MongoClient')
+    def setUp(self, _):
+        self.slot = datetime.now(tz=pytz.timezone('US/Pacific')) + timedelta(days=1)
+        self.my_turn_ca = MagicMock(location_catalogue=None, error_rate=0.0)
+        self.my_turn_ca.get_availabilities.side_effect = lambda locations, start_date, end_date: \
+            [LocationAvailability(location=location, dates_available=[start_date]) for location in locations]
+        self.my_turn_ca.get_slots_for_dates.side_effect = lambda location_dates: \
+            [LocationAvailabilitySlots(location=location, slots=[self.slot]) for location, _ in location_dates]
+        self.generator = NotificationGenerator(mongodb_user='USER', mongodb_password='PASSWORD', mongodb_host='HOST',
+                                               mongodb_port='PORT', my_turn_api_key='API_KEY',
+                                               my_turn_ca=self.my_turn_ca)
+        self.notifications = self.generator.mongodb.my_turn_ca.notifications
+
+    def set_pending(self, subscriber_counts):
+        """Helper method to set the zip code -> subscriber counts returned by the notifications aggregation"""
+        self.notifications.aggregate.return_value = [{'_id': zip_code, 'subscribers': subscribers}
+                                                     for zip_code, subscribers in subscriber_counts.items()]
+
+    def polled_zip_codes(self):
+        """Helper method to return the zip codes that got their notifications updated, in order"""
+        return [call[0][0]['zip_code'] for call in self.notifications.update_many.call_args_list]
+
+    def test_scheduler_tick_picks_up_subscription_changes(self):
+        """Tests that each tick polls new zip codes and stops tracking canceled ones without a restart"""
+        self.my_turn_ca.get_locations_for_coordinates.side_effect = lambda coordinates: \
+            [[make_location('a')] for _ in coordinates]
+        self.set_pending({94103: 1})
+        self.generator.run_scheduler_tick()
+        self.assertEqual(self.polled_zip_codes(), [94103])
+
+        # 94103 was just polled so it isn't due again yet, 90001 is new and 94103 was canceled
+        self.set_pending({90001: 2})
+        self.generator.run_scheduler_tick()
+        self.assertEqual(self.polled_zip_codes(), [94103, 90001])
+        self.assertEqual(list(self.generator.poll_scheduler.schedules), [90001])
+
+        self.set_pending({90001: 2})
+        self.generator.run_scheduler_tick()
+        self.assertEqual(self.polled_zip_codes(), [94103, 90001])
+
+    def test_scheduler_tick_without_location_catalogue(self):
+        """Tests that a MyTurnCA without a location catalogue is polled without errors"""
+        self.my_turn_ca.get_locations_for_coordinates.return_value = [[]]
+        self.set_pending({94103: 1})
+        with patch.object(self.generator.logger, 'error') as error:
+            self.generator.run_scheduler_tick()
+        error.assert_not_called()
+        self.my_turn_ca.get_locations_for_coordinates.assert_called_once()
+        self.my_turn_ca.refresh_location_catalogue.assert_not_called()
+
+    def test_scheduler_tick_refreshes_stale_location_catalogue(self):
+        """Tests that a location catalogue that's due is refreshed in the background while zip codes are polled"""
+        self.my_turn_ca.location_catalogue = MagicMock(refreshing=False)
+        self.my_turn_ca.location_catalogue.needs_refresh.return_value = True
+        self.my_turn_ca.get_locations_for_coordinates.return_value = [[]]
+        self.set_pending({94103: 1})
+        self.generator.run_scheduler_tick()
+        self.generator.location_catalogue_refresh.join()
+        self.my_turn_ca.refresh_location_catalogue.assert_called_once()
+        self.my_turn_ca.get_locations_for_coordinates.assert_called_once()
+
+    def test_scheduler_tick_skips_location_catalogue_not_due(self):
+        """Tests that a location catalogue that isn't due or is already being refreshed isn't refreshed again"""
+        self.my_turn_ca.location_catalogue = MagicMock(refreshing=False)
+        self.my_turn_ca.location_catalogue.needs_refresh.return_value = False
+        self.my_turn_ca.get_locations_for_coordinates.return_value = [[]]
+        self.set_pending({94103: 1})
+        self.generator.run_scheduler_tick()
+        self.my_turn_ca.location_catalogue.refreshing = True
+        self.my_turn_ca.location_catalogue.needs_refresh.return_value = True
+        self.generator.run_scheduler_tick()
+        self.assertIsNone(self.generator.location_catalogue_refresh)
+        self.my_turn_ca.refresh_location_catalogue.assert_not_called()
+
+    def test_shared_locations_fetched_once(self):
+        """Tests that a location near several zip codes only has its availability and slots fetched once"""
+        shared, only_94103, only_94110 = make_location('shared'), make_location('94103'), make_location('94110')
+        self.my_turn_ca.get_locations_for_coordinates.return_value = [[only_94103, shared], [shared, only_94110]]
+        self.generator.poll_zip_codes([94103, 94110])
+
+        self.assertEqual(self.my_turn_ca.get_availabilities.call_args[1]['locations'],
+                         [only_94103, shared, only_94110])
+        self.assertEqual([location for location, _ in self.my_turn_ca.get_slots_for_dates.call_args[0][0]],
+                         [only_94103, shared, only_94110])
+        self.assertEqual(self.generator.location_subscribers['shared'], [(94103, shared), (94110, shared)])
+
+    def test_appointments_fanned_out_to_every_subscribed_zip_code(self):
+        """Tests that appointments at a shared location are published to every zip code near it, each with
+        its own distance and closest location first"""
+        shared_from_94103 = Location(location_id='shared', name='shared', booking_type='TYPE',
+                                     vaccine_data='VACCINE_DATA', distance=5000.0, address='ADDRESS')
+        shared_from_94110 = Location(location_id='shared', name='shared', booking_type='TYPE',
+                                     vaccine_data='VACCINE_DATA', distance=1000.0, address='ADDRESS')
+        only_94110 = Location(location_id='94110', name='94110', booking_type='TYPE', vaccine_data='VACCINE_DATA',
+                              distance=2000.0, address='ADDRESS')
+        self.my_turn_ca.get_locations_for_coordinates.return_value = [[shared_from_94103],
+                                                                      [only_94110, shared_from_94110]]
+        self.assertEqual(self.generator.poll_zip_codes([94103, 94110]), [94103, 94110])
+
+        messages = {call[0][0]['zip_code']: call[0][1]['$set']['message']
+                    for call in self.notifications.update_many.call_args_list}
+        self.assertIn(str(shared_from_94103), messages[94103])
+        self.assertNotIn('94110', messages[94103])
+        self.assertLess(messages[94110].index(str(shared_from_94110)), messages[94110].index(str(only_94110)))
+
+    def test_zip_code_polled_through_availability_tracker(self):
+        """Tests that a single zip code is polled closest location first through the availability tracker, so
+        slots it already fetched aren't fetched again"""
+        near = Location(location_id='near', name='near', booking_type='TYPE', vaccine_data='VACCINE_DATA',
+                        distance=1000.0, address='ADDRESS')
+        far = Location(location_id='far', name='far', booking_type='TYPE', vaccine_data='VACCINE_DATA',
+                       distance=5000.0, address='ADDRESS')
+        self.my_turn_ca.get_locations.return_value = [far, near]
+        self.assertTrue(self.generator.poll_zip_code(94103))
+        self.assertTrue(self.generator.poll_zip_code(94103))
+
+        self.my_turn_ca.iter_appointments_for_locations.assert_not_called()
+        self.assertEqual(self.my_turn_ca.get_availabilities.call_args[1]['locations'], [near, far])
+        self.my_turn_ca.get_slots_for_dates.assert_called_with([])
+        message = self.notifications.update_many.call_args[0][1]['$set']['message']
+        self.assertLess(message.index(str(near)), message.index(str(far)))
+
+    def test_generate_notification_tracks_subscribers(self):
+        """Tests that a per-zip code poll is scheduled with the zip code's current subscriber count"""
+        self.notifications.count_documents.side_effect = [5, 2]
+        subscribers = []
+
+        def poll_zip_code(zip_code):
+            subscribers.append(self.generator.poll_scheduler.schedules[zip_code].subscribers)
+            return len(subscribers) == 2
+
+        with patch.object(self.generator, 'poll_zip_code', side_effect=poll_zip_code), \
+                patch('app.src.notificationGenerator.time.sleep'):
+            self.generator.generate_notification(94103)
+        self.assertEqual(subscribers, [5, 2])
+        self.notifications.count_documents.assert_called_with({'zip_code': 94103, 'message': {'$exists': False}})
+
+    def test_generate_notification_stops_without_subscribers(self):
+        """Tests that a per-zip code poll stops once every request for the zip code has been canceled"""
+        self.notifications.count_documents.side_effect = [1, 0]
+        with patch.object(self.generator, 'poll_zip_code', return_value=False) as poll_zip_code, \
+                patch('app.src.notificationGenerator.time.sleep'):
+            self.generator.generate_notification(94103)
+        poll_zip_code.assert_called_once_with(94103)
+
+    def test_import_does_not_load_discord(self):
+        """Tests that the workers can import the notification generator without loading discord"""
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        result = subprocess.run([sys.executable, '-c', 'import sys, app.src.notificationGenerator; '
+                                                       'print(sorted({"discord", "aiohttp"} & set(sys.modules)))'],
+                                cwd=root, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), '[]')
@@ -0,0 +1,58 @@
+"""Unit tests for PollScheduler"""
+from unittest import TestCase
+
+from ..src.constants import NOTIFICATION_WAIT_PERIOD, POLL_COLD_FACTOR, POLL_HOT_FACTOR, \
+    POLL_ERROR_FACTOR
+from ..src.pollScheduler import PollScheduler
+
+
+class PollSchedulerTest(TestCase):
+    """Main unit test class"""
+    def setUp(self):
+        self.now = 0
+        self.scheduler = PollScheduler(timer=lambda: self.now, jitter=lambda: 0.5)
+
+    def test_update(self):
+        """Tests that new zip codes are due immediately and zip codes without subscribers are dropped"""
+        self.scheduler.update({90001: 1, 90002: 1})
+        self.assertEqual(sorted(self.scheduler.due()), [90001, 90002])
+        self.scheduler.update({90002: 3})
+        self.assertEqual(self.scheduler.due(), [90002])
+        self.assertEqual(self.scheduler.schedules[90002].subscribers, 3)
+
+    def test_record_poll(self):
+        """Tests that polled zip codes aren't due again until their delay has passed"""
+        self.scheduler.update({90001: 1})
+        self.scheduler.record_poll(zip_code_location_ids={90001: ['a']}, available_location_ids=set(), error_rate=0)
+        self.assertEqual(self.scheduler.due(), [])
+        self.assertEqual(self.scheduler.seconds_until_next_poll(), NOTIFICATION_WAIT_PERIOD * POLL_COLD_FACTOR)
+        self.now = NOTIFICATION_WAIT_PERIOD * POLL_COLD_FACTOR
+        self.assertEqual(self.scheduler.due(), [90001])
+
+    def test_next_delay(self):
+        """Tests that subscribers and recent availability shorten the delay while errors lengthen it"""
+        self.scheduler.update({90001: 1, 90002: 4})
+        self.scheduler.record_poll(zip_code_location_ids={90001: ['a'], 90002: ['b']},
+                                   available_location_ids={'a'}, error_rate=0)
+        self.assertEqual(self.scheduler.schedules[90001].next_poll_at, NOTIFICATION_WAIT_PERIOD * POLL_HOT_FACTOR)
+        self.assertAlmostEqual(self.scheduler.schedules[90002].next_poll_at,
+                               NOTIFICATION_WAIT_PERIOD / 3 * POLL_COLD_FACTOR)
+
+        self.scheduler.record_poll(zip_code_location_ids={90002: ['b']}, available_location_ids=set(), error_rate=1)
+        self.assertAlmostEqual(self.scheduler.schedules[90002].next_poll_at,
+                               NOTIFICATION_WAIT_PERIOD / 3 * POLL_COLD_FACTOR * (1 + POLL_ERROR_FACTOR))
+
+    def test_jitter(self):
+        """Tests that jitter spreads out zip codes that would otherwise be polled together"""
+        jitter = iter([0, 1])
+        scheduler = PollScheduler(timer=lambda: 0, jitter=lambda: next(jitter))
+        scheduler.update({90001: 1, 90002: 1})
+        scheduler.record_poll(zip_code_location_ids={90001: [], 90002: []}, available_location_ids=set(), error_rate=0)
+        self.assertLess(scheduler.schedules[90001].next_poll_at, scheduler.schedules[90002].next_poll_at)
+
+    def test_delays(self):
+        """Tests that delays count down from each zip code's next poll and skip unscheduled zip codes"""
+        self.scheduler.update({90001: 1})
+        self.scheduler.record_poll(zip_code_location_ids={90001: []}, available_location_ids=set(), error_rate=0)
+        self.now = 10
+        self.assertEqual(self.scheduler.delays([90001, 90002]), {90001: NOTIFICATION_WAIT_PERIOD * POLL_COLD_FACTOR - 10})
@@ -0,0 +1,108 @@
+"""Unit tests for the rate limiter"""
+import asyncio
+import threading
+from unittest import TestCase, IsolatedAsyncioTestCase
+from unittest.mock import MagicMock
+
+from pymongo.errors import PyMongoError
+
+from ..src.rateLimiter import RateLimiter, RateLimitedRetry, endpoint_name
+
+
+class RateLimiterTest(TestCase):
+    """Main unit test class"""
+    def setUp(self):
+        self.now = 1000.0
+        self.rate_limiter = RateLimiter(quotas={'slots': (2, 2)}, timer=lambda: self.now)
+
+    def test_endpoint_name(self):
+        """Tests that urls and paths are mapped to their endpoint"""
+        self.assertEqual(endpoint_name('locations/search'), 'locations')
+        self.assertEqual(endpoint_name('/public/locations/ID/availability'), 'availability')
+        self.assertEqual(endpoint_name('locations/ID/date/2025-01-01/slots'), 'slots')
+        self.assertEqual(endpoint_name('eligibility'), 'eligibility')
+        self.assertIsNone(endpoint_name('something/else'))
+
+    def test_burst_then_wait(self):
+        """Tests that the burst is handed out immediately and then callers have to wait for tokens to refill"""
+        self.assertEqual(self.rate_limiter.try_acquire('slots'), 0)
+        self.assertEqual(self.rate_limiter.try_acquire('slots'), 0)
+        self.assertAlmostEqual(self.rate_limiter.try_acquire('slots'), 0.5)
+        self.now += 0.5
+        self.assertEqual(self.rate_limiter.try_acquire('slots'), 0)
+
+    def test_unlimited_endpoint(self):
+        """Tests that endpoints without a quota are never limited"""
+        self.assertTrue(all(self.rate_limiter.try_acquire('locations') == 0 for _ in range(0, 100)))
+
+    def test_retry_after(self):
+        """Tests that Retry-After pauses the endpoint even if tokens are available"""
+        self.rate_limiter.retry_after('slots', 30)
+        self.assertAlmostEqual(self.rate_limiter.try_acquire('slots'), 30)
+        self.now += 30
+        self.assertEqual(self.rate_limiter.try_acquire('slots'), 0)
+
+    def test_retry_reports_retry_after(self):
+        """Tests that retried responses with Retry-After are shared with the rate limiter"""
+        rate_limiter = MagicMock()
+        retry = RateLimitedRetry(rate_limiter=rate_limiter, total=3, status_forcelist=[429])
+        response = MagicMock(status=429, headers={'Retry-After': '7'})
+        new_retry = retry.increment(method='POST', url='/public/locations/search', response=response)
+        rate_limiter.retry_after.assert_called_once_with('locations', 7)
+        self.assertIs(new_retry.rate_limiter, rate_limiter)
+        self.assertEqual(new_retry.endpoint, 'locations')
+        self.assertEqual(new_retry.total, 2)
+
+    def test_backend_failure_falls_back_to_process_share(self):
+        """Tests that requests keep going at this process' share of the quota while the backend can't be reached,
+        and that the backend is only tried again after the fallback period"""
+        backend = MagicMock()
+        backend.take.side_effect = PyMongoError('unreachable')
+        backend.block.side_effect = PyMongoError('unreachable')
+        rate_limiter = RateLimiter(backend=backend, quotas={'slots': (8, 8)}, fallback_share=0.25,
+                                   fallback_seconds=60, timer=lambda: self.now)
+        self.assertEqual(rate_limiter.try_acquire('slots'), 0)
+        self.assertEqual(rate_limiter.try_acquire('slots'), 0)
+        self.assertAlmostEqual(rate_limiter.try_acquire('slots'), 0.5)
+        rate_limiter.retry_after('slots', 5)
+        self.assertAlmostEqual(rate_limiter.try_acquire('slots'), 5)
+        backend.take.assert_called_once()
+        backend.block.assert_not_called()
+
+        self.now += 60
+        backend.take.side_effect = None
+        backend.take.return_value = 0.0
+        self.assertEqual(rate_limiter.try_acquire('slots'), 0)
+        self.assertEqual(backend.take.call_count, 2)
+
+
+class AsyncRateLimiterTest(IsolatedAsyncioTestCase):
+    """Unit tests for the async side of the rate limiter"""
+    def setUp(self):
+        self.taking = threading.Event()
+        self.released = threading.Event()
+        self.backend = MagicMock()
+        self.backend.take.side_effect = self.take
+        self.rate_limiter = RateLimiter(backend=self.backend, quotas={'slots': (2, 2)})
+
+    def take(self, **_) -> float:
+        """Helper method standing in for a blocking backend, only hands out a token once the test releases it"""
+        self.taking.set()
+        if not self.released.wait(timeout=5):
+            raise AssertionError('the event loop was blocked while a token was being taken')
+        return 0.0
+
+    async def test_acquire_async_doesnt_block_loop(self):
+        """Tests that the event loop keeps running while the backend is taking a token"""
+        acquire = asyncio.create_task(self.rate_limiter.acquire_async('slots'))
+        while not self.taking.is_set():
+            await asyncio.sleep(0)
+        self.assertFalse(acquire.done())
+        self.released.set()
+        await acquire
+        self.backend.take.assert_called_once()
+
+    async def test_acquire_async_unlimited_endpoint(self):
+        """Tests that endpoints without a quota don't touch the backend"""
+        await self.rate_limiter.acquire_async('locations')
+        self.backend.take.assert_not_called()
@@ -0,0 +1,122 @@
+"""Unit tests for request coalescing"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from unittest import TestCase, IsolatedAsyncioTestCase
+from unittest.mock import MagicMock, patch
+
+from ..src.myTurnCA import MyTurnCA
+from ..src.singleFlight import SingleFlight, AsyncSingleFlight
+from .constants import MOCK_VACCINE_DATA, TEST_API_KEY, TEST_LOCATION, AVAILABLE_LOCATION_AVAILABILITY_RESPONSE
+
+
+class SingleFlightTest(TestCase):
+    """Main unit test class"""
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def slow(self, result):
+        """Helper method that blocks until released"""
+        self.started.set()
+        self.release.wait(timeout=5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def test_coalesces_concurrent_calls(self):
+        """Tests that callers arriving while a call is in flight share its result"""
+        func = MagicMock(side_effect=lambda: self.slow('value'))
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            leader = executor.submit(self.single_flight.do, 'key', func)
+            self.started.wait(timeout=5)
+            followers = [executor.submit(self.single_flight.do, 'key', func) for _ in range(3)]
+            while self.single_flight.calls < 4:
+                time.sleep(0.001)
+            self.release.set()
+            self.assertEqual([future.result() for future in [leader] + followers], ['value'] * 4)
+
+        func.assert_called_once()
+        self.assertEqual(self.single_flight.coalesced, 3)
+        self.assertEqual(len(self.single_flight), 0)
+
+    def test_shares_exceptions(self):
+        """Tests that followers get the leader's exception and the key can be retried afterwards"""
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(self.single_flight.do, 'key', lambda: self.slow(ValueError()))
+            self.started.wait(timeout=5)
+            follower = executor.submit(self.single_flight.do, 'key', MagicMock())
+            while self.single_flight.calls < 2:
+                time.sleep(0.001)
+            self.release.set()
+            self.assertRaises(ValueError, leader.result)
+            self.assertRaises(ValueError, follower.result)
+
+        self.assertEqual(self.single_flight.do('key', lambda: 'retried'), 'retried')
+
+    def test_different_keys(self):
+        """Tests that calls with different keys aren't coalesced"""
+        self.assertEqual([self.single_flight.do(key, lambda: key) for key in ['a', 'b']], ['a', 'b'])
+        self.assertEqual(self.single_flight.coalesced, 0)
+
+    @patch('app.src.myTurnCA.MyTurnCA._get_vaccine_data', MagicMock(return_value=MOCK_VACCINE_DATA))
+    def test_my_turn_ca_coalesces_availability(self):
+        """Tests that concurrent availability lookups for the same location send a single request"""
+        my_turn_ca = MyTurnCA(api_key=TEST_API_KEY)
+        today = date.today()
+        response = MagicMock()
+        response.json.return_value = AVAILABLE_LOCATION_AVAILABILITY_RESPONSE
+
+        def send_request(url, body):
+            self.slow(None)
+            return response
+
+        with patch.object(my_turn_ca, '_send_request', MagicMock(side_effect=send_request)) as mock_send_request, \
+                ThreadPoolExecutor(max_workers=3) as executor:
+            lookups = [executor.submit(my_turn_ca.get_availability, TEST_LOCATION, today, today) for _ in range(3)]
+            while my_turn_ca.single_flight.calls < 3:
+                time.sleep(0.001)
+            self.release.set()
+            availabilities = [lookup.result() for lookup in lookups]
+
+        mock_send_request.assert_called_once()
+        self.assertEqual(len(set(availabilities)), 1)
+
+
+class AsyncSingleFlightTest(IsolatedAsyncioTestCase):
+    """Unit tests for coalescing within an event loop"""
+    def setUp(self):
+        self.single_flight = AsyncSingleFlight()
+        self.calls = 0
+
+    async def slow(self):
+        """Helper method that counts its calls and takes a while"""
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return 'value'
+
+    async def test_coalesces_concurrent_calls(self):
+        """Tests that concurrent callers share a single call"""
+        results = await asyncio.gather(*[self.single_flight.do('key', self.slow) for _ in range(5)])
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual((self.calls, self.single_flight.coalesced, len(self.single_flight)), (1, 4, 0))
+
+    async def test_cancelling_one_caller(self):
+        """Tests that the shared call keeps running for the others when one caller is cancelled and is
+        cancelled once nobody is waiting on it anymore"""
+        first = asyncio.ensure_future(self.single_flight.do('key', self.slow))
+        second = asyncio.ensure_future(self.single_flight.do('key', self.slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertEqual(await second, 'value')
+
+        only = asyncio.ensure_future(self.single_flight.do('other', self.slow))
+        await asyncio.sleep(0)
+        only.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await only
+        await asyncio.sleep(0)
+        self.assertEqual(len(self.single_flight), 0)
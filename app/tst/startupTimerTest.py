@@ -0,0 +1,30 @@
+"""Unit tests for StartupTimer"""
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from ..src.startupTimer import StartupTimer
+
+
+class StartupTimerTest(TestCase):
+    """Main unit test class"""
+    def setUp(self):
+        self.now = 0
+        self.timer = StartupTimer(timer=lambda: self.now)
+
+    def test_phases(self):
+        """Tests that each phase runs from the end of the previous one"""
+        self.now = 1
+        self.timer.phase('imports')
+        self.now = 3.5
+        self.timer.phase('mongo client')
+        self.assertEqual(self.timer.phases, [('imports', 1), ('mongo client', 2.5)])
+
+    def test_report_once(self):
+        """Tests that the breakdown is only logged by the first report"""
+        logger = MagicMock()
+        self.now = 0.25
+        self.timer.phase('imports')
+        self.timer.report(logger)
+        self.timer.report(logger)
+        logger.info.assert_called_once_with('startup took 250ms - imports 250ms')
+        self.assertTrue(self.timer.reported)
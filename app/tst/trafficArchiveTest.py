@@ -0,0 +1,71 @@
+"""Unit tests for recording and replaying MyTurn API traffic"""
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import requests
+import responses
+
+from .constants import TEST_API_KEY, MOCK_VACCINE_DATA, NON_EMPTY_LOCATION_RESPONSE, TEST_LOCATION
+from ..src.constants import MY_TURN_URL, ELIGIBILITY_URL, LOCATIONS_URL
+from ..src.myTurnCA import MyTurnCA
+from ..src.trafficArchive import ReplayAdapter, load_archive
+
+
+class TrafficArchiveTest(TestCase):
+    """Main unit test class"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'traffic.jsonl.gz')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @responses.activate
+    def record(self):
+        """Helper method to record an eligibility request and a location search"""
+        responses.add(responses.POST, f'{MY_TURN_URL}{ELIGIBILITY_URL}',
+                      json={'eligible': True, 'vaccineData': MOCK_VACCINE_DATA})
+        responses.add(responses.POST, f'{MY_TURN_URL}{LOCATIONS_URL}', json=NON_EMPTY_LOCATION_RESPONSE)
+        my_turn_ca = MyTurnCA(api_key=TEST_API_KEY, record_to=self.path)
+        my_turn_ca.get_locations(1, 2)
+        my_turn_ca.close()
+
+    def test_record(self):
+        """Tests that every request and its response are written to the archive"""
+        self.record()
+        records = load_archive(self.path)
+        self.assertEqual([record['path'] for record in records],
+                         [f'/public/{ELIGIBILITY_URL}', f'/public/{LOCATIONS_URL}'])
+        self.assertEqual(records[1]['body']['location'], {'lat': 1, 'lng': 2})
+        self.assertEqual(records[1]['status'], 200)
+
+    def test_replay(self):
+        """Tests that recorded responses are served back without reaching the network"""
+        self.record()
+        my_turn_ca = MyTurnCA(api_key=TEST_API_KEY, cache_ttl=0, replay_from=self.path)
+        self.assertEqual(my_turn_ca.vaccine_data, MOCK_VACCINE_DATA)
+        self.assertEqual(my_turn_ca.get_locations(1, 2), [TEST_LOCATION for _ in range(0, 3)])
+        # falls back to the responses recorded for the same endpoint
+        self.assertEqual(my_turn_ca.get_locations(3, 4), [TEST_LOCATION for _ in range(0, 3)])
+
+    @patch('app.src.trafficArchive.time')
+    def test_realtime_replay_keeps_recorded_pacing(self, time):
+        """Tests that realtime replays wait until each response's recorded time, and never less than it took"""
+        now = [100.0]
+        adapter = ReplayAdapter([{'offset': 5.0, 'elapsed': 0.5, 'method': 'POST', 'path': '/a', 'body': None,
+                                  'status': 200, 'headers': {}, 'content': ''},
+                                 {'offset': 15.0, 'elapsed': 1.0, 'method': 'POST', 'path': '/b', 'body': None,
+                                  'status': 200, 'headers': {}, 'content': ''}],
+                                realtime=True, timer=lambda: now[0])
+        session = requests.Session()
+        session.mount('http://', adapter)
+
+        session.post('http://host/a')
+        now[0] = 102.0
+        session.post('http://host/b')
+        # /b was received 11 seconds into the recording
+        now[0] = 120.0
+        session.post('http://host/a')
+        self.assertEqual([call[0][0] for call in time.sleep.call_args_list], [0.5, 9.0, 0.5])
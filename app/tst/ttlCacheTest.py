@@ -0,0 +1,45 @@
+"""Unit tests for TTLCache"""
+from unittest import TestCase
+
+from ..src.ttlCache import TTLCache, MISSING
+
+
+class TTLCacheTest(TestCase):
+    """Main unit test class"""
+    def setUp(self):
+        self.now = 0
+        self.cache = TTLCache(ttl=10, max_size=2, timer=lambda: self.now)
+
+    def test_miss(self):
+        """Tests that a missing key is counted as a miss"""
+        self.assertIs(self.cache.get('key'), MISSING)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+
+    def test_hit(self):
+        """Tests that a stored key is returned and counted as a hit"""
+        self.cache.put('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 0))
+
+    def test_expiration(self):
+        """Tests that entries are dropped once their ttl has passed"""
+        self.cache.put('key', 'value')
+        self.now = 10
+        self.assertIs(self.cache.get('key'), MISSING)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        """Tests that the least recently used entry is evicted when the cache is full"""
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.get('a')
+        self.cache.put('c', 3)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIs(self.cache.get('b'), MISSING)
+        self.assertEqual(self.cache.get('c'), 3)
+
+    def test_disabled(self):
+        """Tests that nothing is stored when the ttl is 0"""
+        cache = TTLCache(ttl=0, max_size=2)
+        cache.put('key', 'value')
+        self.assertIs(cache.get('key'), MISSING)
@@ -0,0 +1,83 @@
+"""Unit tests for the vaccine data cache"""
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from pymongo.errors import ServerSelectionTimeoutError
+
+from ..src.apiExceptions import VaccineDataRejected
+from ..src.myTurnCA import MyTurnCA
+from ..src.vaccineDataCache import VaccineDataCache
+from .constants import TEST_API_KEY, MOCK_VACCINE_DATA
+
+
+class VaccineDataCacheTest(TestCase):
+    """Main unit test class"""
+    def setUp(self):
+        self.now = 1000.0
+        self.backend = MagicMock()
+        self.backend.load.return_value = None
+        self.cache = VaccineDataCache(backend=self.backend, ttl=100, refresh_ahead=10, timer=lambda: self.now)
+
+    def test_loads_from_backend(self):
+        """Tests that vaccine data stored by another process is used without fetching it"""
+        self.backend.load.return_value = ('shared', 990.0)
+        fetch = MagicMock()
+        self.cache.refresh(fetch)
+        self.assertEqual(self.cache.get(), 'shared')
+        fetch.assert_not_called()
+
+    def test_refresh_ahead(self):
+        """Tests that vaccine data needs refreshing once it's within the refresh-ahead window"""
+        self.cache.refresh(MagicMock(return_value='first'))
+        self.backend.store.assert_called_once_with(vaccine_data='first', fetched_at=1000.0)
+        self.now += 89
+        self.assertFalse(self.cache.needs_refresh())
+        self.now += 1
+        self.assertTrue(self.cache.needs_refresh())
+        self.cache.refresh(MagicMock(return_value='second'))
+        self.assertEqual(self.cache.get(), 'second')
+
+    def test_expire(self):
+        """Tests that only the rejected vaccine data is expired"""
+        self.cache.put('current')
+        self.cache.expire('older')
+        self.assertFalse(self.cache.needs_refresh())
+        self.cache.expire('current')
+        self.assertTrue(self.cache.needs_refresh())
+        self.assertEqual(self.cache.get(), 'current')
+        self.backend.expire.assert_called_once_with('current')
+
+    def test_failed_refresh_keeps_old_value(self):
+        """Tests that a failed refresh keeps serving the old value and lets the next caller retry"""
+        self.cache.put('old')
+        self.now += 100
+        with self.assertRaises(ValueError):
+            self.cache.refresh(MagicMock(side_effect=ValueError))
+        self.assertEqual(self.cache.get(), 'old')
+        self.assertFalse(self.cache.refreshing)
+
+    def test_backend_unavailable(self):
+        """Tests that the cache falls back to the in-process value when Mongo can't be reached"""
+        self.backend.load.side_effect = ServerSelectionTimeoutError()
+        self.backend.store.side_effect = ServerSelectionTimeoutError()
+        self.cache.refresh(MagicMock(return_value='local'))
+        self.assertEqual(self.cache.get(), 'local')
+
+    @patch('app.src.myTurnCA.MyTurnCA._get_vaccine_data')
+    def test_my_turn_ca_starts_from_cache(self, get_vaccine_data: MagicMock):
+        """Tests that MyTurnCA doesn't request vaccine data when it's already cached"""
+        self.cache.put(MOCK_VACCINE_DATA)
+        my_turn_ca = MyTurnCA(api_key=TEST_API_KEY, vaccine_data_cache=self.cache)
+        self.assertEqual(my_turn_ca.vaccine_data, MOCK_VACCINE_DATA)
+        get_vaccine_data.assert_not_called()
+
+    @patch('app.src.myTurnCA.MyTurnCA._get_vaccine_data', MagicMock(return_value=MOCK_VACCINE_DATA))
+    def test_my_turn_ca_expires_rejected_vaccine_data(self):
+        """Tests that a location search rejecting the vaccine data expires it"""
+        my_turn_ca = MyTurnCA(api_key=TEST_API_KEY, vaccine_data_cache=self.cache)
+        response = MagicMock(status_code=400, content=b'')
+        response.raw.retries = None
+        with patch.object(my_turn_ca.session, 'post', MagicMock(return_value=response)), \
+                self.assertRaises(VaccineDataRejected):
+            my_turn_ca._send_request(url='locations/search', body={'vaccineData': MOCK_VACCINE_DATA})
+        self.assertTrue(self.cache.needs_refresh())
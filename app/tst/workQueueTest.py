@@ -0,0 +1,50 @@
+"""Unit tests for WorkQueue"""
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from pymongo import DeleteMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from ..src.constants import DUPLICATE_KEY_ERROR_CODE
+from ..src.workQueue import WorkQueue
+
+
+class WorkQueueTest(TestCase):
+    """Main unit test class"""
+    def setUp(self):
+        self.collection = MagicMock()
+        self.queue = WorkQueue(self.collection, worker_id='worker', lease_seconds=30, timer=lambda: 100)
+
+    def test_claim(self):
+        """Tests that due tasks with expired leases are leased to this worker until none are left"""
+        self.collection.find_one_and_update.side_effect = [{'_id': 90001}, {'_id': 90002}, None]
+        self.assertEqual(self.queue.claim(5), [{'_id': 90001}, {'_id': 90002}])
+        query, update = self.collection.find_one_and_update.call_args[0]
+        self.assertEqual(query, {'next_poll_at': {'$lte': 100}, 'lease_expires_at': {'$lte': 100}})
+        self.assertEqual(update, {'$set': {'lease_owner': 'worker', 'lease_expires_at': 130}})
+
+    def test_claim_limit(self):
+        """Tests that no more than limit tasks are claimed"""
+        self.collection.find_one_and_update.return_value = {'_id': 90001}
+        self.assertEqual(len(self.queue.claim(3)), 3)
+        self.assertEqual(self.collection.find_one_and_update.call_count, 3)
+
+    def test_complete(self):
+        """Tests that only this worker's leases are released and rescheduled"""
+        self.queue.complete({90001: 200})
+        self.collection.bulk_write.assert_called_once_with(
+            [UpdateOne({'_id': 90001, 'lease_owner': 'worker'},
+                       {'$set': {'next_poll_at': 200, 'lease_owner': None, 'lease_expires_at': 0}})], ordered=False)
+
+    def test_sync(self):
+        """Tests that tasks are upserted for pending zip codes and removed for the rest"""
+        self.queue.sync({90001: 2})
+        requests = self.collection.bulk_write.call_args[0][0]
+        self.assertEqual(requests[-1], DeleteMany({'_id': {'$nin': [90001]}}))
+        self.assertEqual(len(requests), 2)
+
+    def test_sync_duplicate_key(self):
+        """Tests that losing an upsert race to another worker isn't an error"""
+        self.collection.bulk_write.side_effect = BulkWriteError(
+            {'writeErrors': [{'code': DUPLICATE_KEY_ERROR_CODE}]})
+        self.queue.sync({90001: 2})
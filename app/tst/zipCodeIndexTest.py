@@ -0,0 +1,31 @@
+"""Unit tests for ZipCodeIndex"""
+import os
+import tempfile
+from unittest import TestCase
+
+from ..src.zipCodeIndex import ZipCodeIndex
+
+
+class ZipCodeIndexTest(TestCase):
+    """Main unit test class"""
+    def test_bundled_index(self):
+        """Tests that the bundled index contains CA zip codes and nothing else"""
+        zip_code_index = ZipCodeIndex.load()
+        latitude, longitude = zip_code_index.lookup(94105)
+        self.assertAlmostEqual(latitude, 37.79, places=1)
+        self.assertAlmostEqual(longitude, -122.39, places=1)
+        self.assertFalse(zip_code_index.is_valid(10001))
+        self.assertFalse(zip_code_index.is_valid(99999))
+
+    def test_write_and_load(self):
+        """Tests that an index survives a round trip to disk"""
+        zip_codes = {90001: (33.5, -118.25), 90005: (34.0, -118.5)}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.bin')
+            ZipCodeIndex.write(path, zip_codes)
+            zip_code_index = ZipCodeIndex.load(path)
+
+        self.assertEqual(dict(zip_code_index.items()), zip_codes)
+        self.assertIsNone(zip_code_index.lookup(90002))
+        self.assertIsNone(zip_code_index.lookup(90000))
+        self.assertIsNone(zip_code_index.lookup(90006))